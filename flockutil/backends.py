@@ -0,0 +1,158 @@
+"""
+Renderer backends.
+
+A backend renders frames of a genome, given as (index, time) pairs, yielding
+an object with 'idx', 'buf' (float RGBA in [0, 1], height by width by 4) and
+'gpu_time' (in ms) for each, in order. The 'cuda' backend is cuburn's
+renderer. The 'cpu' backend is a stand-in which needs neither a GPU nor
+pycuda: it runs a short chaos game over the genome's xforms, using only their
+affine transforms, density and color, and tone-maps the result with the
+genome's palette. It is nothing like a real render in quality, but its frames
+follow the genome, are the same from run to run, and cost time in proportion
+to the frame size, so the rest of the pipeline (writing, logging, comparing
+and encoding frames) can be run and benchmarked on any machine.
+
+The backend is chosen by '--backend' (or the key "backend" in .flockrc),
+then by the 'backend' item of the profile, and is 'cuda' otherwise.
+"""
+
+import time
+from collections import namedtuple
+import numpy as np
+
+from splines import SplineBatch
+
+DEFAULT_BACKEND = 'cuda'
+
+RenderOutput = namedtuple('RenderOutput', 'idx buf gpu_time')
+
+class CudaBackend(object):
+    name = 'cuda'
+
+    def __init__(self):
+        import pycuda.autoinit
+        from cuburn import render
+        self.device = pycuda.autoinit.device.name()
+        self.renderer = render.Renderer()
+
+    def render(self, gnm, rt, width, height):
+        return self.renderer.render(gnm, rt, width, height)
+
+class CpuBackend(object):
+    name = 'cpu'
+    device = 'cpu'
+
+    # Points traced per pixel, and iterations of the chaos game per point.
+    DENSITY = 0.125
+    ITERATIONS = 16
+
+    def __init__(self, seed=0):
+        self.seed = seed
+
+    @staticmethod
+    def affines(at, keys):
+        """Return the 2x3 affine matrix of each xform in 'keys'."""
+        val = lambda *path: float(at[path][0]) if path in at else 0.
+        mats = []
+        for k in keys:
+            a = np.radians(val(k, 'affine', 'angle'))
+            s = np.radians(val(k, 'affine', 'spread'))
+            mx = val(k, 'affine', 'magnitude', 'x')
+            my = val(k, 'affine', 'magnitude', 'y')
+            mats.append([[mx * np.cos(a - s), -my * np.sin(a + s),
+                          val(k, 'affine', 'offset', 'x')],
+                         [mx * np.sin(a - s), my * np.cos(a + s),
+                          val(k, 'affine', 'offset', 'y')]])
+        return np.array(mats).reshape(-1, 2, 3)
+
+    @staticmethod
+    def palette(gnm, t):
+        """
+        Return the palette at time 't' as a 256x3 array, blending between the
+        palettes named in 'palette_times', if there is more than one. As in
+        blend.get_palette, reference genomes give just the palette's index.
+        """
+        from cuburn.genome import palette_decode
+        get = lambda i: np.asarray(palette_decode(gnm['palettes'][int(i)]),
+                                   float)[:,:3]
+        pt = (gnm.get('color') or {}).get('palette_times')
+        if not pt:
+            return get(0)
+        if isinstance(pt, basestring):
+            return get(pt)
+        knots = zip(pt[::2], pt[1::2])
+        if len(knots) == 1:
+            return get(knots[0][1])
+        for (t0, i0), (t1, i1) in zip(knots, knots[1:]):
+            if t <= t1:
+                f = min(max((t - t0) / float(t1 - t0 or 1), 0), 1)
+                return get(i0) * (1 - f) + get(i1) * f
+        return get(knots[-1][1])
+
+    def frame(self, gnm, t, width, height):
+        """Render the frame of 'gnm' at time 't'."""
+        if isinstance(t, (tuple, list)):
+            t = (t[0] + t[-1]) / 2.
+        keys = sorted(k for k in gnm['xforms'] if k != 'final')
+        xfs = dict((k, gnm['xforms'][k]) for k in keys)
+        at = SplineBatch(xfs).lookup([t])
+        mats = self.affines(at, keys)
+        dens = np.array([abs(float(at[(k, 'density')][0]))
+                         if (k, 'density') in at else 0. for k in keys])
+        dens = dens / dens.sum() if dens.sum() else np.ones(len(keys))
+        dens /= dens.sum()
+        colors = np.array([float(at[(k, 'color')][0])
+                           if (k, 'color') in at else 0. for k in keys])
+
+        # The same seed every frame keeps consecutive frames alike
+        rng = np.random.RandomState(self.seed)
+        npts = max(1, int(width * height * self.DENSITY))
+        pts = rng.uniform(-1, 1, (npts, 2))
+        col = rng.uniform(0, 1, npts)
+        choice = rng.choice(len(keys), (self.ITERATIONS, npts), p=dens)
+        for xi in choice:
+            m = mats[xi]
+            x, y = pts[:,0], pts[:,1]
+            pts = np.column_stack((m[:,0,0] * x + m[:,0,1] * y + m[:,0,2],
+                                   m[:,1,0] * x + m[:,1,1] * y + m[:,1,2]))
+            # Keep expansive transforms from running off to infinity
+            np.clip(pts, -1e3, 1e3, pts)
+            col = (col + colors[xi]) / 2
+
+        # Fit the bulk of the attractor to the frame
+        lo, hi = np.percentile(pts, [1, 99], axis=0)
+        scale = 0.9 * min(width / max(hi[0] - lo[0], 1e-6),
+                          height / max(hi[1] - lo[1], 1e-6))
+        px = ((pts[:,0] - (lo[0] + hi[0]) / 2) * scale + width / 2)
+        py = ((pts[:,1] - (lo[1] + hi[1]) / 2) * scale + height / 2)
+        ok = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+        bins = py[ok].astype(int) * width + px[ok].astype(int)
+
+        pal = self.palette(gnm, t)
+        rgb = pal[np.clip((col[ok] * 255).astype(int), 0, 255)]
+        count = np.bincount(bins, minlength=width * height)
+        buf = np.zeros((height * width, 4), np.float32)
+        for c in range(3):
+            buf[:,c] = np.bincount(bins, rgb[:,c], width * height)
+        # Log-density tone mapping, as flames do
+        hit = count > 0
+        alpha = np.log1p(count[hit]) / np.log1p(max(count.max(), 1))
+        buf[hit,:3] *= (alpha / count[hit])[:,None]
+        buf[hit,3] = alpha
+        return buf.reshape(height, width, 4)
+
+    def render(self, gnm, rt, width, height):
+        for idx, t in rt:
+            start = time.time()
+            buf = self.frame(gnm, t, width, height)
+            yield RenderOutput(idx, buf, int((time.time() - start) * 1000))
+
+BACKENDS = {'cuda': CudaBackend, 'cpu': CpuBackend}
+
+def backend_name(prof, name=None):
+    """Return the name of the backend to use, as described above."""
+    name = name or prof.get('backend') or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError('Unknown renderer backend "%s" (choose from %s)' %
+                         (name, ', '.join(sorted(BACKENDS))))
+    return name
@@ -0,0 +1,345 @@
+#!/usr/bin/env python2
+"""
+Benchmarks for flockutil's CPU-bound paths, and for operations on a whole
+flock.
+
+Run as 'python -m flockutil.bench NAME [options]' from the top of a checkout.
+With '-o', results are also written as JSON, and with '-b', compared to those
+of an earlier run, so that regressions show up.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+from glob import glob
+from os.path import join
+from copy import deepcopy
+from cStringIO import StringIO
+import numpy as np
+
+# (name, values) for each result reported, in order.
+RESULTS = []
+
+def timeit(fn, reps, warmup=True):
+    """Call 'fn' 'reps' times, returning the mean and best time in ms."""
+    if warmup:
+        fn()
+    times = []
+    for i in range(reps):
+        start = time.time()
+        fn()
+        times.append((time.time() - start) * 1000)
+    return np.mean(times), np.min(times)
+
+def report(name, mean, best):
+    print '%-32s mean %8.2f ms   best %8.2f ms' % (name, mean, best)
+    RESULTS.append((name, dict(mean_ms=mean, best_ms=best)))
+
+def report_error(name, err):
+    err = str(err).split('\n')[0][:200]
+    print '%-32s failed: %s' % (name, err)
+    RESULTS.append((name, dict(error=err)))
+
+def bench_convert(args):
+    """Float-to-8-bit frame conversion and encoding, old path versus new."""
+    import scipy.misc
+    from output import FrameEncoder
+
+    rng = np.random.RandomState(0)
+    buf = rng.uniform(-0.1, 1.1, (args.height, args.width, 4))
+    buf = buf.astype(np.float32)
+    enc = FrameEncoder(quality=95)
+    denc = FrameEncoder(quality=95, dither=True)
+
+    def toimage():
+        return scipy.misc.toimage(buf[:,:,:3], cmin=0, cmax=1)
+    def encode(img):
+        img.save(StringIO(), 'JPEG', quality=95)
+    def fromarray(arr):
+        from PIL import Image
+        return Image.fromarray(arr, 'RGB')
+
+    ref = np.asarray(toimage())
+    if not np.array_equal(ref, enc.convert(buf)):
+        sys.exit('Converted frames differ from scipy.misc.toimage!')
+
+    print 'Frame size %dx%d, %d reps' % (args.width, args.height, args.reps)
+    report('convert (toimage)', *timeit(toimage, args.reps))
+    report('convert (FrameEncoder)',
+           *timeit(lambda: enc.convert(buf), args.reps))
+    report('convert (FrameEncoder, dither)',
+           *timeit(lambda: denc.convert(buf), args.reps))
+    report('convert+encode (toimage)',
+           *timeit(lambda: encode(toimage()), args.reps))
+    report('convert+encode (FrameEncoder)',
+           *timeit(lambda: encode(fromarray(enc.convert(buf))), args.reps))
+
+# Variations without parameters, so random xforms need only set weights
+VARIATIONS = ('linear', 'spherical', 'julia', 'swirl', 'sinusoidal', 'disc',
+              'heart', 'handkerchief', 'horseshoe', 'polar')
+
+def random_xform(rng):
+    """Return a random xform, with splines over [0, 1]."""
+    from cuburn.genome import SplEval
+    def spl(lo, hi):
+        return SplEval([0, rng.uniform(lo, hi), 1, rng.uniform(lo, hi)])
+    spread = 45 if rng.uniform() < 0.7 else -45
+    names = rng.choice(VARIATIONS, rng.randint(1, 4), replace=False)
+    return dict(color=spl(0, 1), color_speed=spl(0, 0.5),
+                opacity=SplEval(1), density=spl(0, 1),
+                affine=dict(angle=spl(-180, 180), spread=SplEval(spread),
+                            magnitude=dict(x=spl(0.2, 1), y=spl(0.2, 1)),
+                            offset=dict(x=spl(-1, 1), y=spl(-1, 1))),
+                variations=dict((str(n), dict(weight=spl(0, 1)))
+                                for n in names))
+
+def random_genome(rng, nxforms):
+    """Return a random genome, as far as aligning xforms is concerned."""
+    return dict(xforms=dict((str(i), random_xform(rng))
+                            for i in range(nxforms)))
+
+def alignment_cost(A, B):
+    """Return the total pairing cost of two aligned genomes."""
+    from blend import xform_features, pair_costs
+    keys = [k for k in A['xforms'] if k != 'final']
+    ax, bx = [[g['xforms'][k] for k in keys] for g in A, B]
+    names = sorted(set(sum([x['variations'].keys() for x in ax + bx], [])))
+    costs = pair_costs(xform_features(ax, 1, names),
+                       xform_features(bx, 0, names))
+    return np.trace(costs)
+
+def bench_align(args):
+    """Xform alignment of random genomes, by sorting and by assignment."""
+    from blend import align_xforms
+
+    rng = np.random.RandomState(0)
+    print '%d reps' % args.reps
+    for n in args.xforms or [8, 24, 48]:
+        # Sides of different sizes, so that some xforms are padded
+        A, B = random_genome(rng, n), random_genome(rng, n - n / 4)
+        report('copy (%d xforms)' % n,
+               *timeit(lambda: deepcopy((A, B)), args.reps))
+        for method in ('weightflip', 'optimal'):
+            def align():
+                a, b = deepcopy((A, B))
+                align_xforms(a, b, method)
+                return a, b
+            report('align %s (%d xforms)' % (method, n),
+                   *timeit(align, args.reps))
+            print '%-32s total cost %8.2f' % ('', alignment_cost(*align()))
+
+def bench_render(args):
+    """
+    The render pipeline, with the CPU backend standing in for the GPU:
+    rendering, writing and logging frames, then reading back the manifest and
+    comparing frames as 'update' does.
+    """
+    from cuburn.genome import palette_encode
+    from backends import CpuBackend
+    from output import FrameWriter, FrameManifest, frame_saver, read_log
+    from metrics import compare, load_frame
+    import framearray
+
+    rng = np.random.RandomState(0)
+    gnm = random_genome(rng, 6)
+    gnm['palettes'] = [palette_encode(rng.uniform(0, 1, (256, 4)))]
+    backend = CpuBackend()
+    prof = dict(output=dict(format=args.format))
+    save = frame_saver(prof)
+    if save.ext == 'raw':
+        topath = lambda odir, idx: os.path.join(odir, framearray.NAME)
+        load = lambda (odir, idx): framearray.FrameArray(
+                os.path.join(odir, framearray.NAME)).rgb(idx)
+    else:
+        topath = lambda odir, idx: os.path.join(odir, '%05d.%s' %
+                                                (idx, save.ext))
+        load = lambda (odir, idx): load_frame(topath(odir, idx))
+    rt = [(i, (i - 1) / float(args.reps)) for i in range(1, args.reps + 1)]
+
+    print 'Frame size %dx%d, %d frames, %s output' % (
+            args.width, args.height, args.reps, args.format)
+    report('render (cpu)', *timeit(
+        lambda: backend.frame(gnm, 0.5, args.width, args.height), args.reps))
+
+    odir = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        with FrameWriter(odir, topath, save) as writer:
+            for out in backend.render(gnm, rt, args.width, args.height):
+                writer.write(out.idx, out.buf[:,:,:3], out.gpu_time, 0)
+        took = time.time() - start
+        frames = read_log(odir)[1]
+        print '%-32s %8.2f frames/s' % ('render+write', len(frames) / took)
+        RESULTS.append(('render+write', dict(fps=len(frames) / took)))
+        report('encode (per frame)',
+               np.mean([f['encode_ms'] for f in frames]),
+               np.min([f['encode_ms'] for f in frames]))
+        report('load manifest', *timeit(
+            lambda: FrameManifest.load(odir, save=False), args.reps))
+        pairs = [((odir, i), (odir, i)) for i, t in rt[:8]]
+        report('compare %d frames (ssim)' % len(pairs), *timeit(
+            lambda: compare(pairs, load=load), max(1, args.reps / 4)))
+    finally:
+        shutil.rmtree(odir)
+
+class Quiet(object):
+    """Send standard output to /dev/null for the duration."""
+    def __enter__(self):
+        self.stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    def __exit__(self, *exc):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+def flock_command(**kwargs):
+    """Run a flock command quietly, given its parsed arguments."""
+    from flock import Flockutil
+    with Quiet():
+        Flockutil(argparse.Namespace(**kwargs))
+
+def bench_flock(args):
+    """
+    Operations on a whole synthetic flock (see synth.py): loading it, listing
+    and rating its edges, scanning its output directories, and blending its
+    managed edges.
+    """
+    import synth
+    from flock import Flock
+    from output import FrameManifest
+    from history import HISTORY_PATH
+    from blendcache import CACHE_DIR
+
+    params = dict(commits=args.commits, edges=args.edges,
+                  managed=args.managed, ratings=args.ratings,
+                  frames=args.frames)
+    root = args.dir or tempfile.mkdtemp()
+    keep = args.dir and os.path.isdir(root) and os.listdir(root)
+    if keep and not synth.is_synthetic(root):
+        # The benchmarks delete caches and blend into the flock
+        sys.exit('%s is not a synthetic flock made by a previous run; '
+                 'refusing to use it' % root)
+    cwd = os.getcwd()
+    try:
+        if keep:
+            print 'Using the flock in %s' % root
+        else:
+            start = time.time()
+            synth.create(root, **params)
+            took = time.time() - start
+            print 'Created %s in %.1f s' % (root, took)
+            RESULTS.append(('create', dict(seconds=took)))
+        os.chdir(root)
+
+        def cold_flock():
+            if os.path.isfile(HISTORY_PATH):
+                os.unlink(HISTORY_PATH)
+            return Flock()
+        report('flock (no history cache)', *timeit(cold_flock, args.reps))
+        report('flock', *timeit(Flock, args.reps))
+
+        flock = Flock()
+        edges = flock.edges.keys() + flock.managed.keys()
+        print '%d edges, %d managed, %d rated' % (len(flock.edges),
+                len(flock.managed), len(flock.ratings))
+        report('list_flock', *timeit(flock.list_flock, args.reps))
+        report('list_flock (thresh 3)', *timeit(
+            lambda: flock.list_flock(thresh=3), args.reps))
+        report('find_edge (every edge)', *timeit(
+            lambda: map(flock.find_edge, edges), args.reps))
+        report('get_rating (every edge)', *timeit(
+            lambda: map(flock.get_rating, edges), args.reps))
+
+        latest = sorted(glob(join('out', '*', '*', 'latest')))
+        RESULTS.append(('size', dict(edges=len(flock.edges),
+                                     managed=len(flock.managed),
+                                     rated=len(flock.ratings),
+                                     outputs=len(latest))))
+        def manifests(cold):
+            for d in latest:
+                if cold and os.path.isfile(join(d, FrameManifest.NAME)):
+                    os.unlink(join(d, FrameManifest.NAME))
+                FrameManifest.load(d)
+        print '%d output directories' % len(latest)
+        report('manifests (from logs)', *timeit(
+            lambda: manifests(True), args.reps))
+        report('manifests', *timeit(lambda: manifests(False), args.reps))
+        report('stats', *timeit(
+            lambda: flock_command(cmd='stats', profiles=None, thresh=0,
+                                  verbose=False), args.reps))
+
+        def blend():
+            shutil.rmtree(CACHE_DIR, ignore_errors=True)
+            flock_command(cmd='blend_all', procs=args.procs)
+        try:
+            # Blending everything is slow, so it's done just once
+            report('blend-all', *timeit(blend, 1, warmup=False))
+        except (Exception, SystemExit), e:
+            report_error('blend-all', e)
+    finally:
+        os.chdir(cwd)
+        if not args.dir:
+            shutil.rmtree(root)
+
+BENCHMARKS = dict(convert=bench_convert, align=bench_align,
+                  render=bench_render, flock=bench_flock)
+
+def save_results(path, args):
+    with open(path, 'w') as fp:
+        json.dump(dict(benchmark=args.name, time=round(time.time(), 3),
+                       host=socket.gethostname(), params=vars(args),
+                       results=dict(RESULTS)), fp, indent=2, sort_keys=True)
+        fp.write('\n')
+
+def compare_results(path):
+    """Print each timing as a ratio to the same result in a saved run."""
+    with open(path) as fp:
+        old = json.load(fp)['results']
+    print '\nCompared to %s:' % path
+    for name, vals in RESULTS:
+        was = old.get(name, {})
+        if 'mean_ms' in vals and was.get('mean_ms'):
+            ratio = vals['mean_ms'] / was['mean_ms']
+            print '%-32s %8.2f x  %s' % (name, ratio,
+                    'slower' if ratio > 1.2 else
+                    'faster' if ratio < 1 / 1.2 else '')
+
+def synth_default(key):
+    from synth import DEFAULTS
+    return DEFAULTS[key]
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a micro-benchmark.')
+    parser.add_argument('name', choices=sorted(BENCHMARKS))
+    parser.add_argument('-W', dest='width', type=int, default=1920)
+    parser.add_argument('-H', dest='height', type=int, default=1080)
+    parser.add_argument('-n', dest='reps', type=int, default=10)
+    parser.add_argument('-x', dest='xforms', type=int, action='append',
+            help='Number of xforms per genome for "align" (8, 24, 48)')
+    parser.add_argument('-f', dest='format', default='jpeg',
+            help='Output format for "render" (jpeg)')
+    parser.add_argument('-d', dest='dir',
+            help='Directory for the synthetic flock of "flock", which is '
+            'kept, and reused if an earlier run made it (a temporary one)')
+    parser.add_argument('-j', dest='procs', type=int,
+            help='Number of processes to blend with for "flock" (all cores)')
+    parser.add_argument('-o', dest='output',
+            help='Also write the results to this file, as JSON')
+    parser.add_argument('-b', dest='baseline',
+            help='Compare the results to those in this JSON file')
+    group = parser.add_argument_group('synthetic flock, for "flock"')
+    for key in ('commits', 'edges', 'managed', 'ratings', 'frames'):
+        group.add_argument('--' + key, type=int, default=synth_default(key),
+                help='(%d)' % synth_default(key))
+    args = parser.parse_args()
+    BENCHMARKS[args.name](args)
+    if args.output:
+        save_results(args.output, args)
+    if args.baseline:
+        compare_results(args.baseline)
+
+if __name__ == '__main__':
+    main()
@@ -5,11 +5,14 @@
 from copy import deepcopy
 import numpy as np
 from scipy.ndimage.filters import gaussian_filter1d
+from scipy.optimize import linear_sum_assignment
 
 from cuburn import genome
 from cuburn.genome import SplEval
 from cuburn.code.interp import Palette
 
+from splines import SplineBatch
+
 pad_arg = 'normal', 'flipped'
 
 normal_affine = dict(spread=45, magnitude={'x':1, 'y':1},
@@ -17,6 +20,23 @@ normal_affine = dict(spread=45, magnitude={'x':1, 'y':1},
 flipped_affine = dict(spread=-45, magnitude={'x':1, 'y':1},
                       angle=135, offset={'x':0, 'y':0})
 
+# Xform parameters compared by the 'optimal' alignment, and the weight of each
+# in the cost of pairing two xforms. Angles are compared as angles, scaled so
+# that opposite directions cost 1. The difference in variation weights is
+# weighted by VARIATION_COST.
+ALIGN_PARAMS = [
+    (('affine', 'angle'), 1.0),
+    (('affine', 'spread'), 1.0),
+    (('affine', 'magnitude', 'x'), 0.5),
+    (('affine', 'magnitude', 'y'), 0.5),
+    (('affine', 'offset', 'x'), 0.5),
+    (('affine', 'offset', 'y'), 0.5),
+    (('color',), 0.5),
+    (('density',), 1.0),
+]
+ALIGN_ANGLES = 2
+VARIATION_COST = 1.0
+
 def blend_genomes(left, right, nloops=2, align='weightflip', seed=None,
         stagger=False, blur=None, palflip=True):
     """
@@ -28,7 +48,9 @@ def blend_genomes(left, right, nloops=2, align='weightflip', seed=None,
     ``num_loops`` is the number of complete loops through which xforms will be
     rotated. Use at least two to avoid singularities and backwards rotations.
 
-    ``align`` changes the sort applied before aligning xforms.
+    ``align`` changes the sort applied before aligning xforms. With
+    'optimal', xforms are instead paired to minimize the total difference
+    between them (see ``assign_xforms``).
 
     ``seed`` is the seed for the random number generator. If not supplied, a
     hash of the combined xform name (from the ``info`` genome section, not
@@ -87,6 +109,13 @@ def blend_splines(A, B, nloops, rng, stagger=False):
     # dc = (da + db) * nloops / 2.0
     dc = float(nloops)
     scalea, scaleb = dc / da, dc / db
+    # Evaluate the ends of every spline in bulk, rather than one at a time
+    # B may have splines that A lacks, so pair the two sides up by path
+    ba, bb = SplineBatch(A), SplineBatch(B)
+    va, sa = ba([1])[:,0], ba([1], 1)[:,0]
+    vb, sb = bb([0])[:,0], bb([0], 1)[:,0]
+    ends = dict((p, (va[i], sa[i], vb[bb.index[p]], sb[bb.index[p]]))
+                for i, p in enumerate(ba.paths) if p in bb.index)
 
     def go(a, b, path=()):
         if isinstance(a, dict):
@@ -96,14 +125,16 @@ def blend_splines(A, B, nloops, rng, stagger=False):
                 e.args = path[-1:] + e.args
                 raise e
         elif isinstance(a, SplEval):
+            end = ends.get(path) if isinstance(b, SplEval) else None
             ik = lambda nl: blend_spline(a, b, scalea, scaleb, nloops=nl,
-                                         rng=rng, stagger=stagger)
+                                         rng=rng, stagger=stagger, ends=end)
             # interpolate a with b (it will exist)
             if path[-2:] == ('affine', 'angle'):
                 if path[-3] != 'final':
-                    if abs(a(1, 1)) < 1e-6 and abs(b(0, 1)) < 1e-6:
+                    sa, sb = end[1::2] if end else (a(1, 1), b(0, 1))
+                    if abs(sa) < 1e-6 and abs(sb) < 1e-6:
                         return ik(0)
-                    elif abs(a(1, 1)) < 1e-6 or abs(b(0, 1)) < 1e-6:
+                    elif abs(sa) < 1e-6 or abs(sb) < 1e-6:
                         return ik(1)
                     else:
                         return ik(nloops)
@@ -134,7 +165,7 @@ def isflipped(xf):
     return xf['spread'](0) < 0
 
 def blend_spline(ka, kb, scalea, scaleb, nloops=None,
-                 stagger=False, rng=None):
+                 stagger=False, rng=None, ends=None):
     """
     Blend a pair of splines. Returns a new SplEval.
 
@@ -149,9 +180,14 @@ def blend_spline(ka, kb, scalea, scaleb, nloops=None,
     start and end values will satisfy ``-180 <= diff + 360 * nloops <= 180``.
 
     ``stagger`` and ``rng`` will be replaced soon.
+
+    ``ends``, if given, is the tuple ``(ka(1), ka(1, deriv=1), kb(0),
+    kb(0, deriv=1))``, already evaluated (see SplineBatch).
     """
-    vala, slopea = ka(1), ka(1, deriv=1) * scalea
-    valb, slopeb = kb(0), kb(0, deriv=1) * scaleb
+    if ends is None:
+        ends = ka(1), ka(1, deriv=1), kb(0), kb(0, deriv=1)
+    vala, slopea, valb, slopeb = map(float, ends)
+    slopea, slopeb = slopea * scalea, slopeb * scaleb
 
     if nloops is not None:
         vala, valb = vala % 360, valb % 360
@@ -238,11 +274,13 @@ def sort_xforms(xf, method, t):
     if method == 'natural':
         xf = [xf[k] for k in sorted(xf, key=int)]
     elif method in ('weight', 'weightflip'):
-        xf = sorted(xf.values(), key=lambda v: v['density'](t))
+        at = SplineBatch(xf).lookup([t])
+        xf = [xf[k] for k in sorted(xf, key=lambda k: at[(k, 'density')][0])]
         if not (method == 'weightflip' and t == 0):
             xf.reverse()
     elif method == 'color':
-        xf = sorted(xf.values(), key=lambda v: v['color'](t))
+        at = SplineBatch(xf).lookup([t])
+        xf = [xf[k] for k in sorted(xf, key=lambda k: at[(k, 'color')][0])]
     else:
         assert 'Unknown method %s' % method
 
@@ -255,6 +293,78 @@ def sort_xforms(xf, method, t):
 
     return xf, out
 
+def xform_features(xfs, t, names):
+    """
+    Describe each xform in the list ``xfs`` at time ``t``. Returns an array
+    of the ``ALIGN_PARAMS`` and an array of the weight of each variation in
+    ``names``, each with a row per xform.
+    """
+    at = SplineBatch(dict(enumerate(xfs))).lookup([t])
+    def value(i, path):
+        v = xfs[i]
+        for k in path:
+            v = v[k]
+        return at[(i,) + path][0] if isinstance(v, SplEval) else float(v)
+    params = np.array([[value(i, p) for p, w in ALIGN_PARAMS]
+                       for i in range(len(xfs))])
+    params = params.reshape(-1, len(ALIGN_PARAMS))
+    weights = np.array([[value(i, ('variations', n, 'weight'))
+                         if n in x['variations'] else 0. for n in names]
+                        for i, x in enumerate(xfs)]).reshape(-1, len(names))
+    return params, weights
+
+def pair_costs(a, b):
+    """
+    Return the matrix of costs of pairing each xform described by ``a`` with
+    each described by ``b``, where both come from ``xform_features``.
+    """
+    (pa, wa), (pb, wb) = a, b
+    d = np.abs(pa[:,None,:] - pb[None,:,:])
+    angles = d[...,:ALIGN_ANGLES] % 360
+    d[...,:ALIGN_ANGLES] = np.minimum(angles, 360 - angles) / 180
+    cost = np.dot(d, [w for p, w in ALIGN_PARAMS])
+    cost += VARIATION_COST * np.abs(wa[:,None,:] - wb[None,:,:]).sum(-1) / 2
+    return cost
+
+def assign_xforms(ax, bx, category):
+    """
+    Reorder the xform lists ``ax`` and ``bx``, from the left and right genomes
+    respectively, in place so that xforms at the same position form the
+    cheapest pairing overall (by ``pair_costs``). The xforms of the longer
+    list left without a partner are moved to its end, where they will be
+    paired with pad xforms; the cost of that is the cost of pairing each with
+    its own pad. ``category`` is the index of the flip category of the lists,
+    as used by ``align_xforms``.
+    """
+    na, nb = len(ax), len(bx)
+    if not na or not nb:
+        return
+    n = max(na, nb)
+    names = sorted(set(sum([x['variations'].keys() for x in ax + bx], [])))
+    fa, fb = xform_features(ax, 1, names), xform_features(bx, 0, names)
+    cost = np.zeros((n, n))
+    cost[:na,:nb] = pair_costs(fa, fb)
+
+    # Pad xforms may have variations the originals don't, but those are only
+    # ever paired with the xform they were made from
+    longer, t, f = (ax, 1, fa) if na > nb else (bx, 0, fb)
+    pads = [create_pad_xform(x, ptype=pad_arg[category % 2],
+                             posttype=pad_arg[category / 2]) for x in longer]
+    pnames = sorted(set(sum([p['variations'].keys() for p in pads], names)))
+    padcost = np.diag(pair_costs(xform_features(longer, t, pnames),
+                                 xform_features(pads, t, pnames)))
+    if na > nb:
+        cost[:,nb:] = padcost[:,None]
+    else:
+        cost[na:,:] = padcost[None,:]
+
+    rows, cols = linear_sum_assignment(cost)
+    pairs = [(r, c) for r, c in zip(rows, cols) if r < na and c < nb]
+    ax[:] = ([ax[r] for r, c in pairs] +
+             [ax[r] for r, c in zip(rows, cols) if c >= nb])
+    bx[:] = ([bx[c] for r, c in pairs] +
+             [bx[c] for r, c in zip(rows, cols) if r >= na])
+
 def align_xforms(A, B, sort='weightflip'):
     """
     Aligns the xforms of the genomes A and B in place.
@@ -269,8 +379,9 @@ def align_xforms(A, B, sort='weightflip'):
             assert not isflipped(fin['affine'])
             assert 'post' not in fin or not isflipped(fin['post'])
 
-    Ax, Ax_sorted = sort_xforms(Ax, sort, 1)
-    Bx, Bx_sorted = sort_xforms(Bx, sort, 0)
+    method = 'natural' if sort == 'optimal' else sort
+    Ax, Ax_sorted = sort_xforms(Ax, method, 1)
+    Bx, Bx_sorted = sort_xforms(Bx, method, 0)
 
     def pad_post(a, b):
         if ('post' in a) ^ ('post' in b):
@@ -280,6 +391,9 @@ def align_xforms(A, B, sort='weightflip'):
     # pad each category to have the same number of xforms
     for i in range(4):
 
+        if sort == 'optimal':
+            assign_xforms(Ax_sorted[i], Bx_sorted[i], i)
+
         # for things that are already aligned, we must make sure that
         # if a post is present on one side, it's also present on the other
         # this check is only for 'normal' post cases, since those might not
@@ -366,19 +480,19 @@ def align_xforms(A, B, sort='weightflip'):
     A['xforms'], B['xforms'] = map(genome._AttrDict._wrap, (A_xforms, B_xforms))
 
 def checkpalflip(gnm):
+    # Values of every xform spline at both ends, as {path: [v(0), v(1)]}
+    at = SplineBatch(gnm['xforms']).lookup([0, 1])
     if 'final' in gnm['xforms']:
-        f = gnm['xforms']['final']
-        fcv, fcsp = f['color'], f['color_speed']
+        fcv, fcsp = at[('final', 'color')], at[('final', 'color_speed')]
     else:
-        fcv, fcsp = SplEval(0), SplEval(0)
-    sansfinal = [v for k, v in gnm['xforms'].items() if k != 'final']
+        fcv, fcsp = np.zeros(2), np.zeros(2)
+    sansfinal = [k for k in gnm['xforms'] if k != 'final']
 
-    lc, rc = [np.array([v['color'](t) * (1 - fcsp(t)) + fcv(t) * fcsp(t)
-               for v in sansfinal]) for t in (0, 1)]
+    color = np.array([at[(k, 'color')] for k in sansfinal]).reshape(-1, 2)
+    lc, rc = (color * (1 - fcsp) + fcv * fcsp).T
     rcrv = 1 - rc
     # TODO: use spline integration instead of L2
-    dens = np.array([np.hypot(v['density'](0), v['density'](1))
-                     for v in sansfinal])
+    dens = np.array([np.hypot(*at[(k, 'density')]) for k in sansfinal])
     if np.sum(np.abs(dens * (rc - lc))) > np.sum(np.abs(dens * (rcrv - lc))):
         palflip(gnm)
 
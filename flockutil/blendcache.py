@@ -0,0 +1,123 @@
+"""
+Content-addressed cache of blended edges.
+
+A managed edge is stored under a key derived from the contents of its two
+source genomes, the options used to blend them, and the version of the
+blending code, so an edge only needs to be blended again when one of those
+actually changes. Blending is CPU-bound and independent per edge, so missing
+edges can be prepared in bulk across a pool of processes.
+
+Quality scores (see quality.py) are stored beside each cached edge, and so are
+invalidated along with it.
+"""
+
+import os
+import json
+import traceback
+from hashlib import sha1
+
+from cuburn import genome
+
+import blend
+import quality
+from workers import run_jobs
+
+CACHE_DIR = 'out/cache/blend'
+
+# The options from the 'blend' command which affect its output.
+BLEND_OPTS = ('nloops', 'align', 'stagger', 'blur')
+
+def code_version(deprevs=()):
+    """
+    Return a string identifying the blending code. 'deprevs' should contain the
+    revids of any dependencies, but the source of the blend module is hashed
+    as well so that edits to an untracked checkout are not missed.
+    """
+    src = blend.__file__
+    if src.endswith(('.pyc', '.pyo')):
+        src = src[:-1]
+    with open(src) as fp:
+        return ':'.join(list(deprevs) + [sha1(fp.read()).hexdigest()[:12]])
+
+def blend_opts(args):
+    """Extract the output-affecting blend options from parsed arguments."""
+    return dict((k, getattr(args, k)) for k in BLEND_OPTS)
+
+def blend_key(lpath, rpath, opts, version):
+    h = sha1()
+    for path in (lpath, rpath):
+        with open(path) as fp:
+            h.update(sha1(fp.read()).digest())
+    h.update(json.dumps([opts, version], sort_keys=True))
+    return h.hexdigest()
+
+def cache_path(key):
+    return os.path.join(CACHE_DIR, key[:2], key + '.json')
+
+def score_path(path):
+    """Return the path of the quality score of the cached edge at 'path'."""
+    return path[:-len('.json')] + '.score.json'
+
+def load_score(path):
+    """Return the score of the cached edge at 'path', or None if unscored."""
+    try:
+        with open(score_path(path)) as fp:
+            return json.load(fp)['score']
+    except (IOError, ValueError, KeyError):
+        return None
+
+def blend_edge(lname, lpath, rname, rpath, opts):
+    """Blend two genome files, returning the encoded genome."""
+    l, r = [genome.Genome(json.load(open(p))) for p in (lpath, rpath)]
+    bl = blend.blend_genomes(l, r, **opts)
+    bl['link'] = {'left': lname, 'right': rname}
+    return genome.json_encode_genome(bl)
+
+def write_cached(path, gnm):
+    dir = os.path.dirname(path)
+    if not os.path.isdir(dir):
+        try:
+            os.makedirs(dir)
+        except OSError:
+            # Another process got there first
+            if not os.path.isdir(dir): raise
+    # Write to a private name so concurrent workers never see partial files
+    tmp = '%s.%d' % (path, os.getpid())
+    with open(tmp, 'w') as fp:
+        fp.write(gnm)
+    os.rename(tmp, path)
+
+def _blend_job(job):
+    name, path, lname, lpath, rname, rpath, opts = job
+    try:
+        write_cached(path, blend_edge(lname, lpath, rname, rpath, opts))
+    except Exception:
+        return name, traceback.format_exc()
+    return name, None
+
+def _score_job(job):
+    name, path = job
+    try:
+        with open(path) as fp:
+            gnm = genome.Genome(json.load(fp))
+        scores = quality.score_genome(gnm)
+        write_cached(score_path(path), json.dumps(scores, sort_keys=True))
+    except Exception:
+        return name, traceback.format_exc()
+    return name, None
+
+def blend_all(jobs, procs=None):
+    """
+    Blend each job in a pool of 'procs' processes (all cores by default).
+    Each job is a tuple of (name, cache path, left name, left path, right
+    name, right path, options). Yields (name, error) as jobs complete, where
+    'error' is None or a formatted traceback.
+    """
+    return run_jobs(_blend_job, jobs, procs)
+
+def score_all(jobs, procs=None):
+    """
+    Score each cached edge, as for blend_all. Each job is a tuple of (name,
+    cache path).
+    """
+    return run_jobs(_score_job, jobs, procs)
@@ -0,0 +1,176 @@
+"""
+Selection of new edges to blend between reference nodes.
+
+With N nodes there are N^2 possible blends, far too many to blend, let alone
+render. Instead, each node is described by a fixed-length feature vector
+(its palette, the mix of variations it uses, and the shape of its xforms), and
+edges are chosen between nodes which are close in that space. Each node is
+joined to its nearest neighbours, and then the cheapest edges joining separate
+components are added until the graph is connected, so that any node can be
+reached from any other.
+
+Distances are computed in chunks of rows with NumPy, so selection over
+thousands of nodes takes seconds; loading the genomes usually takes longer.
+"""
+
+import json
+import traceback
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from cuburn import genome
+
+from splines import SplineBatch
+
+# Number of bins the palette is averaged into.
+PALETTE_BINS = 16
+
+# Number of the densest xforms whose share of the density is compared.
+TOP_XFORMS = 4
+
+# Relative weight of each block of features in the distance between nodes.
+BLOCK_WEIGHTS = dict(palette=1.0, variations=1.0, shape=0.5)
+
+# Number of rows of the distance matrix computed at once.
+CHUNK = 1024
+
+def node_features(gnm):
+    """
+    Describe a node genome at its start. Returns a dict of feature blocks:
+    'palette' and 'shape' are lists of numbers, and 'variations' a dict from
+    variation name to its share of the total density-weighted weight.
+    """
+    keys = [k for k in gnm['xforms'] if k != 'final']
+    at = SplineBatch(gnm['xforms']).lookup([0])
+    val = lambda *path: float(at[path][0]) if path in at else 0.
+
+    dens = np.array([abs(val(k, 'density')) for k in keys])
+    share = dens / dens.sum() if dens.sum() else np.ones(len(keys)) / len(keys)
+
+    variations = {}
+    for k, s in zip(keys, share):
+        for name in gnm['xforms'][k]['variations']:
+            w = abs(val(k, 'variations', name, 'weight'))
+            variations[name] = variations.get(name, 0) + s * w
+    total = sum(variations.values()) or 1.
+    variations = dict((n, w / total) for n, w in variations.items())
+
+    pal = np.asarray(genome.palette_decode(gnm['palettes'][0]), float)
+    pal = [c.mean(axis=0) for c in np.array_split(pal[:,:3], PALETTE_BINS)]
+
+    color = np.array([val(k, 'color') for k in keys])
+    cmean = np.dot(share, color)
+    top = np.zeros(TOP_XFORMS)
+    srt = np.sort(share)[::-1][:TOP_XFORMS]
+    top[:len(srt)] = srt
+    shape = [len(keys),
+             np.dot(share, [val(k, 'affine', 'spread') < 0 for k in keys]),
+             np.dot(share, [abs(val(k, 'affine', 'magnitude', 'x')) +
+                            abs(val(k, 'affine', 'magnitude', 'y'))
+                            for k in keys]),
+             cmean, np.sqrt(np.dot(share, (color - cmean) ** 2))]
+    return dict(palette=list(np.ravel(pal)), variations=variations,
+                shape=shape + list(top))
+
+def load_node(job):
+    """
+    Load a node genome from the file 'path' and describe it. Returns (name,
+    link, features, error), where 'error' is None or a formatted traceback.
+    """
+    name, path = job
+    try:
+        with open(path) as fp:
+            gnm = genome.Genome(json.load(fp))
+        return name, gnm.get('link', {}), node_features(gnm), None
+    except Exception:
+        return name, None, None, traceback.format_exc()
+
+def feature_matrix(feats):
+    """
+    Stack a list of node features into an array with a row per node. Each
+    column is standardized, and each block scaled so that its weight in
+    BLOCK_WEIGHTS is its share of the expected distance between nodes.
+    """
+    names = sorted(set(sum([f['variations'].keys() for f in feats], [])))
+    blocks = dict(
+        palette=np.array([f['palette'] for f in feats], float),
+        shape=np.array([f['shape'] for f in feats], float),
+        variations=np.array([[f['variations'].get(n, 0.) for n in names]
+                             for f in feats], float).reshape(len(feats), -1))
+    out = []
+    for key in sorted(blocks):
+        b = blocks[key]
+        std = b.std(axis=0)
+        std[std == 0] = 1
+        b = (b - b.mean(axis=0)) / std
+        out.append(b * BLOCK_WEIGHTS[key] / np.sqrt(max(1, b.shape[1])))
+    return np.hstack(out)
+
+def distance_chunks(x, chunk=CHUNK):
+    """
+    Yield (start, dist) for successive chunks of rows of the matrix of
+    squared distances between the rows of 'x', with the diagonal set to inf.
+    """
+    sq = (x ** 2).sum(axis=1)
+    for start in range(0, len(x), chunk):
+        rows = x[start:start+chunk]
+        d = sq[start:start+chunk,None] + sq[None,:] - 2 * np.dot(rows, x.T)
+        d[np.arange(len(rows)), start + np.arange(len(rows))] = np.inf
+        yield start, np.maximum(d, 0)
+
+def nearest(x, k):
+    """
+    Return the set of pairs (i, j), with i < j, which join each row of 'x' to
+    its 'k' nearest others.
+    """
+    k = min(k, len(x) - 1)
+    pairs = set()
+    if k < 1:
+        return pairs
+    for start, d in distance_chunks(x):
+        near = np.argpartition(d, k - 1, axis=1)[:,:k]
+        for i, js in enumerate(near, start):
+            pairs.update((min(i, j), max(i, j)) for j in js)
+    return pairs
+
+def components(n, pairs):
+    """Return the number of connected components and the label of each."""
+    pairs = np.array(sorted(pairs), int).reshape(-1, 2)
+    g = coo_matrix((np.ones(len(pairs)), (pairs[:,0], pairs[:,1])),
+                   shape=(n, n))
+    return connected_components(g, directed=False)
+
+def connect(x, pairs):
+    """
+    Return a set of pairs which, added to 'pairs', joins every row of 'x'
+    into a single component. In each round, every component is joined to
+    its nearest other component (as in Boruvka's algorithm), so few rounds
+    are needed.
+    """
+    added = set()
+    ncomp, labels = components(len(x), pairs)
+    while ncomp > 1:
+        best = {}
+        for start, d in distance_chunks(x):
+            rows = labels[start:start+len(d)]
+            d[rows[:,None] == labels[None,:]] = np.inf
+            js = d.argmin(axis=1)
+            for i, (j, c) in enumerate(zip(js, rows), start):
+                dist = d[i - start, j]
+                if c not in best or dist < best[c][0]:
+                    best[c] = (dist, min(i, j), max(i, j))
+        added.update((i, j) for dist, i, j in best.values())
+        ncomp, labels = components(len(x), pairs | added)
+    return added
+
+def select(x, k, existing=()):
+    """
+    Choose pairs of rows of the feature matrix 'x' to join: the 'k' nearest
+    neighbours of each, plus whatever is needed to connect the graph given
+    the pairs already in 'existing'. Returns the new pairs, with i < j.
+    """
+    existing = set((min(i, j), max(i, j)) for i, j in existing)
+    pairs = nearest(x, k) - existing
+    return pairs | connect(x, pairs | existing)
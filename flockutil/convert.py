@@ -0,0 +1,67 @@
+"""
+Conversion of flam3 XML genomes to JSON reference edges.
+
+Each XML file is converted as a separate job, so that large libraries can be
+converted across a pool of processes (see workers.run_jobs). Workers write
+their own output files; staging them is left to the caller, so that it can
+be done in a few large batches.
+"""
+
+import os
+import traceback
+
+from cuburn import genome
+
+OUTPUT_DIR = 'edges/reference'
+
+# Files with more flames than this are probably animations, not keyframes.
+MAX_FLAMES = 10
+
+def convert_flame(flame, arc=-360, offset=0, flip=True,
+                  link={'left': 'loop', 'right': 'loop'}):
+    """Convert one flame to an encoded JSON genome."""
+    gnm = genome.convert_flame(flame, arc, offset)
+    gnm['link'] = link
+    if flip and 'final' in gnm['xforms']:
+        a = gnm['xforms']['final']['affine']
+        a['spread'] = abs(a['spread'])
+    return genome.json_encode_genome(gnm).lstrip()
+
+def convert_file(job):
+    """
+    Convert every flame in an XML file. 'job' is a tuple of (path, force,
+    flip, half), as for the 'convert' command. Returns (path, written,
+    warning, error), where 'written' lists the files written, 'warning' is
+    None or a message explaining why the file was skipped, and 'error' None
+    or a formatted traceback.
+    """
+    path, force, flip, half = job
+    written = []
+    try:
+        with open(path) as fp:
+            flames = genome.XMLGenomeParser.parse(fp.read())
+        if len(flames) > MAX_FLAMES and not force:
+            return path, written, ('In file %s:\n'
+                'This looks like an XML frame-by-frame animation.\n'
+                'Try importing just the keyframes, or use "-f" to force.'
+                % path), None
+        basename = os.path.basename(path).rsplit('.', 1)[0]
+        names = ['%s_%d' % (basename, i) for i in range(len(flames))]
+        if len(flames) == 1:
+            names = [basename]
+        for name, flame in zip(names, flames):
+            if half:
+                outs = [(name, convert_flame(flame, -180, 90, flip,
+                            {'left': 'reference', 'right': 'reference'})),
+                        (name + '_180', convert_flame(flame, -180, 270, flip,
+                            {'left': name, 'right': name}))]
+            else:
+                outs = [(name, convert_flame(flame, -360, 0, flip))]
+            for oname, out in outs:
+                opath = os.path.join(OUTPUT_DIR, oname + '.json')
+                with open(opath, 'w') as fp:
+                    fp.write(out)
+                written.append(opath)
+    except Exception:
+        return path, written, None, traceback.format_exc()
+    return path, written, None, None
@@ -0,0 +1,110 @@
+"""
+Encoding of rendered edges to video.
+
+Frames are streamed in index order to an encoder subprocess as raw 8-bit RGB
+on its standard input, so no intermediate files are written and nothing is
+decoded twice. Frames come either straight from the renderer, or from the
+images in an output directory, decoded a few frames ahead on a pool of
+threads while the encoder works on earlier ones.
+"""
+
+import time
+import shlex
+from collections import deque
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from subprocess import Popen, PIPE
+import numpy as np
+
+from output import FrameManifest, read_log
+
+# The encoder command. '{width}', '{height}', '{fps}' and '{out}' are filled
+# in; frames arrive on standard input as packed 8-bit RGB.
+DEFAULT_COMMAND = ('ffmpeg -loglevel error -y -f rawvideo -pix_fmt rgb24 '
+                   '-s {width}x{height} -r {fps} -i - '
+                   '-c:v libx264 -pix_fmt yuv420p {out}')
+
+class EncodeError(Exception):
+    pass
+
+def load_image(path):
+    """Decode an image file to an 8-bit RGB array."""
+    try:
+        from PIL import Image
+    except ImportError:
+        import Image
+    return np.asarray(Image.open(path).convert('RGB'))
+
+def prefetch(items, load, threads=None, depth=None):
+    """
+    Yield 'load(item)' for each of 'items', in order. Up to 'depth' items
+    are loaded ahead on a pool of 'threads' threads.
+    """
+    threads = threads or cpu_count()
+    depth = depth or 2 * threads
+    pool = ThreadPool(threads)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(pool.apply_async(load, (item,)))
+            if len(pending) >= depth:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+def edge_frames(odir):
+    """
+    Return (indices, expected) for an output directory: the indices of the
+    frames written to it, in order, and the number of frames the edge has
+    (or None, if its log has no header).
+    """
+    header = read_log(odir)[0]
+    indices = list(FrameManifest.load(odir, save=False).indices())
+    return indices, header.get('nf')
+
+class VideoEncoder(object):
+    """
+    An encoder subprocess, fed raw frames of a fixed size through a pipe.
+    'cmd' is a command line as for DEFAULT_COMMAND.
+    """
+    def __init__(self, out, width, height, fps, cmd=DEFAULT_COMMAND):
+        self.shape = (height, width, 3)
+        fields = dict(width=width, height=height, fps=fps, out=out)
+        self.args = [a.format(**fields) for a in shlex.split(cmd)]
+        self.proc = Popen(self.args, stdin=PIPE)
+        self.frames = self.bytes = 0
+        self.start = time.time()
+
+    def write(self, frame):
+        if frame.shape != self.shape:
+            raise EncodeError('Frame has shape %s, but the video is %s' %
+                              (frame.shape, self.shape))
+        frame = np.ascontiguousarray(frame, np.uint8)
+        try:
+            self.proc.stdin.write(frame.data)
+        except IOError:
+            # The encoder has gone away; 'close' will say why
+            self.close()
+            raise EncodeError('Encoder exited early')
+        self.frames += 1
+        self.bytes += frame.nbytes
+
+    def close(self):
+        """Wait for the encoder to finish. Raises EncodeError on failure."""
+        if not self.proc.stdin.closed:
+            try:
+                self.proc.stdin.close()
+            except IOError:
+                pass
+        ret = self.proc.wait()
+        if ret:
+            raise EncodeError('"%s" exited with status %d' %
+                              (' '.join(self.args), ret))
+
+    def report(self):
+        took = max(time.time() - self.start, 1e-3)
+        print ('Encoded %d frames (%.1f MB raw) in %.1f s: %.1f frames/s, '
+               '%.1f MB/s' % (self.frames, self.bytes / 1e6, took,
+                              self.frames / took, self.bytes / 1e6 / took))
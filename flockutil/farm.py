@@ -0,0 +1,217 @@
+"""
+Distribution of frames across several render hosts.
+
+A server holds the list of frames left to render and leases them out in
+batches to hosts, which render them into their own 'out/' directory and report
+back. Leases which are not reported within the lease time are put back at the
+front of the queue, so frames held by a crashed or stalled host are picked up
+by the next host to ask for work.
+
+The protocol is one JSON object per line over TCP, one request per connection.
+Once every frame is in, the server stays up for a while to tell hosts so.
+Hosts retry requests which fail, backing off, so a network hiccup or a server
+restart doesn't stop them; they only stop early when the server is gone for
+longer than that.
+"""
+
+import json
+import time
+import socket
+import threading
+import SocketServer
+from collections import deque
+
+DEFAULT_PORT = 7677
+
+# Seconds the server keeps answering once all work is done, and the delays
+# between a host's attempts at a request, which together outlast it.
+LINGER = 30
+BACKOFF = (1, 2, 4, 8, 16, 30)
+
+class FrameQueue(object):
+    """
+    The frames remaining in a render. Each task is an (edge, rev, idx) tuple,
+    identified by its (edge, idx) key.
+    """
+    def __init__(self, tasks, lease_time=600, clock=time.time):
+        self.pending = deque(tasks)
+        self.leases = {}
+        self.done = set()
+        # Keys not yet reported, whether pending, leased or requeued
+        self.remaining = set(map(self.key, self.pending))
+        self.lease_time = lease_time
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        if not self.remaining:
+            self.finished.set()
+
+    @staticmethod
+    def key(task):
+        return task[0], task[2]
+
+    def _requeue(self):
+        now = self.clock()
+        expired = [k for k, (w, exp, t) in self.leases.items() if exp <= now]
+        # Pushed on the front in reverse, so they go out in their old order
+        expired.sort(key=lambda k: self.leases[k][1:], reverse=True)
+        for k in expired:
+            self.pending.appendleft(self.leases.pop(k)[2])
+
+    def lease(self, worker, count=1):
+        """
+        Lease up to 'count' tasks to 'worker'. All tasks in a lease belong to
+        the same edge, so hosts only need to load one genome per batch.
+        """
+        with self.lock:
+            self._requeue()
+            out = []
+            while self.pending and len(out) < count:
+                task = self.pending[0]
+                if out and task[0] != out[0][0]:
+                    break
+                self.pending.popleft()
+                if self.key(task) in self.done:
+                    continue
+                self.leases[self.key(task)] = (worker,
+                        self.clock() + self.lease_time, task)
+                out.append(task)
+            return out
+
+    def complete(self, worker, keys):
+        """Mark tasks as completed. Reports from any worker are accepted."""
+        with self.lock:
+            for k in map(tuple, keys):
+                self.leases.pop(k, None)
+                self.done.add(k)
+                self.remaining.discard(k)
+            # Requeued copies of tasks reported late may still be pending;
+            # 'lease' skips them, but they mustn't hold up the finish
+            if not self.remaining:
+                self.finished.set()
+
+    def status(self):
+        with self.lock:
+            return dict(pending=len(self.pending), leased=len(self.leases),
+                        done=len(self.done))
+
+class _Handler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        try:
+            req = json.loads(self.rfile.readline())
+            resp = self.server.dispatch(req)
+        except Exception, e:
+            resp = dict(error=str(e))
+        self.wfile.write(json.dumps(resp) + '\n')
+
+class FarmServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+    Serves a FrameQueue. 'info' is a dict of settings (such as the profile
+    name) which is sent to hosts along with every lease.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, addr, queue, info=None):
+        SocketServer.TCPServer.__init__(self, addr, _Handler)
+        self.queue = queue
+        self.info = info or {}
+
+    def dispatch(self, req):
+        op = req.get('op')
+        if op == 'lease':
+            tasks = self.queue.lease(req['worker'], req.get('count', 1))
+            return dict(self.info, tasks=tasks,
+                        finished=self.queue.finished.is_set())
+        elif op == 'complete':
+            self.queue.complete(req['worker'], req['keys'])
+            return dict(ok=True)
+        elif op == 'status':
+            return self.queue.status()
+        raise ValueError('Unknown operation %r' % op)
+
+    def serve_until_finished(self, poll=0.5, linger=LINGER):
+        """
+        Serve requests until every task has been completed, and then for
+        'linger' seconds more, so hosts still at work hear that it's over.
+        """
+        thread = threading.Thread(target=self.serve_forever,
+                                  kwargs=dict(poll_interval=poll))
+        thread.daemon = True
+        thread.start()
+        try:
+            while not self.queue.finished.wait(poll):
+                pass
+            time.sleep(linger)
+        finally:
+            self.shutdown()
+            self.server_close()
+
+class FarmClient(object):
+    def __init__(self, addr):
+        self.addr = addr
+
+    def request(self, **req):
+        sock = socket.create_connection(self.addr)
+        try:
+            fp = sock.makefile('rw')
+            fp.write(json.dumps(req) + '\n')
+            fp.flush()
+            resp = json.loads(fp.readline())
+        finally:
+            sock.close()
+        if 'error' in resp:
+            raise RuntimeError('Server error: ' + resp['error'])
+        return resp
+
+    def lease(self, worker, count=1):
+        return self.request(op='lease', worker=worker, count=count)
+
+    def complete(self, worker, keys):
+        return self.request(op='complete', worker=worker, keys=keys)
+
+def retry(fn, *args, **kwargs):
+    """
+    Call fn(*args), retrying after each delay in 'backoff' if the server
+    can't be reached. The last failure is raised.
+    """
+    sleep = kwargs.get('sleep', time.sleep)
+    for delay in kwargs.get('backoff', BACKOFF):
+        try:
+            return fn(*args)
+        except socket.error, e:
+            print 'Could not reach the server (%s), retrying in %g s' % (
+                    e, delay)
+            sleep(delay)
+    return fn(*args)
+
+def run_host(client, worker, render, count=8, wait=5, sleep=time.sleep,
+             backoff=BACKOFF):
+    """
+    Lease and render frames until the server reports that all work is done.
+
+    'render' is called with the response to each lease, a dict containing the
+    list of (edge, rev, idx) 'tasks' along with the server's settings, and
+    should return the (edge, idx) keys of the frames it successfully wrote.
+    Requests are retried as described above; socket.error is raised if the
+    server can't be reached even so.
+    """
+    call = lambda fn, *args: retry(fn, *args, sleep=sleep, backoff=backoff)
+    while True:
+        resp = call(client.lease, worker, count)
+        if not resp['tasks']:
+            if resp['finished']:
+                return
+            # Everything left is leased elsewhere; wait in case one expires
+            sleep(wait)
+            continue
+        keys = render(resp)
+        if keys:
+            call(client.complete, worker, keys)
+
+def parse_addr(addr, host=''):
+    """Parse 'host:port', 'host' or ':port' into a (host, port) tuple."""
+    if ':' in addr:
+        h, p = addr.rsplit(':', 1)
+        return h or host, int(p)
+    return addr or host, DEFAULT_PORT
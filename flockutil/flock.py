@@ -5,21 +5,41 @@ import sys
 import json
 import random
 import shutil
+import time
+import socket
 import warnings
 import traceback
-from os.path import isfile, join
+from os.path import join
 from glob import glob
 from hashlib import sha1
 from tempfile import mkdtemp
-from subprocess import check_call, check_output, CalledProcessError, STDOUT
+from subprocess import check_call, check_output
 from contextlib import contextmanager
 import numpy as np
 from itertools import ifilter
 
-from cuburn import genome, render
-
-from main import parse_simple
-import blend
+from cuburn import genome
+
+from main import parse_simple, parse_blend_args
+from history import History
+from ratings import RatingIndex
+import blendcache
+import farm
+import stats
+import schedule
+import metrics
+import workers
+import store
+import motion
+import quality
+import candidates
+import graph
+import convert
+import encode
+import backends
+from output import (FrameWriter, FrameEncoder, FrameManifest, frame_ext,
+                    frame_saver, log_record, read_log)
+import framearray
 
 FLOCK_PATH_IGNORE = bool(os.environ.get('FLOCK_PATH_IGNORE'))
 FLOCK_PATH_SET = bool(os.environ.get('FLOCK_PATH')) and not FLOCK_PATH_IGNORE
@@ -49,6 +69,9 @@ elif FLOCK_PATH_SET:
 # The key representing untracked files (mostly for readability)
 UNTR = (-1, 'untracked')
 
+# Number of paths to give each 'git add' process.
+GIT_ADD_BATCH = 1000
+
 class Flock(object):
     """
     The collection of flames which comprise the current flock.
@@ -57,7 +80,6 @@ class Flock(object):
         self.paths, self.revmap = self.parse_log()
         self.dirty = self.parse_status()
         self.managed = dict(self.parse_managed())
-        self.ratings = self.parse_ratings()
 
         for d in self.dirty.intersection(self.paths):
             self.paths[d] = UNTR
@@ -73,6 +95,8 @@ class Flock(object):
         self.edges = dict((k[6:-5].replace('/', '_'), v)
                           for k, v in self.paths.items()
                           if k.startswith('edges/') and k.endswith('.json'))
+        # Ratings depend on the revisions of the edges, so go last
+        self.ratings = self.parse_ratings()
 
     @staticmethod
     def parse_status(path=None, untracked=False):
@@ -88,39 +112,8 @@ class Flock(object):
         Parses the revision history for the current branch to determine the
         latest revision at which a given file was changed.
         """
-        revlist = []
-        paths = {}
-        rev = None
-        log = check_output(['git', 'log', '--name-only', '--pretty=format:%H'])
-        for line in log.split('\n'):
-            if rev is None:
-                rev = line
-                revlist.append(line)
-            elif line == '':
-                rev = None
-            elif os.path.exists(line):
-                paths.setdefault(line, (len(revlist), rev))
-
-        # Identify the smallest unique prefix to use as the revid (min 6). If
-        # there is a collision, the newer revid will be extended, but the
-        # older revid will not change length.
-        shortrefs = set()
-        revmap = {}
-        revrevmap = {}
-        for i in reversed(revlist):
-            for j in range(6, 41):
-                short = i[:j]
-                if short not in shortrefs:
-                    shortrefs.add(short)
-                    revmap[short] = i
-                    revrevmap[i] = short
-                    break
-
-        # Update the paths to use shorter revs.
-        for k, v in paths.items():
-            paths[k] = (v[0], revrevmap[v[1]])
-
-        return paths, revmap
+        hist = History.load()
+        return hist.paths(), hist.revs
 
     @staticmethod
     def parse_managed():
@@ -131,17 +124,12 @@ class Flock(object):
             l, r = args[:2]
             yield '%s=%s.%s' % (l, r, idx), args
 
-    @staticmethod
-    def parse_ratings():
-        ratings = {}
-        for line in parse_simple('ratings.txt'):
-            sp = line.split()
-            if len(sp) < 4: continue
-            name, rev, user, flags = sp[:4]
-            if flags[0] not in '012345': continue
-            ratings.setdefault(name, {}).setdefault(rev, {}).setdefault(user,
-                    (int(flags[0]), flags[1:]))
-        return ratings
+    def parse_ratings(self):
+        """
+        Index the ratings in ratings.txt, with the effective rating of each
+        rated edge at its current revision.
+        """
+        return RatingIndex(lambda edge: self.find_edge(edge)[2])
 
     def find_edge(self, edge):
         """
@@ -173,18 +161,10 @@ class Flock(object):
         raise KeyError('No edges matched "%s".' % match)
 
     def get_rating(self, edge, default=2.5):
-        if edge not in self.ratings:
-            return default
-        rev = self.find_edge(edge)[2]
-        if rev in self.ratings[edge]:
-            ratings = [v[0] for v in self.ratings[edge][rev].values()]
-        else:
-            ratings = [v[0] for d in self.ratings[edge].values()
-                            for v in d.values()]
-        return sum(ratings) / float(len(ratings))
+        return self.ratings.get(edge, default)
 
     def list_flock(self, shuffle=False, rating=True, separate=False,
-                   thresh=0):
+                   thresh=0, scores=None, min_score=None):
         """
         Return a list of edges in the flock. If 'shuffle' is True, the order
         will be randomized. If 'rating' is True, the edges will be sorted by
@@ -194,10 +174,18 @@ class Flock(object):
         If multiple of these are True, they are applied in the order given in
         the method signature using stable sorting.
 
-        Edges with rating lower than 'thresh' will be omitted.
+        Edges with rating lower than 'thresh' will be omitted. So will
+        unrated edges whose blend quality score, from the dict 'scores', is
+        lower than 'min_score'; edges without a score are kept.
         """
-        edges = [e for e in self.edges.keys() + self.managed.keys()
-                 if self.get_rating(e) >= thresh]
+        scores = scores or {}
+        self.ratings.refresh()
+        def keep(e):
+            if self.get_rating(e) < thresh:
+                return False
+            return (min_score is None or e in self.ratings or
+                    scores.get(e, min_score) >= min_score)
+        edges = filter(keep, self.edges.keys() + self.managed.keys())
         if shuffle:
             np.random.shuffle(edges)
         else:
@@ -211,157 +199,595 @@ class Flock(object):
 class Flockutil(object):
     def __init__(self, args):
         self.flock = Flock()
+        self._blend_jobs = {}
+        self._backend = getattr(args, 'backend', None)
+        self._backends = {}
+        self.info = dict(worker=getattr(args, 'worker', None) or
+                                '%s.%d' % (socket.gethostname(), os.getpid()),
+                         revs=self.dep_revs())
         getattr(self, 'cmd_' + args.cmd)(args)
 
     def cmd_convert(self, args):
-        def cvt(name, flame, arc=-360, offset=0,
-                link={'left': 'loop', 'right': 'loop'}):
-            path = os.path.join('edges/reference', name + '.json')
-            gnm = genome.convert_flame(flame, arc, offset)
-            gnm['link'] = link
-
-            if args.flip and 'final' in gnm['xforms']:
-                a = gnm['xforms']['final']['affine']
-                a['spread'] = abs(a['spread'])
-            out = genome.json_encode_genome(gnm)
-
-            with open(path, 'w') as fp:
-                fp.write(out.lstrip())
-            if args.add:
-                self._git_add(path)
-            print path
-        for node in args.nodes:
-            flames = genome.XMLGenomeParser.parse(node.read())
-            if len(flames) > 10 and not args.force:
-                print ('In file %s:\n'
-                    'This looks like an XML frame-by-frame animation.\n'
-                    'Try importing just the keyframes, or use "-f" to force.'
-                    % node.name)
-                continue
-            basename = os.path.basename(node.name).rsplit('.', 1)[0]
-            names = ['%s_%d' % (basename, i) for i in range(len(flames))]
-            if len(flames) == 1:
-                names = [basename]
-            for name, flame in zip(names, flames):
-                if args.half:
-                    cvt(name, flame, -180, 90,
-                        {'left': 'reference', 'right': 'reference'})
-                    cvt(name + '_180', flame, -180, 270,
-                        {'left': name, 'right': name})
-                else:
-                    cvt(name, flame, -360, 0)
-        self._git_check_status('edges/reference')
+        jobs = [(path, args.force, args.flip, args.half)
+                for path in args.nodes]
+        start = time.time()
+        written, failed = [], []
+        results = workers.run_jobs(convert.convert_file, jobs, args.procs,
+                                   chunksize=8)
+        for path, out, warning, err in results:
+            if err:
+                print '\nWhile converting %s:\n%s' % (path, err)
+                failed.append(path)
+            elif warning:
+                print warning
+            for opath in out:
+                print opath
+            written.extend(out)
+        took = time.time() - start
+        if args.add and written:
+            self._git_add(*written)
+        print ('Converted %d files to %d edges in %.1f s (%.1f edges/s), '
+               '%d failed' % (len(jobs) - len(failed), len(written), took,
+                              len(written) / max(took, 1e-3), len(failed)))
+        self._git_check_status(convert.OUTPUT_DIR)
+        if failed:
+            sys.exit('Failed: ' + ' '.join(failed))
 
     def _git_add(self, *paths):
-        check_call(('git', 'add') + paths)
+        # Batched, so that thousands of paths don't exceed the argument limit
+        # or fork thousands of processes
+        for i in range(0, len(paths), GIT_ADD_BATCH):
+            check_call(('git', 'add', '--') + paths[i:i+GIT_ADD_BATCH])
 
     def _git_check_status(self, path):
         if Flock.parse_status(path, untracked=True):
             print 'Repository is now dirty; remember to commit your changes.'
 
-    def cache_managed_edge(self, name, args, rev):
-        path = 'out/cache/%s.%s.json' % (name, rev)
-        if not os.path.isfile(path):
-            from main import mkparser
-            parser = mkparser()
-            args = parser.parse_args(['blend'] + args)
-            bname, paths, gnm = self.blend(args)
-            if not os.path.isdir('out/cache'):
-                os.makedirs('out/cache')
-            with open(path, 'w') as fp:
-                fp.write(gnm)
-        return path
+    def dep_revs(self):
+        """Return a dict of the revids of the flock's dependencies."""
+        return dict((d, self.flock.paths.get('.deps/' + d, UNTR)[1])
+                    for d in ('cuburn', 'flockutil'))
+
+    def blend_job(self, name):
+        """
+        Return the job tuple used by blendcache.blend_all to create the
+        managed edge 'name'. The second item is its path in the blend cache.
+        """
+        if name not in self._blend_jobs:
+            if not hasattr(self, '_blend_version'):
+                revs = self.dep_revs()
+                self._blend_version = blendcache.code_version(
+                        [revs['cuburn'], revs['flockutil']])
+            args = parse_blend_args(self.flock.managed[name])
+            lname, lpath = self.flock.find_edge(args.left)[:2]
+            rname, rpath = self.flock.find_edge(args.right)[:2]
+            opts = blendcache.blend_opts(args)
+            key = blendcache.blend_key(lpath, rpath, opts, self._blend_version)
+            self._blend_jobs[name] = (name, blendcache.cache_path(key),
+                                      lname, lpath, rname, rpath, opts)
+        return self._blend_jobs[name]
+
+    def blend_managed(self, names, procs=None):
+        """
+        Blend those managed edges in 'names' which are not yet cached, using
+        'procs' processes. Returns the names of edges which failed.
+        """
+        jobs = [j for j in map(self.blend_job, names)
+                if not os.path.isfile(j[1])]
+        failed = []
+        for i, (name, err) in enumerate(blendcache.blend_all(jobs, procs), 1):
+            if err:
+                print '\nWhile blending %s:\n%s' % (name, err)
+                failed.append(name)
+            else:
+                print 'Blended %s (%d/%d)' % (name, i, len(jobs))
+        return failed
+
+    def cache_managed_edge(self, name):
+        if self.blend_managed([name], 1):
+            sys.exit('Error creating %s' % name)
+        return self.blend_job(name)[1]
+
+    def edge_scores(self, names):
+        """
+        Return a dict of the blend quality scores of those managed edges in
+        'names' which have been scored (see cmd_score).
+        """
+        scores = {}
+        for name in names:
+            if name in self.flock.managed:
+                score = blendcache.load_score(self.blend_job(name)[1])
+                if score is not None:
+                    scores[name] = score
+        return scores
+
+    def cmd_score(self, args):
+        names = sorted(self.flock.managed)
+        failed = self.blend_managed(names, args.procs)
+        jobs = [self.blend_job(n)[:2] for n in names if n not in failed]
+        if not args.force:
+            jobs = [j for j in jobs
+                    if not os.path.isfile(blendcache.score_path(j[1]))]
+        for name, err in blendcache.score_all(jobs, args.procs):
+            if err:
+                print '\nWhile scoring %s:\n%s' % (name, err)
+                failed.append(name)
+        scores = []
+        for name in names:
+            if name in failed: continue
+            with open(blendcache.score_path(self.blend_job(name)[1])) as fp:
+                scores.append((name, json.load(fp)))
+        scores.sort(key=lambda (n, s): s['score'])
+        keys = sorted(quality.WEIGHTS)
+        print '%-40s %6s  %s' % ('edge', 'score', '  '.join(keys))
+        for name, s in scores:
+            print '%-40s %6.3f  %s' % (name, s['score'], '  '.join(
+                    '%*.3f' % (len(k), s[k]) for k in keys))
+        if failed:
+            sys.exit('Failed: ' + ' '.join(failed))
+
+    def cmd_blend_all(self, args):
+        names = sorted(self.flock.managed)
+        start = time.time()
+        failed = self.blend_managed(names, args.procs)
+        print '%d managed edges, %d failed, took %.1f s' % (
+                len(names), len(failed), time.time() - start)
+        if failed:
+            sys.exit('Failed: ' + ' '.join(failed))
+
+    def cmd_add_edges(self, args):
+        opts = args.opts[1:] if args.opts[:1] == ['--'] else args.opts
+        # Check them now, rather than when a render first blends an edge
+        try:
+            parse_blend_args(['left', 'right'] + opts)
+        except SystemExit:
+            sys.exit('Invalid blend options: %s' % ' '.join(opts))
+        start = time.time()
+        paths = sorted(p for p in self.flock.paths
+                       if p.startswith('edges/reference/')
+                       and p.endswith('.json'))
+        jobs = [(p[len('edges/'):-len('.json')], p) for p in paths]
+        names, feats = [], []
+        for name, link, feat, err in workers.run_jobs(
+                candidates.load_node, jobs, args.procs):
+            if err:
+                print '\nWhile loading %s:\n%s' % (name, err)
+            # Second halves of split nodes link to the node's own first half
+            elif link.get('left') in ('loop', 'reference'):
+                names.append(name)
+                feats.append(feat)
+        order = np.argsort(names)
+        names, feats = [names[i] for i in order], [feats[i] for i in order]
+        loaded = time.time()
+
+        index = dict((n, i) for i, n in enumerate(names))
+        existing = set()
+        for margs in self.flock.managed.values():
+            l, r = margs[:2]
+            if l in index and r in index:
+                existing.add((index[l], index[r]))
+        x = candidates.feature_matrix(feats)
+        pairs = candidates.select(x, args.neighbours, existing)
+        print 'Chose %d edges between %d nodes in %.1f s (loading %.1f s)' % (
+                len(pairs), len(names), time.time() - loaded,
+                loaded - start)
+
+        lines = []
+        for i, j in sorted(pairs):
+            for l, r in ((i, j), (j, i)):
+                if (l, r) not in existing:
+                    lines.append(' '.join([names[l], names[r]] + opts))
+        if args.dry_run:
+            print '\n'.join(lines)
+            return
+        with open('edges/managed.txt', 'a') as fp:
+            for line in lines:
+                fp.write(line + '\n')
+        print 'Added %d lines to edges/managed.txt.' % len(lines)
+        self._git_check_status('edges/managed.txt')
 
     def load_edge(self, edge):
         # TODO: check for changes in linked edges and warn/error
         name, path, rev, managed = self.flock.find_edge(edge)
         if managed:
-            path = self.cache_managed_edge(name, path, rev)
+            path = self.cache_managed_edge(name)
         with open(path) as fp:
             return genome.Genome(json.load(fp)), name, rev
 
-    def cmd_render(self, args):
+    def select_edges(self, args):
+        """Choose the edges to work on from the arguments of 'render'."""
         if args.edges:
             if args.match:
-                edges = set(sum(map(self.flock.match_edges, args.edges), []))
-            else:
-                edges = args.edges
+                return set(sum(map(self.flock.match_edges, args.edges), []))
+            return args.edges
+        if self.flock.dirty:
+            sys.exit('Index or working copy has uncommitted changes.\n'
+                     'Commit them or specify specific edges to render.')
+        scores = None
+        if args.min_score is not None:
+            scores = self.edge_scores(self.flock.managed)
+        edges = self.flock.list_flock(args.randomize,
+                not args.ignore_ratings, args.committed, args.thresh,
+                scores, args.min_score)
+        if args.graph:
+            edges = graph.build(self.flock).render_order(edges,
+                                                         self.edge_weight)
+        return edges
+
+    def edge_weight(self, edge):
+        """Return how strongly playlists should favour 'edge'."""
+        return max(self.flock.get_rating(edge), 0.1) ** 2
+
+    def cmd_playlist(self, args):
+        edges = self.flock.list_flock(thresh=args.thresh)
+        g = graph.build(self.flock).subgraph(set(edges))
+        rng = np.random.RandomState(args.seed)
+        if args.length:
+            seqs = g.walk(args.length, self.edge_weight, rng)
         else:
-            if self.flock.dirty:
-                sys.exit('Index or working copy has uncommitted changes.\n'
-                         'Commit them or specify specific edges to render.')
-            # TODO: playlist mode
-            edges = self.flock.list_flock(args.randomize,
-                    not args.ignore_ratings, args.committed, args.thresh)
+            seqs = g.cover(self.edge_weight, rng)
+        for i, seq in enumerate(seqs):
+            if i:
+                print '# jump'
+            for edge in seq:
+                print edge
+
+    @staticmethod
+    def load_profile(pname):
+        return json.load(open(join('profiles', pname + '.json')))
 
-        ppath = join('profiles', args.profile + '.json')
-        prof = json.load(open(ppath))
+    def prepare_edge(self, pname, prof, edge):
+        """
+        Load an edge and set up its output directory for the given profile.
+        Returns (gnm, rev, odir, rt), where 'rt' is the list of (index, time)
+        pairs for every frame of the edge.
+        """
+        gnm, name, rev = self.load_edge(edge)
+        err, times = gnm.set_profile(prof)
+        odir = join('out', pname, edge, rev)
+        if not os.path.isdir(odir):
+            os.makedirs(odir)
+            self.start_log(odir, name, rev, times, prof)
+        if rev != 'untracked':
+            llink = join('out', pname, edge, 'latest')
+            if os.path.islink(llink):
+                os.unlink(llink)
+            os.symlink(rev, llink)
+        return gnm, rev, odir, list(enumerate(times, 1))
+
+    def pass_frames(self, prof, rt, passes, p):
+        """Return the frames from 'rt' rendered in pass 'p' of 'passes'."""
+        return rt[::(prof['skip']+1)*(2**(passes-p-1))]
+
+    def edge_frames(self, args, prof, gnm, rt, p):
+        """
+        Return the frames of an edge to render in pass 'p', in the order given
+        by the '--order' and '-r' arguments. Progressive orders take a single
+        pass. With '--adaptive', frames the motion plan can do without are
+        left out.
+        """
+        keep = None
+        if args.adaptive:
+            keep = set(self.motion_plan(prof, gnm, rt, args.adaptive)[2])
+        if args.order != 'linear':
+            rt = rt[::prof['skip']+1]
+            rates = None
+            if args.order == 'motion':
+                rates = motion.change_rates(gnm, [r[1] for r in rt])
+            rt = schedule.order_frames(rt, args.order, rates)
+        else:
+            rt = self.pass_frames(prof, rt, args.passes, p)
+            if args.randomize:
+                np.random.shuffle(rt)
+        if keep is not None:
+            rt = [r for r in rt if r[0] in keep]
+        return rt
+
+    def motion_plan(self, prof, gnm, rt, thresh, max_stride=8):
+        """
+        Plan which frames of an edge need rendering, given its motion (see
+        motion.plan_spans). Returns (velocities, spans, indices of needed
+        frames), over the frames selected by the profile's skip.
+        """
+        rt = rt[::prof['skip']+1]
+        times = [r[1] for r in rt]
+        vel = motion.visual_velocity(gnm, times)
+        spans = motion.plan_spans(vel, motion.frame_step(times), thresh,
+                                  max_stride)
+        return vel, spans, [rt[i][0] for i in motion.needed_frames(spans)]
+
+    def cmd_motion(self, args):
+        prof = self.load_profile(args.profile)
+        edges = args.edges or self.flock.list_flock()
+        self.blend_managed([e for e in edges if e in self.flock.managed])
+        for edge in edges:
+            gnm, name, rev = self.load_edge(edge)
+            err, times = gnm.set_profile(prof)
+            rt = list(enumerate(times, 1))
+            vel, spans, needed = self.motion_plan(prof, gnm, rt, args.thresh,
+                                                  args.max_stride)
+            motion.report(edge, vel, spans)
+
+    def cmd_render(self, args):
+        edges = self.select_edges(args)
+        prof = self.load_profile(args.profile)
 
-        for p in range(args.passes):
+        # Blend everything up front, rather than stalling the render loop
+        self.blend_managed([e for e in edges if e in self.flock.managed])
+
+        if args.schedule:
+            return self.render_scheduled(args, edges, prof)
+
+        for p in range(args.passes if args.order == 'linear' else 1):
             for edge in edges:
                 print 'Rendering %s' % edge
-                gnm, name, rev = self.load_edge(edge)
-                err, times = gnm.set_profile(prof)
-                odir = join('out', args.profile, edge, rev)
-                if not os.path.isdir(odir):
-                    os.makedirs(odir)
-                    self.start_log(odir, name, rev, times, prof)
-
-                rt = list(enumerate(times, 1))
-                rt = rt[::(prof['skip']+1)*(2**(args.passes-p-1))]
-                if args.randomize:
-                    np.random.shuffle(rt)
+                gnm, rev, odir, rt = self.prepare_edge(args.profile, prof,
+                                                       edge)
+                rt = self.edge_frames(args, prof, gnm, rt, p)
 
                 if rev != 'untracked':
-                    llink = join('out', args.profile, edge, 'latest')
-                    if os.path.islink(llink):
-                        os.unlink(llink)
-                    os.symlink(rev, llink)
-                    rt = (r for r in rt if not isfile(self.topath(odir, r[0])))
+                    rt = FrameManifest.load(odir).missing(rt)
                 self.render_frames(odir, gnm, prof, rt)
 
-    @staticmethod
-    def start_log(odir, name, rev, times, prof):
+    def plan_edge(self, args, prof, edge):
+        """
+        Return a schedule.EdgePlan of the unrendered frames of an edge, by
+        index only. The number of frames is taken from the log of the edge's
+        output directory if there is one, and otherwise from its genome, which
+        is not kept; either way, nothing is written.
+        """
+        stride = prof['skip'] + 1
+        rev = self.flock.find_edge(edge)[2]
+        odir = join('out', args.profile, edge, rev)
+        header, frames = read_log(odir)
+        if header.get('nf') is not None:
+            # The log rounds the count down, so allow for one frame more
+            end = header['nf'] * stride + 1
+        else:
+            end = len(self.load_edge(edge)[0].set_profile(prof)[1])
+        rt = [(i, None) for i in range(1, end + 1, stride)]
+        if rev != 'untracked':
+            done = FrameManifest.load(odir)
+            rt = [r for r in rt if r[0] not in done]
+        # Frame costs rarely change much between revisions
+        frames = (frames or
+                  read_log(join('out', args.profile, edge, 'latest'))[1])
+        return schedule.EdgePlan(edge, rt, stride, frames)
+
+    def scheduled_work(self, args, edges, prof):
+        """
+        Order the unrendered frames of 'edges' by the policy given in
+        'args.schedule'. Yields (edge, gnm, rev, odir, rt) tuples. Edges are
+        planned from their logs where possible, and only prepared, one at a
+        time, as the policy reaches them.
+        """
+        plans = [self.plan_edge(args, prof, edge) for edge in edges]
+        prepared = None
+        for edge, chunk in schedule.order(plans, args.schedule):
+            if not prepared or prepared[0] != edge:
+                prepared = (edge,) + self.prepare_edge(args.profile, prof,
+                                                       edge)
+            gnm, rev, odir, rt = prepared[1:]
+            want = set(r[0] for r in chunk)
+            rt = [r for r in rt if r[0] in want]
+            if rt:
+                yield edge, gnm, rev, odir, rt
+
+    def render_scheduled(self, args, edges, prof):
+        for edge, gnm, rev, odir, rt in self.scheduled_work(args, edges, prof):
+            print 'Rendering %s (%d frames)' % (edge, len(rt))
+            if rev != 'untracked':
+                rt = FrameManifest.load(odir).missing(rt)
+            self.render_frames(odir, gnm, prof, rt)
+
+    def cmd_serve(self, args):
+        edges = self.select_edges(args)
+        prof = self.load_profile(args.profile)
+        self.blend_managed([e for e in edges if e in self.flock.managed])
+
+        tasks, seen = [], set()
+        if args.schedule:
+            for edge, gnm, rev, odir, rt in self.scheduled_work(args, edges,
+                                                                prof):
+                tasks.extend((edge, rev, r[0]) for r in rt)
+        passes = args.passes if args.order == 'linear' else 1
+        for p in range(0 if args.schedule else passes):
+            for edge in edges:
+                gnm, rev, odir, rt = self.prepare_edge(args.profile, prof,
+                                                       edge)
+                rt = self.edge_frames(args, prof, gnm, rt, p)
+                done = FrameManifest.load(odir)
+                for idx, t in rt:
+                    if (edge, idx) in seen: continue
+                    seen.add((edge, idx))
+                    if rev == 'untracked' or idx not in done:
+                        tasks.append((edge, rev, idx))
+
+        queue = farm.FrameQueue(tasks, args.lease)
+        server = farm.FarmServer(farm.parse_addr(args.addr), queue,
+                                 dict(profile=args.profile))
+        print 'Serving %d frames on %s:%d' % ((len(tasks),) +
+                                              server.server_address)
+        server.serve_until_finished()
+        print 'All frames rendered.'
+
+    def cmd_host(self, args):
+        worker = self.info['worker']
+        client = farm.FarmClient(farm.parse_addr(args.server, 'localhost'))
+        edges = {}
+
+        def render(resp):
+            pname, tasks = resp['profile'], resp['tasks']
+            edge, rev = tasks[0][:2]
+            if (pname, edge) not in edges:
+                prof = self.load_profile(pname)
+                edges[pname, edge] = (prof,) + self.prepare_edge(pname, prof,
+                                                                 edge)
+            prof, gnm, myrev, odir, rt = edges[pname, edge]
+            if myrev != rev:
+                sys.exit('Server wants %s at %s, but this checkout has %s.' %
+                         (edge, rev, myrev))
+            times = dict(rt)
+            self.render_frames(odir, gnm, prof,
+                               [(t[2], times[t[2]]) for t in tasks])
+            return [(edge, t[2]) for t in tasks]
+
+        try:
+            farm.run_host(client, worker, render, args.count)
+        except socket.error, e:
+            sys.exit('Lost the server at %s:%d (%s).' % (client.addr + (e,)))
+
+    def start_log(self, odir, name, rev, times, prof):
         with open(join(odir, 'log.txt'), 'w') as fp:
-            fp.write('%s rev=%s nf=%d\n' %
-                     (name, rev, len(times) / (prof['skip']+1)))
+            fp.write(log_record(name=name, rev=rev,
+                                nf=len(times) / (prof['skip']+1),
+                                time=round(time.time(), 3), **self.info))
 
     @staticmethod
-    def topath(odir, idx):
-        return join(odir, '%05d.jpg' % idx)
+    def topath(odir, idx, ext='jpg'):
+        if ext == 'raw':
+            # Every frame shares the one array file
+            return join(odir, framearray.NAME)
+        return join(odir, '%05d.%s' % (idx, ext))
 
-    def render_frames(self, odir, gnm, prof, rt):
-        import scipy
-        import pycuda.autoinit
+    def frame_loader(self, ext, rgb8=False):
+        """
+        Return a function which loads frame 'idx' of the output directory
+        'odir', given the pair (odir, idx), as 8-bit RGB if 'rgb8' is set and
+        as float RGB in [0, 1] otherwise. Frames in array files are read in
+        place, without decoding; each array is opened once, and again only
+        if it has grown past the frames it held when opened.
+        """
+        if ext == 'raw':
+            arrays = {}
+            def load((odir, idx)):
+                arr = arrays.get(odir)
+                if arr is None or idx > len(arr):
+                    arr = framearray.FrameArray(self.topath(odir, idx, ext))
+                    arrays[odir] = arr
+                return arr.rgb8(idx) if rgb8 else arr.rgb(idx)
+        elif rgb8:
+            load = lambda (odir, idx): encode.load_image(
+                    self.topath(odir, idx, ext))
+        else:
+            load = lambda (odir, idx): metrics.load_frame(
+                    self.topath(odir, idx, ext))
+        return load
 
-        renderer = render.Renderer()
+    def backend(self, prof):
+        """
+        Return the renderer backend for a profile, creating it on first use
+        (which, for CUDA, must happen on the thread that renders).
+        """
+        name = backends.backend_name(prof, self._backend)
+        if name not in self._backends:
+            self._backends[name] = backends.BACKENDS[name]()
+        return self._backends[name]
+
+    def render_frames(self, odir, gnm, prof, rt, reuse=True):
+        """
+        Render the frames 'rt' of 'gnm' into 'odir'. Unless 'reuse' is
+        False, frames are taken from and added to the frame store.
+        """
+        backend = self.backend(prof)
         w, h = prof['width'], prof['height']
-        for out in renderer.render(gnm, rt, w, h):
-            noalpha = out.buf[:,:,:3]
-            img = scipy.misc.toimage(noalpha, cmin=0, cmax=1)
-            path = self.topath(odir, out.idx)
-            img.save(path, quality=95)
-            with open(join(odir, 'log.txt'), 'a') as fp:
-                # TODO: add unique GPU id, other frame stats
-                fp.write('%d g=%d\n' % (out.idx, out.gpu_time))
-            print 'Wrote %s (took %5d ms)' % (path, out.gpu_time)
+        enc = frame_saver(prof)
+        topath = lambda odir, idx: self.topath(odir, idx, enc.ext)
+        info = dict(self.info, gpu=backend.device)
+        revs = self.info['revs']
+        if backend.name != backends.DEFAULT_BACKEND:
+            info['backend'] = backend.name
+            revs = dict(revs, backend=backend.name)
+        # Frames can only be shared if we know which renderer made them, and
+        # if they are stored as separate files
+        fstore = None
+        if (reuse and UNTR[1] not in self.info['revs'].values()
+                and enc.ext != 'raw'):
+            fstore = store.FrameStore(prof, revs, enc.ext)
+        with FrameWriter(odir, topath, enc, info=info, store=fstore) as writer:
+            if fstore:
+                rt = writer.reuse(rt, lambda r: fstore.key(gnm, r[1]))
+            last = time.time()
+            for out in backend.render(gnm, rt, w, h):
+                now = time.time()
+                writer.write(out.idx, out.buf[:,:,:3], out.gpu_time,
+                             int((now - last) * 1000))
+                last = now
+
+    def live_frames(self, prof, edge):
+        """Render every frame of an edge, yielding 8-bit RGB arrays."""
+        gnm, name, rev = self.load_edge(edge)
+        err, times = gnm.set_profile(prof)
+        rt = list(enumerate(times, 1))[::prof['skip']+1]
+        enc = FrameEncoder.from_profile(prof)
+        for out in self.backend(prof).render(gnm, rt, prof['width'],
+                                             prof['height']):
+            yield enc.convert(out.buf)
+
+    def cmd_encode(self, args):
+        prof = self.load_profile(args.profile)
+        edges = list(args.edges)
+        if args.playlist:
+            edges.extend(parse_simple(args.playlist))
+        if not edges:
+            sys.exit('No edges to encode.')
+        name = edges[0].replace('/', '_')
+        if args.playlist:
+            name = os.path.basename(args.playlist).rsplit('.', 1)[0]
+        out = args.out or name + '.mp4'
+
+        # Check every edge before starting the encoder
+        ext = frame_ext(prof)
+        load = self.frame_loader(ext, rgb8=True)
+        sources = []
+        for edge in edges:
+            if args.render:
+                sources.append((edge, None))
+                continue
+            rev = self.flock.find_edge(edge)[2]
+            odir = join('out', args.profile, edge, rev)
+            idxs, nf = encode.edge_frames(odir)
+            if not idxs or nf is None or len(idxs) < nf:
+                msg = '%s has %d of %s frames' % (edge, len(idxs), nf or '?')
+                if not args.force:
+                    sys.exit(msg + '; use "-f" to encode it anyway.')
+                print 'Warning: ' + msg
+            sources.append((edge, [(odir, i) for i in idxs]))
+        if args.render:
+            self.blend_managed([e for e in edges if e in self.flock.managed])
+
+        fps = prof['fps'] / float(prof['skip'] + 1)
+        enc = encode.VideoEncoder(out, prof['width'], prof['height'], fps,
+                                  args.command or encode.DEFAULT_COMMAND)
+        try:
+            for edge, items in sources:
+                if items is None:
+                    frames = self.live_frames(prof, edge)
+                else:
+                    frames = encode.prefetch(items, load)
+                for frame in frames:
+                    enc.write(frame)
+                print 'Encoded %s' % edge
+            enc.close()
+        except encode.EncodeError, e:
+            sys.exit(str(e))
+        enc.report()
+        print 'Wrote %s.' % out
 
     def blend(self, args):
         # TODO: check for canonicity of edges
         lname, lpath, lrev, m = self.flock.find_edge(args.left)
         rname, rpath, rrev, m = self.flock.find_edge(args.right)
         name = '%s=%s' % (lname, rname)
-        l, r = [genome.Genome(json.load(open(p))) for p in (lpath, rpath)]
         try:
-            bl = blend.blend_genomes(l, r, nloops=args.nloops,
-                align=args.align, stagger=args.stagger, blur=args.blur)
+            gnm = blendcache.blend_edge(lname, lpath, rname, rpath,
+                                        blendcache.blend_opts(args))
         except:
             print '\nWhile blending %s and %s:' % (lname, rname)
             traceback.print_exc()
             # TODO: propagate? nah, don't think so
             sys.exit('Error creating %s' % name)
-        bl['link'] = {'left': lname, 'right': rname}
-        return name, min(lrev, rrev)[1], genome.json_encode_genome(bl)
+        return name, min(lrev, rrev)[1], gnm
 
     def cmd_blend(self, args):
         name, paths, gnm = self.blend(args)
@@ -383,6 +809,17 @@ class Flockutil(object):
         with open('.flockrc', 'w') as fp:
             fp.write('\n'.join(map(' '.join, cfg.items())))
 
+    def cmd_stats(self, args):
+        edges = self.flock.list_flock(rating=False, thresh=args.thresh)
+        if not args.profiles:
+            args.profiles = [p[9:-5] for p in glob('profiles/*.json')]
+        for pname in sorted(args.profiles):
+            logs = []
+            for edge in edges:
+                rev = self.flock.find_edge(edge)[2]
+                logs.append((edge,) + read_log(join('out', pname, edge, rev)))
+            stats.report(pname, logs, args.verbose)
+
     def cmd_update(self, args):
         assert not self.flock.dirty, 'Repository is dirty.'
         edges = self.flock.list_flock()
@@ -391,73 +828,122 @@ class Flockutil(object):
         if not args.profiles:
             args.profiles = [p[9:-5] for p in glob('profiles/*.json')]
 
+        # Plan every check first, so that those which can be decided without
+        # rendering don't wait behind those which can't
+        summary, jobs = workers.Summary(), []
         for pname in args.profiles:
-            prof = json.load(open(join('profiles', pname + '.json')))
+            prof = self.load_profile(pname)
             for edge in edges:
-                print '\n', pname, edge
                 ldir = os.path.realpath(join('out', pname, edge, 'latest'))
-                if not os.path.isdir(ldir): continue
-                # TODO: determine ext from output format
-                idxs = [int(i.rsplit('/', 1)[-1].rsplit('.', 1)[0])
-                        for i in glob(ldir + '/*.jpg')]
-                if len(idxs) < 10 * args.nframes: continue
-                gnm, name, rev = self.load_edge(edge)
+                if not os.path.isdir(ldir):
+                    summary.add('Skipped, nothing rendered', (pname, edge))
+                    continue
+                rev = self.flock.find_edge(edge)[2]
                 odir = join('out', pname, edge, rev)
-                if os.path.isdir(odir): continue
-
-                def cmp(d1, d2, rt, thresh=0):
-                    for i, t in rt:
-                        # TODO: implement SSIM
-                        p1, p2 = self.topath(d1, i), self.topath(d2, i)
-                        cmp = check_output(['compare', '-metric', 'RMSE',
-                                    p1, p2, '/tmp/ignore.jpg'], stderr=STDOUT)
-                        v = float(cmp.split('(')[1].split(')')[0])
-                        print 'Frame %05d: %g' % (i, v)
-                        if v > thresh:
-                            yield ((i, t), v)
-
-                err, times = gnm.set_profile(prof)
-                if len(times) < max(idxs): continue
-                rt = list(enumerate(times, 1))
-                rt = [rt[i-1] for i in random.sample(idxs, args.nframes)]
-
-                with TemporaryDir() as tdir:
-                    cp = lambda: shutil.copytree(tdir, odir)
-
-                    print 'Rendering frames for comparaison'
-                    self.start_log(tdir, name, rev, times, prof)
-                    try:
-                        retry = {}
-                        if args.reldiff <= 1:
-                            # Try one frame at first for early exit
-                            self.render_frames(tdir, gnm, prof, rt[:1])
-                            retry = dict(cmp(ldir, tdir, rt[:1], args.diff))
-                            rt = rt[1:]
-                        if not retry:
-                            self.render_frames(tdir, gnm, prof, rt)
-                            retry = dict(cmp(ldir, tdir, rt, args.diff))
-                    except CalledProcessError:
-                        cp()
-                        continue
-
-                    if retry:
-                        print 'Absolute threshold exceeded'
-                        if args.reldiff <= 1:
-                            cp()
-                            continue
-                        print 'Computing self-similarity for relative threshold'
-                        with TemporaryDir() as tdir2:
-                            self.render_frames(tdir2, gnm, prof, retry.keys())
-                            retried = dict(cmp(tdir, tdir2, retry.keys()))
-                            hi = max(retry[k] / retried[k] for k in retry)
-                            print hi
-                            if hi > args.reldiff:
-                                print 'Relative threshold exceeded (%g)' % hi
-                                cp()
-                                continue
-
-                print 'Looks good, linking to old revid'
-                os.symlink(os.path.relpath(ldir, os.path.dirname(odir)), odir)
+                if os.path.isdir(odir):
+                    summary.add('Skipped, up to date', (pname, edge))
+                    continue
+                idxs = list(FrameManifest.load(ldir).indices())
+                if len(idxs) < 10 * args.nframes:
+                    summary.add('Skipped, too few frames', (pname, edge))
+                    continue
+                jobs.append((pname, prof, edge, ldir, idxs))
+
+        self.blend_managed(set(j[2] for j in jobs) & set(self.flock.managed))
+        service = workers.RenderService()
+        failed = workers.run_pool(jobs,
+                lambda job: self.check_update(args, service, summary, *job),
+                args.jobs, service)
+        for job in failed:
+            summary.add('Failed', job[:3:2])
+        print
+        summary.report(' '.join)
+
+    def compare_frames(self, d1, d2, rt, metric, ext, log, thresh=None):
+        """
+        Compare the frames in 'rt' between two output directories. Yields
+        ((idx, time), difference) for each frame whose difference is above
+        'thresh', or for every frame if 'thresh' is None.
+        """
+        vals = metrics.compare([((d1, i), (d2, i)) for i, t in rt], metric,
+                               load=self.frame_loader(ext))
+        for (i, t), v in zip(rt, vals):
+            log('Frame %05d: %g' % (i, v))
+            if thresh is None or v > thresh:
+                yield ((i, t), v)
+
+    @staticmethod
+    def relative_diff(diffs, noise):
+        """
+        Return the largest ratio of a frame's difference from the old render
+        ('diffs') to its difference between two new renders ('noise'), both
+        dicts keyed alike. Frames the renderer reproduces exactly count as
+        having a tiny amount of noise.
+        """
+        return max(diffs[k] / max(noise.get(k, 0), 1e-9) for k in diffs)
+
+    def check_update(self, args, service, summary, pname, prof, edge, ldir,
+                     idxs):
+        """
+        Render test frames for an edge whose revid has changed, and link its
+        new output directory to 'ldir' if they match, or start the new
+        directory with the test frames if they don't.
+        """
+        ext = frame_ext(prof)
+        gnm, name, rev = self.load_edge(edge)
+        odir = join('out', pname, edge, rev)
+        log = lambda msg: sys.stdout.write('%s %s: %s\n' % (pname, edge, msg))
+        # Test renders stay out of the frame store: a second render of the
+        # same frames must not be linked from the first, or it would always
+        # measure the renderer's noise as zero
+        render = lambda odir, rt: service.call(self.render_frames, odir, gnm,
+                                               prof, rt, False)
+
+        cmp = lambda d1, d2, rt, thresh=None: self.compare_frames(
+                d1, d2, rt, args.metric, ext, log, thresh)
+
+        err, times = gnm.set_profile(prof)
+        if len(times) < max(idxs):
+            summary.add('Skipped, length changed', (pname, edge))
+            return
+        rt = list(enumerate(times, 1))
+        rt = [rt[i-1] for i in random.sample(idxs, args.nframes)]
+
+        with TemporaryDir() as tdir:
+            def cp(why):
+                log(why)
+                shutil.copytree(tdir, odir)
+                summary.add('Needs rendering', (pname, edge))
+
+            log('Rendering frames for comparison')
+            self.start_log(tdir, name, rev, times, prof)
+            try:
+                retry = {}
+                if args.reldiff <= 1:
+                    # Try one frame at first for early exit
+                    render(tdir, rt[:1])
+                    retry = dict(cmp(ldir, tdir, rt[:1], args.diff))
+                    rt = rt[1:]
+                if not retry:
+                    render(tdir, rt)
+                    retry = dict(cmp(ldir, tdir, rt, args.diff))
+            except (IOError, ValueError, IndexError):
+                return cp('Could not compare with old frames')
+
+            if retry:
+                if args.reldiff <= 1:
+                    return cp('Absolute threshold exceeded')
+                log('Computing self-similarity for relative threshold')
+                with TemporaryDir() as tdir2:
+                    render(tdir2, retry.keys())
+                    hi = self.relative_diff(
+                            retry, dict(cmp(tdir, tdir2, retry.keys())))
+                    if hi > args.reldiff:
+                        return cp('Relative threshold exceeded (%g)' % hi)
+
+        log('Looks good, linking to old revid')
+        os.symlink(os.path.relpath(ldir, os.path.dirname(odir)), odir)
+        summary.add('Linked', (pname, edge))
 
 @contextmanager
 def TemporaryDir():
@@ -0,0 +1,138 @@
+"""
+Lossless storage of an edge's frames in a single memory-mapped array file.
+
+With the 'raw' output format, frames are stored as 8-bit RGB, and with
+'raw16' as the renderer's float RGB values in float16, before clipping or
+rounding. Either way they go into 'frames.raw' in the output directory rather
+than one image file per frame. The file starts with a JSON header, padded to
+HEADER_SIZE bytes, followed by a fixed-size slot for each frame in index
+order, starting at 1. Writers seek to a frame's slot and write it, so frames
+can be written in any order, by any number of threads or processes, and the
+file grows sparsely as needed. Readers map the file and get frames as arrays
+without copying or decoding them; which slots hold frames is known from the
+output directory's manifest, as for image files.
+"""
+
+import os
+import json
+import threading
+import numpy as np
+
+NAME = 'frames.raw'
+MAGIC = 'flockutil-array 1'
+HEADER_SIZE = 4096
+
+# Output formats stored as arrays, and the dtype of each.
+DTYPES = {'raw': 'uint8', 'raw16': 'float16'}
+
+def read_header(path):
+    with open(path, 'rb') as fp:
+        head = json.loads(fp.read(HEADER_SIZE).rstrip())
+    if head.get('magic') != MAGIC:
+        raise ValueError('%s is not a frame array' % path)
+    return np.dtype(str(head['dtype'])), tuple(head['shape'])
+
+def create(path, shape, dtype):
+    """
+    Create an empty array file at 'path' for frames of the given shape and
+    dtype, unless one exists. Raises ValueError if an existing file holds
+    frames of a different kind.
+    """
+    dtype = np.dtype(dtype)
+    if not os.path.isfile(path):
+        head = json.dumps(dict(magic=MAGIC, dtype=dtype.name,
+                               shape=list(shape)))
+        tmp = '%s.%d.%d' % (path, os.getpid(),
+                            threading.current_thread().ident)
+        with open(tmp, 'wb') as fp:
+            fp.write(head.ljust(HEADER_SIZE))
+        try:
+            # Unlike a rename, this fails rather than replacing an array
+            # which another writer created in the meantime
+            os.link(tmp, path)
+        except OSError:
+            if not os.path.isfile(path): raise
+        finally:
+            os.unlink(tmp)
+    if read_header(path) != (dtype, tuple(shape)):
+        raise ValueError('%s holds frames of a different kind' % path)
+
+def write_frame(path, idx, frame):
+    """Write 'frame' to slot 'idx' of the array file at 'path'."""
+    frame = np.ascontiguousarray(frame)
+    with open(path, 'r+b') as fp:
+        fp.seek(HEADER_SIZE + (idx - 1) * frame.nbytes)
+        fp.write(frame.data)
+
+class FrameArray(object):
+    """
+    An array file opened for reading. Only slots which existed when it was
+    opened can be read.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.dtype, self.shape = read_header(path)
+        size = np.prod(self.shape) * self.dtype.itemsize
+        self.count = (os.path.getsize(path) - HEADER_SIZE) / size
+        self.data = np.zeros((0,) + self.shape, self.dtype)
+        if self.count:
+            self.data = np.memmap(path, self.dtype, 'r', HEADER_SIZE,
+                                  (self.count,) + self.shape)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx):
+        """Return frame 'idx' as it is stored, as a view of the file."""
+        if not 1 <= idx <= self.count:
+            raise IndexError('Frame %d is not in %s' % (idx, self.path))
+        return self.data[idx - 1]
+
+    def rgb8(self, idx):
+        """Return frame 'idx' as 8-bit RGB, without copying if possible."""
+        frame = self[idx]
+        if self.dtype == np.uint8:
+            return frame
+        out = frame * np.float32(255)
+        out += 0.5
+        np.clip(out, 0, 255, out)
+        return out.astype(np.uint8)
+
+    def rgb(self, idx):
+        """Return frame 'idx' as float32 RGB in [0, 1]."""
+        frame = self[idx]
+        if self.dtype == np.uint8:
+            return frame / np.float32(255)
+        return np.clip(frame.astype(np.float32), 0, 1)
+
+class ArrayEncoder(object):
+    """
+    Stores frames in array files. Instances are callable as the 'save'
+    argument to FrameWriter, like output.FrameEncoder.
+    """
+    ext = 'raw'
+
+    def __init__(self, format='raw', **kwargs):
+        from output import FrameEncoder
+        self.dtype = np.dtype(DTYPES[format])
+        # Does the conversion to 8 bits, with dithering if asked for
+        self.enc = FrameEncoder(dither=kwargs.get('dither', False))
+        self.created = set()
+        self.lock = threading.Lock()
+
+    def convert(self, buf):
+        return self.enc.convert(buf)
+
+    def __call__(self, path, buf, idx):
+        """Store frame 'idx'. Returns the number of bytes written."""
+        buf = buf[:,:,:3]
+        if self.dtype == np.uint8:
+            buf = self.convert(buf)
+        else:
+            buf = buf.astype(self.dtype)
+        with self.lock:
+            if path not in self.created:
+                create(path, buf.shape, self.dtype)
+                self.created.add(path)
+        write_frame(path, idx, buf)
+        return buf.nbytes
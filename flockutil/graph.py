@@ -0,0 +1,170 @@
+"""
+The flock as a graph, for playlists and render ordering.
+
+Nodes are reference genomes, and each edge runs from the node in its 'left'
+link to the node in its 'right' link. A loop (linked to 'loop' or
+'reference') runs from its own node back to itself. Managed edges take their
+nodes from their line in managed.txt.
+
+A playlist is a sequence of edges in which each edge starts where the last
+one ended, so that it plays without a cut. Where no such edge is left, the
+playlist has to jump, which splits it into separate sequences.
+"""
+
+import json
+from collections import deque
+
+import numpy as np
+
+def node_name(value, own, paths):
+    """
+    Return the node a link value refers to. 'own' is the node of the edge
+    itself, and 'paths' the set of paths in the repository.
+    """
+    if value in ('loop', 'reference'):
+        return own
+    for name in (value, 'reference/' + value):
+        if 'edges/%s.json' % name in paths:
+            return name
+    return value
+
+class FlockGraph(object):
+    def __init__(self):
+        # edge name -> (left node, right node)
+        self.edges = {}
+        # node -> list of (edge name, right node), in insertion order
+        self.out = {}
+
+    def add(self, edge, left, right):
+        self.edges[edge] = (left, right)
+        self.out.setdefault(left, []).append((edge, right))
+        self.out.setdefault(right, [])
+
+    def subgraph(self, edges):
+        """Return the graph of only those edges in 'edges'."""
+        g = FlockGraph()
+        for e, (l, r) in sorted(self.edges.items()):
+            if e in edges:
+                g.add(e, l, r)
+        return g
+
+    def path_to(self, start, want):
+        """
+        Return the shortest list of edges from 'start' to a node for which
+        'want' returns True, or None if there is none.
+        """
+        prev = {start: None}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if want(node):
+                path = []
+                while prev[node]:
+                    edge, node = prev[node]
+                    path.append(edge)
+                return path[::-1]
+            for edge, right in self.out.get(node, ()):
+                if right not in prev:
+                    prev[right] = (edge, node)
+                    queue.append(right)
+        return None
+
+    def choose(self, cands, weight, rng):
+        """Pick one (edge, right) pair, randomly by weight if 'rng' is set."""
+        w = np.array([weight(e) for e, r in cands], float)
+        if rng is None:
+            return cands[int(np.argmax(w))]
+        return cands[rng.choice(len(cands), p=w / w.sum())]
+
+    def best_start(self, edges, weight):
+        """Return the left node of the heaviest edge in 'edges'."""
+        return self.edges[max(sorted(edges), key=weight)][0]
+
+    def cover(self, weight, rng=None):
+        """
+        Return a playlist which plays every edge at least once, as a list of
+        sequences of edge names. Edges are taken by 'weight' (at random in
+        proportion to it if 'rng' is given, otherwise heaviest first); when
+        there is no unplayed edge leaving the current node, the playlist
+        follows the shortest path to one which has, replaying edges, and
+        only jumps if there is no such path. On a graph where every node has
+        as many edges in as out, such as one from 'addEdges', this tends to
+        an Eulerian circuit.
+        """
+        unplayed = set(self.edges)
+        seqs = []
+        while unplayed:
+            node = self.best_start(unplayed, weight)
+            seq = []
+            while unplayed:
+                cands = [(e, r) for e, r in self.out[node] if e in unplayed]
+                if not cands:
+                    has = lambda n: any(e in unplayed for e, r in self.out[n])
+                    path = self.path_to(node, has)
+                    if path is None:
+                        break
+                    seq.extend(path)
+                    node = self.edges[path[-1]][1] if path else node
+                    continue
+                edge, node = self.choose(cands, weight, rng)
+                seq.append(edge)
+                unplayed.discard(edge)
+            seqs.append(seq)
+        return seqs
+
+    def walk(self, length, weight, rng=None):
+        """
+        Return a playlist of 'length' edges as a list of sequences, choosing
+        each edge by 'weight' divided by one more than the number of times it
+        has already been played, so that good edges come up often without
+        the walk getting stuck on them. Jumps to a new start at dead ends.
+        """
+        plays = dict((e, 0) for e in self.edges)
+        w = lambda e: weight(e) / (1. + plays[e])
+        seqs, count = [], 0
+        while count < length and self.edges:
+            node = self.best_start(self.edges, w)
+            seq = []
+            while count < length and self.out[node]:
+                edge, node = self.choose(self.out[node], w, rng)
+                seq.append(edge)
+                plays[edge] += 1
+                count += 1
+            seqs.append(seq)
+        return seqs
+
+    def render_order(self, edges, weight):
+        """
+        Order 'edges' so that those forming continuous sequences come first:
+        by first appearance in a covering playlist over just those edges.
+        Edges not in the graph go last, in their original order.
+        """
+        seen = set()
+        order = []
+        for seq in self.subgraph(set(edges)).cover(weight):
+            for e in seq:
+                if e not in seen:
+                    seen.add(e)
+                    order.append(e)
+        return order + [e for e in edges if e not in seen]
+
+def build(flock):
+    """Build the graph of every committed and managed edge in a Flock."""
+    g = FlockGraph()
+    paths = set(flock.paths)
+    for path in sorted(paths):
+        if not (path.startswith('edges/') and path.endswith('.json')):
+            continue
+        own = path[len('edges/'):-len('.json')]
+        try:
+            with open(path) as fp:
+                link = json.load(fp).get('link') or {}
+        except (IOError, ValueError):
+            continue
+        if 'left' in link and 'right' in link:
+            g.add(own.replace('/', '_'), node_name(link['left'], own, paths),
+                  node_name(link['right'], own, paths))
+    for name, args in sorted(flock.managed.items()):
+        g.add(name, node_name(args[0], None, paths),
+              node_name(args[1], None, paths))
+    return g
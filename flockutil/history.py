@@ -0,0 +1,127 @@
+"""
+A persistent index of the revision history of a flock.
+
+Walking the full output of 'git log' on every invocation gets slow once a
+flock has accumulated a few thousand commits. This module keeps the result of
+that walk in 'out/cache/history.json', keyed by the commit it was built at, and
+brings it up to date by reading only the commits added since then.
+"""
+
+import os
+import json
+from subprocess import check_call, check_output, CalledProcessError
+
+from revids import ShortRevs
+
+HISTORY_PATH = 'out/cache/history.json'
+
+# Increment when the on-disk format changes to force a rebuild.
+HISTORY_VERSION = 2
+
+def git_head():
+    return check_output(['git', 'rev-parse', 'HEAD']).strip()
+
+def is_ancestor(old, new):
+    """Return True if commit 'old' is reachable from commit 'new'."""
+    try:
+        with open(os.devnull, 'w') as null:
+            check_call(['git', 'merge-base', '--is-ancestor', old, new],
+                       stdout=null, stderr=null)
+    except CalledProcessError:
+        return False
+    return True
+
+def read_log(span=None):
+    """
+    Yield (revid, paths) for each commit in 'span' (or the entire history of
+    HEAD), newest first.
+    """
+    cmd = ['git', 'log', '--name-only', '--pretty=format:%x00%H']
+    if span:
+        cmd.append(span)
+    rev, paths = None, []
+    for line in check_output(cmd).split('\n'):
+        if line.startswith('\0'):
+            if rev is not None:
+                yield rev, paths
+            rev, paths = line[1:], []
+        elif line:
+            paths.append(line)
+    if rev is not None:
+        yield rev, paths
+
+class History(object):
+    """
+    The revisions of the current branch, and the revision at which each path
+    was last changed.
+
+    Revisions are numbered in the order they were added to the index, starting
+    from 0 for the root commit.
+    """
+    def __init__(self, head=None, revs=None, changed=None):
+        # JSON hands back unicode; git paths and revids are quoted ASCII
+        self.head = head and str(head)
+        # Full and abbreviated revids, oldest first
+        self.revs = ShortRevs.restore(revs) if revs else ShortRevs()
+        # Path -> number of the latest revision which changed it
+        self.changed = dict((str(k), v) for k, v in (changed or {}).items())
+
+    @classmethod
+    def load(cls, path=HISTORY_PATH):
+        """
+        Load the index from 'path' and bring it up to date with HEAD, writing
+        it back if anything changed. A missing or stale index is rebuilt.
+        """
+        head = git_head()
+        hist = None
+        if os.path.isfile(path):
+            try:
+                with open(path) as fp:
+                    d = json.load(fp)
+                if d.pop('version', None) == HISTORY_VERSION:
+                    hist = cls(**d)
+            except (ValueError, TypeError):
+                hist = None
+        if hist is not None and hist.head == head:
+            return hist
+        if hist is None or not is_ancestor(hist.head, head):
+            # No usable index, or history was rewritten
+            hist = cls()
+        hist.update(head)
+        hist.save(path)
+        return hist
+
+    def save(self, path=HISTORY_PATH):
+        dir = os.path.dirname(path)
+        if dir and not os.path.isdir(dir):
+            os.makedirs(dir)
+        d = dict(version=HISTORY_VERSION, head=self.head,
+                 revs=self.revs.dump(), changed=self.changed)
+        tmp = '%s.%d' % (path, os.getpid())
+        with open(tmp, 'w') as fp:
+            json.dump(d, fp, separators=(',', ':'))
+        os.rename(tmp, path)
+
+    def update(self, head):
+        """Add all commits between the indexed head and 'head'."""
+        span = '%s..%s' % (self.head, head) if self.head else head
+        for rev, paths in reversed(list(read_log(span))):
+            self.append(rev, paths)
+        self.head = head
+
+    def append(self, rev, paths):
+        num = len(self.revs)
+        self.revs.add(rev)
+        for p in paths:
+            self.changed[p] = num
+
+    def paths(self):
+        """
+        Return a dict mapping each path that exists in the working copy to a
+        tuple of (age, revid), where 'revid' is the abbreviated revid of the
+        latest revision to change that path, and 'age' is its position
+        counting back from HEAD (which is 1).
+        """
+        count, shorts = len(self.revs), self.revs.shorts
+        return dict((p, (count - n, shorts[n]))
+                    for p, n in self.changed.items() if os.path.exists(p))
@@ -57,11 +57,86 @@ def init(args):
     check_call(['git', 'add', '-A'])
     check_call(['git', 'commit', '-m', 'Initial commit.'])
 
+def add_render_args(p, cfg):
+    p.add_argument('edges', metavar='edge', nargs='*',
+            help='Edge or loop names to render.')
+    p.add_argument('-p', dest='profile', default=cfg.get('profile'),
+            help='Specify a profile. (Key: "profile")')
+    p.add_argument('-m', dest='match', action='store_true',
+            help='Match any edge whose name contains the given substring, '
+            'instead of matching names exactly.')
+    p.add_argument('-c', dest='committed', action='store_true',
+            help='Render committed edges before managed ones.')
+    p.add_argument('-g', dest='graph', action='store_true',
+            help='Render edges in playlist order, so that edges which play '
+            'in sequence without a cut are finished first. (See '
+            '"playlist".) Overrides the edge order from "-r" and "-c".')
+    p.add_argument('-r', dest='randomize', action='store_true',
+            help='Render edges and frames in random order. (Useful when '
+            'running multiple instances simultaneously.)')
+    p.add_argument('-t', dest='thresh', default=2, type=int,
+            help='Only render edges with at least this rating (2). (Unrated '
+            'edges have a default rating of 2.5.)')
+    p.add_argument('-q', dest='min_score', type=float,
+            default=cfg.get('min_score'),
+            help='Skip unrated managed edges whose blend quality score is '
+            'below this, from 0 to 1 (see "score"). (Key: "min_score")')
+    p.add_argument('--passes', default=1, type=int,
+            help='Skip 2^(passes-1) frames at first, come back for them later')
+    p.add_argument('--order', default='linear',
+            choices=('linear', 'progressive', 'motion'),
+            help='Order of frames within each edge. "progressive" renders '
+            'frames so that the rendered part of an edge is always spread '
+            'evenly over it; "motion" does the same, but favours parts of the '
+            'edge that change faster. Both override "--passes" and "-r". '
+            '(linear)')
+    p.add_argument('--adaptive', metavar='THRESH', type=float, const=0.005,
+            nargs='?', help='Only render the frames needed to follow the '
+            'motion of each edge (see "motion"), leaving the rest to be '
+            'interpolated or rendered later. (0.005)')
+    p.add_argument('--ignore-ratings', action='store_true',
+            help="Don't use ratings to sort render order.")
+    p.add_argument('-s', dest='schedule', choices=('complete', 'coverage'),
+            help='Order frames by estimated cost: "complete" finishes the '
+            'cheapest edges first, "coverage" renders a coarse version of '
+            'every edge first. Overrides "--passes", and can\'t be used with '
+            '"--order" or "--adaptive".')
+
+def add_blend_args(p):
+    p.add_argument('left', help='Name (or file) of genome to start at')
+    p.add_argument('right', help='Name (or file) of genome to end at')
+    p.add_argument('-a', dest='align', default='weightflip',
+            choices='natural weight weightflip color optimal'.split(),
+            help='Sort method used to align xforms, or "optimal" to pair '
+            'the most similar xforms (weightflip)')
+    p.add_argument('-b', dest='blur', metavar='STDEV', type=float, const=1.5,
+            nargs='?', help='Blur palettes during interpolation (1.5)')
+    p.add_argument('-l', dest='nloops', metavar='LOOPS', type=int, default=2,
+            help='Number of loops to use (also scales duration) (2)')
+    p.add_argument('-s', dest='stagger', action='store_true',
+            help='Use stagger (experimental!)')
+    p.add_argument('-o', dest='out', help='Output filename')
+
+_blend_parser = None
+
+def parse_blend_args(argv):
+    """Parse the arguments of a 'blend' command, as found in managed.txt."""
+    global _blend_parser
+    if _blend_parser is None:
+        _blend_parser = argparse.ArgumentParser(prog='blend')
+        add_blend_args(_blend_parser)
+    return _blend_parser.parse_args(argv)
+
 def mkparser():
     cfg = load_cfg('.flockrc') if os.path.isfile('.flockrc') else {}
 
     parser = argparse.ArgumentParser(description="Manage a flock.",
         epilog="Some options are required unless a default value is set.")
+    parser.add_argument('--backend', default=cfg.get('backend'),
+            choices=('cuda', 'cpu'),
+            help="Renderer to use: 'cpu' is a deterministic stand-in for "
+            "testing without a GPU (the profile's \"backend\", or cuda) "
+            '(Key: "backend")')
 
     subparsers = parser.add_subparsers()
     p = subparsers.add_parser('init', help='Create a new flock repository.')
@@ -84,7 +159,7 @@ def mkparser():
     p = subparsers.add_parser('convert',
             help='Convert XML nodes to JSON edges.')
     p.set_defaults(cmd='convert')
-    p.add_argument('nodes', metavar='FILE', nargs='+', type=file,
+    p.add_argument('nodes', metavar='FILE', nargs='+',
             help='XML genomes.')
     p.add_argument('-o', dest='output', metavar='DIR', default='edges',
             help='Specify alternate output directory.')
@@ -96,45 +171,156 @@ def mkparser():
             help="Split edges into two 180-degree rotations.")
     p.add_argument('--no-add', dest='add', action='store_false',
             help="Don't automatically add generated edges to the git index.")
+    p.add_argument('-j', dest='procs', type=int,
+            help='Number of processes to convert files with (all cores)')
 
     p = subparsers.add_parser('render', help='Render a flock.')
     p.set_defaults(cmd='render')
+    add_render_args(p, cfg)
+
+    p = subparsers.add_parser('serve',
+            help='Hand out frames of a render to hosts.',
+            epilog="""
+Frames are selected in the same way as for 'render'. Frames leased to a host
+which are not reported as complete within the lease time are handed out again.
+Hosts must be running from a checkout at the same revision as the server, and
+write output to their own 'out' directory.
+""")
+    p.set_defaults(cmd='serve')
+    add_render_args(p, cfg)
+    p.add_argument('-b', dest='addr', default=cfg.get('serve', ''),
+            help='Address to listen on, as [HOST][:PORT] (all interfaces, '
+            'port 7677) (Key: "serve")')
+    p.add_argument('--lease', type=float, default=600,
+            help='Seconds before unreported frames are reassigned (600)')
+
+    p = subparsers.add_parser('host',
+            help='Render frames handed out by a server.')
+    p.set_defaults(cmd='host')
+    p.add_argument('server', nargs='?', default=cfg.get('server'),
+            help='Server address, as HOST[:PORT] (Key: "server")')
+    p.add_argument('-n', dest='count', type=int, default=8,
+            help='Number of frames to lease at a time (8)')
+    p.add_argument('-w', dest='worker',
+            help='Name to report to the server (hostname.pid)')
+
+    p = subparsers.add_parser('blend',
+            help='Create an edge that blends between two others.')
+    p.set_defaults(cmd='blend')
+    add_blend_args(p)
+
+    p = subparsers.add_parser('blend-all',
+            help='Blend all managed edges which are not already cached.')
+    p.set_defaults(cmd='blend_all')
+    p.add_argument('-j', dest='procs', type=int,
+            help='Number of processes to use (all cores)')
+
+    p = subparsers.add_parser('addEdges',
+            help='Add managed edges between similar reference nodes.',
+            epilog="""
+Reference nodes are compared by palette, variations and xform shape. Each node
+is joined to its nearest neighbours, and further edges are added until every
+node can be reached from every other, counting edges already in managed.txt.
+Edges are added in both directions. Blend options for the new edges can be
+given after '--', as in 'addEdges -- -a optimal'.
+""")
+    p.set_defaults(cmd='add_edges')
+    p.add_argument('opts', nargs=argparse.REMAINDER,
+            help='Blend options to add to each new line.')
+    p.add_argument('-k', dest='neighbours', type=int, default=3,
+            help='Number of nearest neighbours to join each node to (3)')
+    p.add_argument('-j', dest='procs', type=int,
+            help='Number of processes to load nodes with (all cores)')
+    p.add_argument('-n', dest='dry_run', action='store_true',
+            help="Print the new lines instead of adding them.")
+
+    p = subparsers.add_parser('encode',
+            help='Encode rendered edges to a video file.',
+            epilog="""
+Frames are piped in order, as raw RGB, to the standard input of an encoder
+command, ffmpeg by default. In the command, '{width}', '{height}', '{fps}' and
+'{out}' are replaced by the frame size, the frame rate of the profile (after
+skipped frames) and the output filename. Edges are taken from the profile's
+output directories for their current revision, unless '-r' is given, in which
+case they are rendered as they are encoded and not saved.
+""")
+    p.set_defaults(cmd='encode')
     p.add_argument('edges', metavar='edge', nargs='*',
-            help='Edge or loop names to render.')
+            help='Edges to encode, in order.')
     p.add_argument('-p', dest='profile', default=cfg.get('profile'),
             help='Specify a profile. (Key: "profile")')
-    p.add_argument('-m', dest='match', action='store_true',
-            help='Match any edge whose name contains the given substring, '
-            'instead of matching names exactly.')
-    # TODO: this should be replaced by graph-aware ordering
-    p.add_argument('-c', dest='committed', action='store_true',
-            help='Render committed edges before managed ones.')
-    p.add_argument('-r', dest='randomize', action='store_true',
-            help='Render edges and frames in random order. (Useful when '
-            'running multiple instances simultaneously.)')
+    p.add_argument('-l', dest='playlist',
+            help='Encode the edges listed in this file (as written by '
+            '"playlist") after any others.')
+    p.add_argument('-o', dest='out',
+            help='Output filename (first edge or playlist name, .mp4)')
+    p.add_argument('-c', dest='command', default=cfg.get('encoder'),
+            help='Encoder command (ffmpeg with libx264) (Key: "encoder")')
+    p.add_argument('-r', dest='render', action='store_true',
+            help='Render frames while encoding, instead of reading them.')
+    p.add_argument('-f', dest='force', action='store_true',
+            help='Encode edges even if some frames are missing.')
+
+    p = subparsers.add_parser('playlist',
+            help='Print a playlist of edges that play without cuts.',
+            epilog="""
+Edges are joined into a graph by the nodes in their 'link' metadata, or their
+line in managed.txt. By default, the playlist covers every edge at least once,
+favouring highly-rated edges and replaying edges only to reach unplayed ones.
+With '-n', it is instead a random walk of that many edges, weighted by rating.
+Where the playlist has to cut to another part of the graph, a '# jump' comment
+is printed.
+""")
+    p.set_defaults(cmd='playlist')
+    p.add_argument('-n', dest='length', type=int,
+            help='Length of a random walk to print instead.')
     p.add_argument('-t', dest='thresh', default=2, type=int,
-            help='Only render edges with at least this rating (2). (Unrated '
-            'edges have a default rating of 2.5.)')
-    p.add_argument('--passes', default=1, type=int,
-            help='Skip 2^(passes-1) frames at first, come back for them later')
-    p.add_argument('--ignore-ratings', action='store_true',
-            help="Don't use ratings to sort render order.")
+            help='Only use edges with at least this rating (2).')
+    p.add_argument('--seed', type=int,
+            help='Seed for the random choice of edges.')
 
-    p = subparsers.add_parser('blend',
-            help='Create an edge that blends between two others.')
-    p.set_defaults(cmd='blend')
-    p.add_argument('left', help='Name (or file) of genome to start at')
-    p.add_argument('right', help='Name (or file) of genome to end at')
-    p.add_argument('-a', dest='align', default='weightflip',
-            choices='natural weight weightflip color'.split(),
-            help='Sort method used to align xforms')
-    p.add_argument('-b', dest='blur', metavar='STDEV', type=float, const=1.5,
-            nargs='?', help='Blur palettes during interpolation (1.5)')
-    p.add_argument('-l', dest='nloops', metavar='LOOPS', type=int, default=2,
-            help='Number of loops to use (also scales duration) (2)')
-    p.add_argument('-s', dest='stagger', action='store_true',
-            help='Use stagger (experimental!)')
-    p.add_argument('-o', dest='out', help='Output filename')
+    p = subparsers.add_parser('score',
+            help='Estimate the quality of managed edges before rendering.',
+            epilog="""
+Each managed edge is blended if needed, and scored from 0 to 1 on how far its
+xforms travel, how much their variations change, how different its palettes
+are, and how much of it is carried by xforms which only exist on one side.
+Scores are cached beside the blended edges. Use 'render -q' to skip unrated
+edges which score poorly.
+""")
+    p.set_defaults(cmd='score')
+    p.add_argument('-j', dest='procs', type=int,
+            help='Number of processes to use (all cores)')
+    p.add_argument('-f', dest='force', action='store_true',
+            help='Score edges again even if they have a cached score.')
+
+    p = subparsers.add_parser('motion',
+            help='Report how fast edges change, and which frames they need.',
+            epilog="""
+The velocity of an edge is estimated from the derivatives of all of its
+splines, each scaled by the parameter's range over the edge (or by a full turn,
+for angles). Spans where the change from one rendered frame to the next stays
+below the threshold can be rendered at a reduced frame rate and interpolated.
+""")
+    p.set_defaults(cmd='motion')
+    p.add_argument('edges', metavar='edge', nargs='*',
+            help='Edges to analyze (all).')
+    p.add_argument('-p', dest='profile', default=cfg.get('profile'),
+            help='Specify a profile. (Key: "profile")')
+    p.add_argument('-t', dest='thresh', type=float, default=0.005,
+            help='Largest tolerable change between rendered frames (0.005)')
+    p.add_argument('-m', dest='max_stride', type=int, default=8,
+            help='Largest number of frames to interpolate across (8)')
+
+    p = subparsers.add_parser('stats',
+            help='Summarize render logs and estimate time to finish.')
+    p.set_defaults(cmd='stats')
+    p.add_argument('-p', dest='profiles', action='append',
+            help='Profile to report on (all), may be given multiple times')
+    p.add_argument('-t', dest='thresh', default=2, type=int,
+            help='Only count edges with at least this rating (2).')
+    p.add_argument('-v', dest='verbose', action='store_true',
+            help='Report on each edge as well.')
 
     p = subparsers.add_parser('update',
             help="Link output directories which don't need re-rendering.",
@@ -160,17 +346,31 @@ used as an alternative threshold.
             help='Number of frames to test (4)')
     p.add_argument('-p', dest='profiles', action='append',
             help='Profile to test (all), may be given multiple times')
+    p.add_argument('-j', dest='jobs', type=int, default=4,
+            help='Number of edges to check at once (4)')
+    p.add_argument('-m', dest='metric', default='ssim',
+            choices=('ssim', 'rmse'),
+            help='Image metric used to compare frames (ssim)')
     p.add_argument('--diff', type=float, default=0.02,
-            help='Maximum mean SSIM deviation to accept frame (0.02)')
+            help='Maximum mean SSIM deviation (or RMS error) to accept '
+            'frame (0.02)')
     p.add_argument('--reldiff', type=float, default=1.1,
-            help='Maximum relative SSIM error to accept frame (1.1)')
+            help='Maximum relative SSIM deviation (or RMS error) to accept '
+            'frame (1.1)')
     return parser
 
 def main():
     parser = mkparser()
     args = parser.parse_args()
-    if args.cmd == 'render' and args.profile is None:
+    if (args.cmd in ('render', 'serve', 'motion', 'encode') and
+            args.profile is None):
         parser.error('"-p" is required when no default profile is set.')
+    if args.cmd == 'host' and args.server is None:
+        parser.error('A server is required when no default server is set.')
+    if (args.cmd in ('render', 'serve') and args.schedule and
+            (args.order != 'linear' or args.adaptive is not None)):
+        parser.error('"-s" orders frames itself, and can\'t be combined '
+                     'with "--order" or "--adaptive".')
 
     if args.cmd == 'init':
         return init(args)
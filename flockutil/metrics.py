@@ -0,0 +1,72 @@
+"""
+Image difference metrics for comparing rendered frames.
+
+Both metrics return a difference in [0, 1], where 0 means the frames are
+identical, so they can be used interchangeably against a threshold.
+
+    rmse    Root-mean-square error over all channels, normalized to [0, 1]
+            (the same figure as ImageMagick's 'compare -metric RMSE').
+    ssim    One minus the mean structural similarity of the frames' luma,
+            using an 11-tap Gaussian window with a standard deviation of 1.5.
+"""
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+METRICS = ('ssim', 'rmse')
+
+LUMA = np.array([0.299, 0.587, 0.114], np.float32)
+
+def load_frame(path):
+    """Load an image file as a float32 RGB array in [0, 1]."""
+    try:
+        from PIL import Image
+    except ImportError:
+        import Image
+    img = Image.open(path).convert('RGB')
+    return np.asarray(img, np.float32) / 255
+
+def rmse(a, b):
+    """
+    Return the RMS difference between each pair of frames in two stacks of
+    shape (n, h, w, c).
+    """
+    d = (a - b).reshape(len(a), -1)
+    return np.sqrt(np.mean(d * d, axis=1))
+
+def ssim(a, b, sigma=1.5, truncate=3.5):
+    """
+    Return one minus the mean SSIM of each pair of frames in two stacks of
+    shape (n, h, w, c). The window is only applied along the image axes, so
+    the whole stack is filtered in one call per statistic.
+    """
+    a, b = np.dot(a, LUMA), np.dot(b, LUMA)
+    sig = (0, sigma, sigma)
+    blur = lambda x: gaussian_filter(x, sig, truncate=truncate)
+    c1, c2 = 0.01 ** 2, 0.03 ** 2
+    mua, mub = blur(a), blur(b)
+    mua2, mub2, muab = mua * mua, mub * mub, mua * mub
+    va = blur(a * a) - mua2
+    vb = blur(b * b) - mub2
+    cov = blur(a * b) - muab
+    s = ((2 * muab + c1) * (2 * cov + c2) /
+         ((mua2 + mub2 + c1) * (va + vb + c2)))
+    return 1 - s.reshape(len(s), -1).mean(axis=1)
+
+def compare(pairs, metric='ssim', batch=8, load=load_frame):
+    """
+    Compare frames given as a list of pairs, returning a list of differences.
+    Each item of a pair is passed to 'load' to get a frame as load_frame
+    would, so by default items are paths. Frames are loaded and compared
+    'batch' pairs at a time.
+    """
+    fn = dict(ssim=ssim, rmse=rmse)[metric]
+    out = []
+    for i in range(0, len(pairs), batch):
+        chunk = pairs[i:i+batch]
+        a = np.array([load(p) for p, q in chunk])
+        b = np.array([load(q) for p, q in chunk])
+        if a.shape != b.shape:
+            raise ValueError('Frame sizes differ')
+        out.extend(map(float, fn(a, b)))
+    return out
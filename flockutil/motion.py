@@ -0,0 +1,117 @@
+"""
+Estimates of how fast an edge changes over time.
+"""
+
+import numpy as np
+from scipy.ndimage import maximum_filter1d
+
+from splines import SplineBatch
+
+# Parameters measured in degrees, whose changes are scaled by a full turn
+# rather than by their range over the edge.
+ANGLES = ('angle', 'rotation')
+
+def midpoint(t):
+    """Return the centre of a frame's time, which may be a (start, end)."""
+    if isinstance(t, (tuple, list)):
+        return (t[0] + t[-1]) / 2.
+    return t
+
+def change_rates(gnm, times):
+    """
+    Return an array giving how much the genome changes around each of
+    'times', as the mean absolute change in each parameter between a frame and
+    its neighbours. Each parameter is scaled by its range over 'times', so
+    that angles in degrees don't drown out weights in [0, 1].
+    """
+    if len(times) < 2:
+        return np.zeros(len(times))
+    x = SplineBatch(gnm)([midpoint(t) for t in times])
+    if not len(x):
+        return np.zeros(len(times))
+    rng = x.max(axis=1) - x.min(axis=1)
+    rng[rng == 0] = 1
+    d = np.abs(np.diff(x / rng[:,None], axis=1)).mean(axis=0)
+    rates = np.zeros(len(times))
+    rates[:-1] += d
+    rates[1:] += d
+    rates[1:-1] /= 2
+    return rates
+
+def derivatives(gnm, times):
+    """
+    Return (paths, vals, derivs), where 'vals' and 'derivs' are arrays of
+    shape (len(paths), len(times)) holding the value and first derivative of
+    each spline at each time.
+    """
+    batch = SplineBatch(gnm)
+    return batch.paths, batch(times), batch(times, 1)
+
+def visual_velocity(gnm, times):
+    """
+    Estimate how fast an edge visibly changes at each of 'times', as the mean
+    absolute rate of change of its parameters per unit time. Each parameter is
+    scaled by its range over 'times' (or by a full turn, for angles), so that
+    every parameter counts equally whatever its units.
+    """
+    times = [midpoint(t) for t in times]
+    paths, vals, derivs = derivatives(gnm, times)
+    if not len(paths):
+        return np.zeros(len(times))
+    scale = vals.max(axis=1) - vals.min(axis=1)
+    for i, p in enumerate(paths):
+        if p[-1] in ANGLES:
+            scale[i] = 360.
+    scale[scale == 0] = 1
+    return np.abs(derivs / scale[:,None]).mean(axis=0)
+
+def frame_step(times):
+    """Return the typical time between frames."""
+    times = [midpoint(t) for t in times]
+    return float(np.median(np.diff(times))) if len(times) > 1 else 1.
+
+def plan_spans(vel, dt, thresh=0.005, max_stride=8):
+    """
+    Split a run of frames into spans by how often they need to be rendered.
+
+    'vel' is the visual velocity at each frame and 'dt' the time between
+    frames. A frame can be left to interpolation when the change between the
+    rendered frames either side of it stays under 'thresh'. Returns a list of
+    (start, stop, stride) tuples over frame positions, with strides that are
+    powers of two no greater than 'max_stride'; a stride of 1 means the span
+    needs every frame.
+    """
+    if not len(vel):
+        return []
+    # A frame can only be skipped if nothing nearby is moving fast either
+    vel = maximum_filter1d(np.asarray(vel, float), max_stride)
+    step = np.maximum(vel * dt, 1e-12)
+    strides = np.clip(thresh / step, 1, max_stride)
+    strides = 2 ** np.floor(np.log2(strides)).astype(int)
+    spans, start = [], 0
+    for i in range(1, len(strides) + 1):
+        if i == len(strides) or strides[i] != strides[start]:
+            spans.append((start, i, int(strides[start])))
+            start = i
+    return spans
+
+def needed_frames(spans):
+    """Return the positions which must be rendered under a span plan."""
+    out = []
+    for start, stop, stride in spans:
+        out.extend(range(start, stop, stride))
+    if spans and spans[-1][2] > 1:
+        # Always keep the last frame, so there is something to interpolate to
+        last = spans[-1][1] - 1
+        if out[-1] != last:
+            out.append(last)
+    return out
+
+def report(edge, vel, spans):
+    needed = len(needed_frames(spans))
+    print '%s: mean velocity %.3g, peak %.3g, %d of %d frames needed' % (
+            edge, np.mean(vel) if len(vel) else 0,
+            np.max(vel) if len(vel) else 0, needed, len(vel))
+    for start, stop, stride in spans:
+        print '    frames %5d-%5d: %s' % (start, stop - 1,
+                'every frame' if stride == 1 else 'every %d frames' % stride)
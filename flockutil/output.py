@@ -0,0 +1,393 @@
+"""
+Encoding and writing of rendered frames.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from os.path import join
+from Queue import Queue
+from multiprocessing import cpu_count
+import numpy as np
+
+# Output format names, as given in a profile, and their file extensions.
+# The raw formats store every frame in one array file (see framearray.py).
+FORMATS = {'jpeg': 'jpg', 'png': 'png', 'tiff': 'tif', 'bmp': 'bmp',
+           'raw': 'raw', 'raw16': 'raw'}
+
+DEFAULT_OUTPUT = dict(format='jpeg', quality=95)
+
+def output_settings(prof):
+    """Return the 'output' settings of a profile, with defaults filled in."""
+    out = dict(DEFAULT_OUTPUT)
+    out.update(prof.get('output', {}))
+    if out['format'] not in FORMATS:
+        raise ValueError('Unknown output format "%s"' % out['format'])
+    return out
+
+def frame_ext(prof):
+    return FORMATS[output_settings(prof)['format']]
+
+def frame_saver(prof):
+    """Return the 'save' callable for FrameWriter for a profile's output."""
+    out = output_settings(prof)
+    if FORMATS[out['format']] == 'raw':
+        from framearray import ArrayEncoder
+        return ArrayEncoder(**out)
+    return FrameEncoder(**out)
+
+class FrameEncoder(object):
+    """
+    Converts floating-point RGB frames in [0, 1] to 8-bit images and saves them
+    in a given format. Instances are callable as the 'save' argument to
+    FrameWriter.
+
+    Conversion is done in place in scratch buffers which are allocated once per
+    frame size and thread. Values are scaled, offset and clipped exactly as
+    'scipy.misc.toimage(buf, cmin=0, cmax=1)' would do, except that if 'dither'
+    is set, a fixed pattern of uniform noise replaces the rounding offset.
+    """
+    def __init__(self, format='jpeg', quality=95, dither=False, **kwargs):
+        self.format, self.quality, self.dither = format, quality, dither
+        self.ext = FORMATS[format]
+        self.local = threading.local()
+        self.noise = {}
+
+    @classmethod
+    def from_profile(cls, prof):
+        return cls(**output_settings(prof))
+
+    def _buffers(self, shape):
+        bufs = self.local.__dict__.setdefault('bufs', {})
+        if shape not in bufs:
+            bufs[shape] = (np.empty(shape, np.float32),
+                           np.empty(shape, np.uint8))
+        return bufs[shape]
+
+    def _noise(self, shape):
+        # Shared between threads, and created at most once per shape, so
+        # every frame of a render gets the same pattern
+        if shape not in self.noise:
+            rng = np.random.RandomState(0)
+            self.noise.setdefault(shape, rng.random_sample(shape)
+                                            .astype(np.float32))
+        return self.noise[shape]
+
+    def convert(self, buf):
+        """
+        Convert 'buf' to 8 bits. Any channels beyond the third are ignored,
+        so the renderer's RGBA buffer can be passed directly. The returned
+        array is reused by the next call from the same thread.
+        """
+        buf = buf[:,:,:3]
+        scratch, out = self._buffers(buf.shape)
+        np.multiply(buf, 255, scratch)
+        if self.dither:
+            np.add(scratch, self._noise(buf.shape), scratch)
+        else:
+            np.add(scratch, 0.5, scratch)
+        np.clip(scratch, 0, 255, scratch)
+        out[:] = scratch
+        return out
+
+    def __call__(self, path, buf, idx=None):
+        try:
+            from PIL import Image
+        except ImportError:
+            import Image
+        img = Image.fromarray(self.convert(buf), 'RGB')
+        # The old file may be hard-linked into the frame store, so replace it
+        # rather than writing through it
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(),
+                                threading.current_thread().ident)
+        try:
+            if self.format == 'jpeg':
+                img.save(tmp, 'JPEG', quality=self.quality)
+            else:
+                img.save(tmp, self.format.upper())
+            os.rename(tmp, path)
+        except:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+
+def log_record(**rec):
+    """Format one line of a render log."""
+    return json.dumps(rec, sort_keys=True, separators=(',', ':')) + '\n'
+
+def parse_log_line(line):
+    """
+    Parse one line of a render log, returning a dict or None. Frame records
+    have an 'idx' key. Logs written before records were JSON are understood
+    too, as far as they go.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if line.startswith('{'):
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+    sp = line.split()
+    try:
+        # Old-style frame line, 'IDX g=GPU_MS'
+        rec = dict(idx=int(sp[0]))
+    except ValueError:
+        # Old-style header, 'NAME rev=REV nf=NF'
+        rec = dict(name=sp[0])
+    for kv in sp[1:]:
+        k, v = kv.split('=', 1)
+        k = dict(g='gpu_ms').get(k, k)
+        rec[k] = int(v) if k in ('gpu_ms', 'nf') else v
+    return rec
+
+def read_log(odir):
+    """
+    Read the log in 'odir', returning (header, frames), where 'header' is the
+    first record (or an empty dict) and 'frames' a list of frame records.
+    """
+    header, frames = {}, []
+    try:
+        with open(join(odir, 'log.txt')) as fp:
+            for line in fp:
+                rec = parse_log_line(line)
+                if rec is None: continue
+                if 'idx' in rec:
+                    frames.append(rec)
+                elif not header:
+                    header = rec
+    except IOError:
+        pass
+    return header, frames
+
+class FrameWriter(object):
+    """
+    Encodes and writes frames to an output directory on a pool of threads, so
+    that the renderer can get on with the next frame in the meantime. NumPy
+    and the image encoders release the GIL for the heavy lifting.
+
+    At most 'depth' frames can be waiting to be written; beyond that, 'write'
+    blocks until a thread catches up. If a thread fails, the exception is
+    raised from the next call to 'write' or 'close'.
+
+    Each frame is logged once it has been written. The items in 'info' (such
+    as the worker name and software revisions) are included in every record.
+
+    If a store.FrameStore is given, frames passed through 'reuse' are taken
+    from the store where possible, and added to it once written otherwise.
+    """
+    def __init__(self, odir, topath, save, threads=None, depth=None,
+                 info=None, store=None):
+        self.odir, self.topath, self.save = odir, topath, save
+        self.info = info or {}
+        self.store, self.keys = store, {}
+        threads = threads or cpu_count()
+        self.queue = Queue(depth or 2 * threads)
+        self.error = None
+        self.lock = threading.Lock()
+        self.log = open(join(odir, 'log.txt'), 'a')
+        self.threads = [threading.Thread(target=self._run)
+                        for i in range(threads)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error:
+                # Keep draining the queue so 'write' doesn't block forever
+                continue
+            try:
+                self._write(*item)
+            except:
+                self.error = sys.exc_info()
+
+    def _write(self, idx, buf, gpu_time, wall_time):
+        path = self.topath(self.odir, idx)
+        start = time.time()
+        size = self.save(path, buf, idx)
+        now = time.time()
+        if size is None:
+            size = os.path.getsize(path)
+        rec = log_record(idx=idx, gpu_ms=gpu_time, wall_ms=wall_time,
+                         encode_ms=int((now - start) * 1000),
+                         bytes=size, time=round(now, 3), **self.info)
+        if idx in self.keys:
+            self.store.put(self.keys.pop(idx), path)
+        with self.lock:
+            self.log.write(rec)
+            self.log.flush()
+            print 'Wrote %s (took %5d ms)' % (path, gpu_time)
+
+    def reuse(self, rt, key):
+        """
+        Lazily filter (index, time) pairs to those which need rendering,
+        linking frames whose key (as given by calling 'key' on the pair) is in
+        the store into the output directory instead.
+        """
+        for r in rt:
+            k = key(r)
+            path = self.topath(self.odir, r[0])
+            if not self.store.fetch(k, path):
+                self.keys[r[0]] = k
+                yield r
+                continue
+            rec = log_record(idx=r[0], stored=k, time=round(time.time(), 3),
+                             **self.info)
+            with self.lock:
+                self.log.write(rec)
+                self.log.flush()
+                print 'Reused %s' % path
+
+    def _raise(self):
+        if self.error:
+            raise self.error[0], self.error[1], self.error[2]
+
+    def write(self, idx, buf, gpu_time, wall_time=None):
+        """
+        Queue a frame for writing. The buffer is copied, since the renderer
+        may reuse it. 'wall_time' is the time in ms the renderer took to
+        produce the frame, if known.
+        """
+        self._raise()
+        self.queue.put((idx, buf.copy(), gpu_time, wall_time))
+
+    def close(self, check=True):
+        """Wait for all queued frames to be written."""
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+        self.log.close()
+        FrameManifest.load(self.odir)
+        if check:
+            self._raise()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, val, tb):
+        # Don't let a writer error mask whatever stopped the render
+        self.close(check=typ is None)
+
+class FrameManifest(object):
+    """
+    A bitmap of the frames which have been written to an output directory.
+
+    The manifest is derived from 'log.txt', which gains a line for each frame
+    after it is written, and records how much of the log it covers. Loading
+    the manifest reads only the part of the log added since then, so finding
+    which frames exist costs a couple of small reads rather than a stat or
+    glob over every frame. Several writers may share a directory; whichever
+    saves last has read every writer's log lines.
+    """
+    NAME = 'frames.idx'
+    MAGIC = 'flockutil-frames 1'
+
+    def __init__(self, odir, bits=None, logsize=0):
+        self.odir = odir
+        self.bits = np.zeros(0, bool) if bits is None else bits
+        self.logsize = logsize
+
+    @classmethod
+    def load(cls, odir, save=True):
+        """
+        Load the manifest for 'odir', catching up with its log. If 'save' is
+        set, the manifest is written back when it has changed.
+        """
+        man = cls(odir)
+        try:
+            with open(join(odir, cls.NAME), 'rb') as fp:
+                head = fp.readline().split()
+                if ' '.join(head[:2]) == cls.MAGIC:
+                    nbits, logsize = int(head[2]), int(head[3])
+                    data = np.fromstring(fp.read(), np.uint8)
+                    man.bits = np.unpackbits(data)[:nbits].astype(bool)
+                    man.logsize = logsize
+        except (IOError, ValueError, IndexError):
+            pass
+        if man.catch_up() and save:
+            try:
+                man.save()
+            except (IOError, OSError):
+                # Read-only output trees are fine, just slower
+                pass
+        return man
+
+    def catch_up(self):
+        """Add frames from log lines not yet covered. Returns True if any."""
+        try:
+            with open(join(self.odir, 'log.txt'), 'rb') as fp:
+                fp.seek(0, 2)
+                if fp.tell() < self.logsize:
+                    # The log was replaced, start over
+                    self.bits, self.logsize = np.zeros(0, bool), 0
+                if fp.tell() == self.logsize:
+                    return False
+                fp.seek(self.logsize)
+                data = fp.read()
+        except IOError:
+            return False
+        # Ignore any partially-written final line
+        data = data[:data.rfind('\n') + 1]
+        self.logsize += len(data)
+        self.update(parse_log_frames(data))
+        return bool(data)
+
+    def update(self, idxs):
+        idxs = np.asarray(list(idxs), int)
+        if not len(idxs):
+            return
+        if idxs.max() >= len(self.bits):
+            bits = np.zeros(idxs.max() + 1, bool)
+            bits[:len(self.bits)] = self.bits
+            self.bits = bits
+        self.bits[idxs] = True
+
+    def save(self):
+        path = join(self.odir, self.NAME)
+        tmp = '%s.%d' % (path, os.getpid())
+        with open(tmp, 'wb') as fp:
+            fp.write('%s %d %d\n' % (self.MAGIC, len(self.bits), self.logsize))
+            fp.write(np.packbits(self.bits).tostring())
+        os.rename(tmp, path)
+
+    def missing(self, rt):
+        """
+        Lazily filter (index, time) pairs to those not yet written. The log is
+        read once up front, and again only before handing out a frame to
+        render, so frames written in the meantime by other renders of the
+        same directory are skipped without touching the log for every frame
+        that is already done.
+        """
+        self.catch_up()
+        for r in rt:
+            if r[0] in self:
+                continue
+            self.catch_up()
+            if r[0] not in self:
+                yield r
+
+    def __contains__(self, idx):
+        return idx < len(self.bits) and self.bits[idx]
+
+    def __len__(self):
+        return int(np.count_nonzero(self.bits))
+
+    def indices(self):
+        """Return the indices of all written frames, in order."""
+        return np.flatnonzero(self.bits)
+
+def parse_log_frames(data):
+    """Yield the index of each frame recorded in a chunk of 'log.txt'."""
+    for line in data.split('\n'):
+        rec = parse_log_line(line)
+        if rec and 'idx' in rec:
+            yield rec['idx']
@@ -0,0 +1,84 @@
+"""
+Cheap estimates of the quality of a blended edge.
+
+Rendering an edge is the only real test of whether it looks good, but some
+kinds of bad blend can be spotted from the genome alone: xforms which travel
+a long way or swap variations wholesale, palettes which have little in common,
+and xforms which only exist on one side and have to fade in or out. Each of
+these is measured on splines sampled across the edge, and the measures are
+combined into a single score between 0 (bad) and 1 (good).
+"""
+
+import numpy as np
+
+from cuburn import genome
+
+from splines import SplineBatch
+
+# Number of times at which splines are sampled.
+SAMPLES = 64
+
+# The weight of each measure in the combined score. The score is
+# exp(-sum(weight * measure)), so the weights set how quickly each measure
+# pulls the score down.
+WEIGHTS = dict(affine_length=0.5, variation_churn=1.0,
+               palette_distance=4.0, pad_density=2.0)
+
+# Affine parameters measured in degrees. These are scaled by a full turn;
+# the 'angle' of the main affine transform is left out entirely, since it
+# rotates through whole loops by design.
+AFFINE_ANGLES = ('angle', 'spread')
+
+def path_lengths(vals):
+    """Return the total absolute change of each row of 'vals'."""
+    return np.abs(np.diff(vals, axis=1)).sum(axis=1)
+
+def palette_distance(gnm):
+    """Return the mean RGB difference between the two end palettes."""
+    pals = gnm.get('palettes', [])
+    if len(pals) < 2:
+        return 0.
+    l, r = [np.asarray(genome.palette_decode(p), float)[:,:3]
+            for p in pals[:2]]
+    return float(np.abs(l - r).mean())
+
+def measure(gnm, samples=SAMPLES):
+    """Return a dict of each measure of the quality of a blended genome."""
+    xforms = gnm['xforms']
+    nxf = max(1, len([k for k in xforms if k != 'final']))
+    batch = SplineBatch(xforms)
+    vals = batch(np.linspace(0, 1, samples))
+    lengths = path_lengths(vals)
+
+    affine = churn = 0.
+    dens = []
+    for path, length, v in zip(batch.paths, lengths, vals):
+        if path[1] in ('affine', 'post'):
+            if path[2] in AFFINE_ANGLES:
+                if path[1] == 'affine' and path[2] == 'angle':
+                    continue
+                length /= 360.
+            affine += length
+        elif path[1] == 'variations' and path[-1] == 'weight':
+            churn += length
+        elif path[1:] == ('density',) and path[0] != 'final':
+            dens.append((v[0], v[-1]))
+
+    # Pad xforms have no density at one end; weigh them by the other end
+    dens = np.abs(np.array(dens, float).reshape(-1, 2))
+    peak = dens.max(axis=1)
+    padded = dens.min(axis=1) < 1e-6
+    pad = peak[padded].sum() / peak.sum() if peak.sum() else 0.
+
+    return dict(affine_length=affine / nxf, variation_churn=churn / nxf,
+                palette_distance=palette_distance(gnm), pad_density=pad)
+
+def score(measures):
+    """Combine a dict of measures into a score between 0 and 1."""
+    return float(np.exp(-sum(WEIGHTS[k] * v for k, v in measures.items())))
+
+def score_genome(gnm):
+    """Return the measures of a blended genome, with 'score' added."""
+    m = measure(gnm)
+    m['score'] = score(m)
+    return m
@@ -0,0 +1,120 @@
+"""
+An index of the ratings in ratings.txt.
+
+Each line of ratings.txt rates an edge at a revision, as 'edgename revid user
+flags [comments]', where the first character of 'flags' is the rating from 0
+to 5. Only the first rating a user gives an edge at a revision counts. An
+edge's effective rating is the mean of the ratings of its current revision,
+or of all its ratings if its current revision has none.
+
+The index works out every rated edge's effective rating once, when it is
+built, and keeps the edges ordered by rating, so that looking up a rating is
+a dict lookup and threshold queries are a binary search. When ratings.txt is
+appended to, 'refresh' reads only the new lines and updates only the edges
+they rate.
+"""
+
+import os
+from bisect import bisect_left, insort
+
+class RatingIndex(object):
+    """
+    The ratings in the file 'path'. 'current' is a function which returns
+    the current revid of an edge, raising KeyError for edges which no longer
+    exist.
+    """
+    def __init__(self, current, path='ratings.txt'):
+        self.current, self.path = current, path
+        self.reset()
+        self.refresh()
+
+    def reset(self):
+        # edge -> rev -> user -> (rating, flags)
+        self.ratings = {}
+        # edge -> effective rating
+        self.effective = {}
+        # (-rating, edge) for each rated edge, best first
+        self.ranked = []
+        # How much of the file has been read, and whether it ended a line
+        self.size, self.whole = 0, True
+
+    def refresh(self):
+        """
+        Bring the index up to date with the file. Returns True if anything
+        was read. A file which has shrunk, or whose last line was incomplete,
+        is read again from the start.
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        if size == self.size:
+            return False
+        if size < self.size or not self.whole:
+            self.reset()
+        try:
+            with open(self.path) as fp:
+                fp.seek(self.size)
+                data = fp.read()
+        except IOError:
+            return False
+        self.size += len(data)
+        self.whole = not data or data.endswith('\n')
+        changed = set()
+        for line in data.split('\n'):
+            sp = line.strip().split('#', 1)[0].split()
+            if len(sp) < 4: continue
+            name, rev, user, flags = sp[:4]
+            if flags[0] not in '012345': continue
+            users = self.ratings.setdefault(name, {}).setdefault(rev, {})
+            if user not in users:
+                users[user] = (int(flags[0]), flags[1:])
+                changed.add(name)
+        for edge in changed:
+            self.update(edge)
+        return True
+
+    def update(self, edge):
+        """Recompute the effective rating of 'edge'."""
+        revs = self.ratings[edge]
+        try:
+            rev = self.current(edge)
+        except KeyError:
+            rev = None
+        if rev in revs:
+            vals = [v[0] for v in revs[rev].values()]
+        else:
+            vals = [v[0] for d in revs.values() for v in d.values()]
+        if edge in self.effective:
+            del self.ranked[bisect_left(self.ranked,
+                                        (-self.effective[edge], edge))]
+        self.effective[edge] = sum(vals) / float(len(vals))
+        insort(self.ranked, (-self.effective[edge], edge))
+
+    def __contains__(self, edge):
+        return edge in self.ratings
+
+    def __len__(self):
+        return len(self.ratings)
+
+    def __iter__(self):
+        return iter(self.ratings)
+
+    def __getitem__(self, edge):
+        return self.ratings[edge]
+
+    def get(self, edge, default=None):
+        """Return the effective rating of 'edge', or 'default' if unrated."""
+        return self.effective.get(edge, default)
+
+    def best(self):
+        """Yield (edge, rating) for every rated edge, best first."""
+        for r, edge in self.ranked:
+            yield edge, -r
+
+    def at_least(self, thresh):
+        """Return the rated edges rated 'thresh' or better, best first."""
+        end = bisect_left(self.ranked, (-thresh, ''))
+        while end < len(self.ranked) and self.ranked[end][0] == -thresh:
+            end += 1
+        return [edge for r, edge in self.ranked[:end]]
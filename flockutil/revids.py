@@ -0,0 +1,105 @@
+"""
+Abbreviated revids.
+
+Each revision is identified by the smallest unique prefix of its SHA (min 6).
+If there is a collision, the newer revid will be extended, but the older revid
+will not change length, so names of output directories stay valid as history
+grows.
+"""
+
+from bisect import bisect_left
+
+MIN_LENGTH = 6
+
+def common_prefix(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y: break
+        n += 1
+    return n
+
+class ShortRevs(object):
+    """
+    Maps full revids to abbreviated ones and back. Revids must be added
+    oldest first.
+
+    The full revids are also kept in sorted order. Every earlier abbreviation
+    that could collide with a new revid shares at least MIN_LENGTH characters
+    with it, and all such revids sit next to its insertion point, so adding or
+    looking up a revid is a binary search plus a scan over (almost always
+    zero) near neighbours. Inserting into the sorted list is linear, but it
+    is a memmove of pointers, which stays well under a millisecond for
+    histories of tens of thousands of revisions.
+    """
+    def __init__(self, revs=(), shorts=None):
+        self.revs = []
+        self.shorts = []
+        self._sorted = []
+        self._short = {}
+        if shorts is None:
+            for rev in revs:
+                self.add(rev)
+        else:
+            self.revs = map(str, revs)
+            self.shorts = map(str, shorts)
+            self._sorted = sorted(self.revs)
+            self._short = dict(zip(self.revs, self.shorts))
+
+    def __len__(self):
+        return len(self.revs)
+
+    def _neighbours(self, rev, i):
+        """Yield the revids next to sorted index 'i' which share a prefix."""
+        for rng in (xrange(i - 1, -1, -1), xrange(i, len(self._sorted))):
+            for j in rng:
+                other = self._sorted[j]
+                if common_prefix(rev, other) < MIN_LENGTH: break
+                yield other
+
+    def add(self, rev):
+        """Add a new revid, returning its abbreviation."""
+        if rev in self._short:
+            return self._short[rev]
+        i = bisect_left(self._sorted, rev)
+        taken = set(len(self._short[o]) for o in self._neighbours(rev, i)
+                    if rev.startswith(self._short[o]))
+        n = MIN_LENGTH
+        while n in taken:
+            n += 1
+        short = rev[:n]
+        self.revs.append(rev)
+        self.shorts.append(short)
+        self._sorted.insert(i, rev)
+        self._short[rev] = short
+        return short
+
+    def short(self, rev):
+        """Return the abbreviation of a full revid."""
+        return self._short[rev]
+
+    def full(self, short):
+        """Return the full revid for an abbreviation, or raise KeyError."""
+        i = bisect_left(self._sorted, short)
+        while i < len(self._sorted) and self._sorted[i].startswith(short):
+            if self._short[self._sorted[i]] == short:
+                return self._sorted[i]
+            i += 1
+        raise KeyError(short)
+
+    def __getitem__(self, short):
+        return self.full(short)
+
+    def __contains__(self, short):
+        try:
+            self.full(short)
+        except KeyError:
+            return False
+        return True
+
+    def dump(self):
+        """Return a JSON-serializable representation."""
+        return dict(revs=self.revs, shorts=self.shorts)
+
+    @classmethod
+    def restore(cls, d):
+        return cls(d['revs'], d['shorts'])
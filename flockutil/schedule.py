@@ -0,0 +1,154 @@
+"""
+Cost-aware ordering of render work.
+
+The cost of a frame varies a lot between edges, so ordering work by rating
+alone can leave many edges half-finished. These policies use per-frame GPU
+times from the output logs to estimate how much work each edge has left, and
+order frames to suit a goal:
+
+    complete    Finish as many edges as possible per hour of rendering, by
+                rendering the edges with the least remaining work first.
+    coverage    Get a coarse view of every edge as soon as possible. Frames
+                are split into power-of-two levels, as with '--passes', and
+                each level is rendered across all edges before the next.
+"""
+
+import numpy as np
+
+POLICIES = ('complete', 'coverage')
+
+# Orders for the frames within an edge. With 'progressive', any prefix of the
+# order covers the edge as evenly as possible; 'motion' does the same, but
+# places frames more densely where the genome changes faster.
+ORDERS = ('linear', 'progressive', 'motion')
+
+def bit_reverse(n, bits):
+    """Reverse the low 'bits' bits of each element of the int array 'n'."""
+    out = np.zeros_like(n)
+    for i in range(bits):
+        out |= ((n >> i) & 1) << (bits - 1 - i)
+    return out
+
+def progressive_order(n):
+    """
+    Return the positions 0..n-1 in van der Corput order: 0, then the middle,
+    then the quarters, and so on. Every prefix is spread evenly over the
+    whole range, whereas power-of-two passes are only even at the end of each
+    pass.
+    """
+    bits = max(1, int(n - 1).bit_length())
+    order = bit_reverse(np.arange(1 << bits), bits)
+    return order[order < n]
+
+def weighted_order(weights):
+    """
+    Return the positions 0..len(weights)-1 in a progressive order under which
+    positions are spread evenly by cumulative weight rather than by count.
+    Each point of a van der Corput sequence over [0, 1) picks the closest
+    unpicked position, measured along the cumulative weight.
+    """
+    w = np.asarray(weights, float)
+    n = len(w)
+    if not n or not w.sum():
+        return progressive_order(n)
+    centres = (np.cumsum(w) - w / 2) / w.sum()
+    bits = max(1, int(n - 1).bit_length()) + 1
+    taken = np.zeros(n, bool)
+    out = []
+    for u in bit_reverse(np.arange(1 << bits), bits) / float(1 << bits):
+        i = min(np.searchsorted(centres, u), n - 1)
+        if i > 0 and u - centres[i-1] < centres[i] - u:
+            i -= 1
+        if taken[i]:
+            # Walk outwards to the nearest free position
+            lo, hi = i - 1, i + 1
+            while lo >= 0 and taken[lo]: lo -= 1
+            while hi < n and taken[hi]: hi += 1
+            if hi >= n or (lo >= 0 and u - centres[lo] <= centres[hi] - u):
+                i = lo
+            else:
+                i = hi
+        taken[i] = True
+        out.append(i)
+        if len(out) == n:
+            break
+    return np.array(out + list(np.flatnonzero(~taken)), int)
+
+def order_frames(rt, order, rates=None):
+    """
+    Reorder a list of (index, time) pairs. For 'motion', 'rates' gives how
+    fast the genome changes at each frame (see motion.change_rates); half the
+    weight is spread uniformly, so still sections are not starved.
+    """
+    if order == 'linear' or not len(rt):
+        return list(rt)
+    if order == 'progressive':
+        perm = progressive_order(len(rt))
+    elif order == 'motion':
+        rates = np.asarray(rates, float)
+        w = 0.5 / len(rt) + 0.5 * rates / max(rates.sum(), 1e-12)
+        perm = weighted_order(w)
+    else:
+        raise ValueError('Unknown frame order "%s"' % order)
+    return [rt[i] for i in perm]
+
+class EdgePlan(object):
+    """
+    The remaining work on an edge. 'rt' is the list of (index, time) pairs
+    still to render (of which only the indices are used), 'stride' the frame
+    index step for the profile, and 'frames' a list of frame log records to
+    estimate costs from.
+    """
+    def __init__(self, edge, rt, stride=1, frames=()):
+        self.edge, self.rt, self.stride = edge, rt, stride
+        costs = [f['gpu_ms'] for f in frames if 'gpu_ms' in f]
+        self.cost = float(np.median(costs)) if costs else None
+
+    def remaining(self):
+        return len(self.rt) * self.cost
+
+    def level(self, idx):
+        """
+        Return the refinement level of a frame: 0 for the first frame, and
+        otherwise higher the fewer times two divides its position.
+        """
+        pos = (idx - 1) / self.stride
+        if pos == 0:
+            return 0
+        tz = 0
+        while not pos & 1:
+            pos >>= 1
+            tz += 1
+        return 32 - tz
+
+def fill_costs(plans, default=1000.0):
+    """Give edges without any log history the median cost of the others."""
+    known = [p.cost for p in plans if p.cost is not None]
+    fill = float(np.median(known)) if known else default
+    for p in plans:
+        if p.cost is None:
+            p.cost = fill
+
+def order(plans, policy):
+    """
+    Order the work in 'plans' by 'policy'. Yields (edge, rt) pairs, where 'rt'
+    is a list of (index, time) pairs; an edge may appear more than once. Ties
+    are broken by the order of 'plans'.
+    """
+    fill_costs(plans)
+    plans = [p for p in plans if p.rt]
+    if policy == 'complete':
+        for p in sorted(plans, key=lambda p: p.remaining()):
+            yield p.edge, p.rt
+    elif policy == 'coverage':
+        plans.sort(key=lambda p: p.cost)
+        levels = [dict() for p in plans]
+        for p, lv in zip(plans, levels):
+            for r in p.rt:
+                lv.setdefault(p.level(r[0]), []).append(r)
+        for level in sorted(set(sum([lv.keys() for lv in levels], []))):
+            for p, lv in zip(plans, levels):
+                if level in lv:
+                    yield p.edge, lv[level]
+    else:
+        raise ValueError('Unknown scheduling policy "%s"' % policy)
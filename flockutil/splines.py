@@ -0,0 +1,131 @@
+"""
+Batch evaluation of all the splines in a genome.
+
+Evaluating a genome one SplEval call at a time costs a few Python calls per
+parameter per time. SplineBatch flattens every spline into a single array of
+knots, indexed by path, so that all parameters can be evaluated at many times
+with a handful of NumPy operations.
+
+The batch evaluator reads the knots of each SplEval directly: padded (time,
+value) pairs with a cubic Hermite segment between each inner pair, using
+Catmull-Rom style tangents scaled for uneven knot spacing. Since that is an
+implementation detail of cuburn, each batch checks every one of its splines
+against the scalar SplEval calls when built, and falls back to them if any
+disagree.
+"""
+
+import numpy as np
+
+from cuburn.genome import SplEval
+
+# Hermite basis matrix, applied to [m1, v1, v2, m2] and [t^3, t^2, t, 1]
+HERMITE = np.array([[ 1., -2, 1, 0],
+                    [ 2., -3, 0, 1],
+                    [-2.,  3, 0, 0],
+                    [ 1., -1, 0, 0]])
+
+# Times at which a new batch is checked against SplEval. Each spline is
+# checked at one of them in turn, so that the check costs no more than a
+# single lookup made without a batch.
+CHECK_TIMES = (0, 0.137, 0.5, 0.971, 1)
+
+def splines(gnm, path=()):
+    """Yield (path, spline) for every spline in a genome, in a fixed order."""
+    if isinstance(gnm, dict):
+        for k in sorted(gnm):
+            for item in splines(gnm[k], path + (k,)):
+                yield item
+    elif isinstance(gnm, SplEval):
+        yield path, gnm
+
+def powers(t, deriv):
+    """Return the 'deriv'th derivative of [t^3, t^2, t, 1], shape (4, ...)."""
+    one, zero = np.ones_like(t), np.zeros_like(t)
+    if deriv == 0:
+        return np.array([t**3, t**2, t, one])
+    elif deriv == 1:
+        return np.array([3*t**2, 2*t, one, zero])
+    elif deriv == 2:
+        return np.array([6*t, 2*one, zero, zero])
+    raise ValueError('Only derivatives up to the second are supported')
+
+class SplineBatch(object):
+    """
+    The splines of a genome (or any part of one). 'paths' lists the path of
+    each spline, as a tuple of keys from the root given.
+    """
+    def __init__(self, gnm):
+        items = list(splines(gnm))
+        self.paths = [p for p, s in items]
+        self.spls = [s for p, s in items]
+        self.index = dict((p, i) for i, p in enumerate(self.paths))
+        self.exact = False
+        try:
+            self._flatten()
+            self.exact = self._check()
+        except (AttributeError, ValueError, IndexError, TypeError):
+            pass
+
+    def _flatten(self):
+        knots = [np.asarray(s.knots, float) for s in self.spls]
+        if any(k.ndim != 2 or k.shape[0] != 2 or k.shape[1] < 4
+               for k in knots):
+            raise ValueError('Unexpected knot layout')
+        counts = np.array([k.shape[1] for k in knots], int)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.counts = counts
+        self.times = np.concatenate([k[0] for k in knots] or [[]])
+        self.vals = np.concatenate([k[1] for k in knots] or [[]])
+        # Shift each spline's knot times into a disjoint range, so one sorted
+        # search over all of them finds the segment for every spline at once
+        lo = self.times.min() if len(self.times) else 0
+        self.stride = (self.times.max() - lo + 1e3) if len(self.times) else 1
+        self.keys = (self.times - lo +
+                     np.repeat(np.arange(len(knots)) * self.stride, counts))
+        self.lo = lo
+
+    def _check(self):
+        if not self.spls:
+            return True
+        idx = np.arange(len(self.spls))
+        which = idx % len(CHECK_TIMES)
+        for deriv in (0, 1):
+            batch = self._eval(CHECK_TIMES, deriv)[idx, which]
+            ref = [s(CHECK_TIMES[w], deriv) for s, w in zip(self.spls, which)]
+            if not np.allclose(batch, ref, rtol=1e-6, atol=1e-9):
+                return False
+        return True
+
+    def _eval(self, ts, deriv):
+        n = len(self.spls)
+        ts = np.asarray(ts, float)
+        keys = (ts[None,:] - self.lo) + (np.arange(n) * self.stride)[:,None]
+        idx = np.searchsorted(self.keys, keys) - 2 - self.offsets[:-1,None]
+        idx = np.clip(idx, 0, (self.counts - 4)[:,None])
+        g = idx + self.offsets[:-1,None]
+        t0, t1, t2, t3 = [self.times[g+i] for i in range(4)]
+        v0, v1, v2, v3 = [self.vals[g+i] for i in range(4)]
+        scale = 1 / (t2 - t1)
+        t = (ts[None,:] - t1) * scale
+        m1 = (v2 - v0) / (1 - (t0 - t1) * scale)
+        m2 = (v3 - v1) / ((t3 - t1) * scale)
+        basis = np.dot(HERMITE, powers(t, deriv).reshape(4, -1))
+        basis = basis.reshape((4,) + t.shape)
+        out = m1 * basis[0] + v1 * basis[1] + v2 * basis[2] + m2 * basis[3]
+        return out * scale ** deriv
+
+    def __call__(self, ts, deriv=0):
+        """
+        Evaluate every spline at each of 'ts'. Returns an array of shape
+        (len(paths), len(ts)).
+        """
+        ts = np.asarray(ts, float)
+        if not self.spls:
+            return np.zeros((0, len(ts)))
+        if self.exact:
+            return self._eval(ts, deriv)
+        return np.array([[s(t, deriv) for t in ts] for s in self.spls], float)
+
+    def lookup(self, ts, deriv=0):
+        """Evaluate every spline, returning a dict from path to values."""
+        return dict(zip(self.paths, self(ts, deriv)))
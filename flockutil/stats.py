@@ -0,0 +1,83 @@
+"""
+Aggregation of render logs into throughput and cost figures.
+"""
+
+import numpy as np
+
+def summarize(frames):
+    """
+    Summarize a list of frame log records. Returns a dict with the number of
+    frames, the median and 95th percentile GPU cost in ms, and the rate in
+    frames per second of wall time for a single renderer (which includes
+    whatever overhead the renderer has beyond GPU time).
+    """
+    gpu = np.array([f['gpu_ms'] for f in frames if 'gpu_ms' in f], float)
+    wall = np.array([f.get('wall_ms') or f['gpu_ms'] for f in frames
+                     if f.get('wall_ms') or 'gpu_ms' in f], float)
+    out = dict(frames=len(frames), p50=None, p95=None, fps=None)
+    if len(gpu):
+        out['p50'], out['p95'] = np.percentile(gpu, [50, 95])
+    if len(wall) and wall.sum():
+        out['fps'] = len(wall) / (wall.sum() / 1000.)
+    return out
+
+def active_workers(frames, window=3600):
+    """
+    Count the workers which logged a frame within 'window' seconds of the most
+    recent frame. Returns at least 1.
+    """
+    times = [f['time'] for f in frames if 'time' in f]
+    if not times:
+        return 1
+    latest = max(times)
+    return max(1, len(set(f.get('worker') for f in frames
+                          if f.get('time', 0) >= latest - window)))
+
+def fmt_duration(secs):
+    if secs is None:
+        return '?'
+    secs = int(secs)
+    if secs >= 86400:
+        return '%dd%02dh' % (secs / 86400, secs % 86400 / 3600)
+    return '%d:%02d:%02d' % (secs / 3600, secs % 3600 / 60, secs % 60)
+
+def fmt_ms(v):
+    return '%8.0f' % v if v is not None else '%8s' % '-'
+
+def report(pname, edges, verbose=False):
+    """
+    Print a report for a profile. 'edges' is a list of (edge, header, frames)
+    tuples, where 'header' and 'frames' are as returned by output.read_log.
+    Edges without a header are assumed to be as long as the median known
+    edge when projecting the time to finish.
+    """
+    allframes = sum([f for e, h, f in edges], [])
+    known = [h['nf'] for e, h, f in edges if 'nf' in h]
+    default_nf = np.median(known) if known else None
+
+    remaining = 0
+    if verbose:
+        print '%-40s %7s %7s %8s %8s' % ('edge', 'done', 'total', 'p50 ms',
+                                         'p95 ms')
+    for edge, header, frames in edges:
+        done = len(set(f['idx'] for f in frames))
+        nf = header.get('nf', default_nf)
+        if nf is not None:
+            remaining += max(0, nf - done)
+        if verbose:
+            s = summarize(frames)
+            print '%-40s %7d %7s %s %s' % (edge[:40], done,
+                    '%d' % nf if nf is not None else '?',
+                    fmt_ms(s['p50']), fmt_ms(s['p95']))
+
+    s = summarize(allframes)
+    workers = active_workers(allframes)
+    eta = None
+    if s['fps'] and default_nf is not None:
+        eta = remaining / (s['fps'] * workers)
+    print ('%s: %d frames in %d edges, p50 %s ms, p95 %s ms, %s frames/s '
+           'per renderer' % (pname, s['frames'], len(edges),
+            fmt_ms(s['p50']).strip(), fmt_ms(s['p95']).strip(),
+            '%.2f' % s['fps'] if s['fps'] else '?'))
+    print '  %d frames remaining, %s with %d active renderer%s' % (
+            remaining, fmt_duration(eta), workers, 's' if workers > 1 else '')
@@ -0,0 +1,119 @@
+"""
+Content-addressed storage of rendered frames.
+
+Each frame is keyed by a hash of everything that determines it: the values of
+every spline in the genome over the frame's time span, the rest of the genome,
+the profile, and the revisions of the renderer and of flockutil. Metadata
+which does not affect the pixels (the edge's name and links) is left out, so
+renaming or relinking an edge keeps its frames. Output directories hold hard
+links into the store, so a frame whose inputs did not change between two
+revisions of an edge is stored once and rendered once, even when other parts
+of the edge changed.
+"""
+
+import os
+import json
+import errno
+import shutil
+import threading
+from hashlib import sha1
+import numpy as np
+
+from cuburn.genome import SplEval
+
+from splines import SplineBatch
+
+STORE_DIR = 'out/store'
+
+# Top-level genome keys which do not affect the rendered frames.
+METADATA = ('info', 'link')
+
+def sample_times(t):
+    """
+    Return the times at which to sample the genome for a frame. Frames which
+    cover a span of time (for motion blur) are sampled at four points, which
+    pins down a cubic spline segment over the span.
+    """
+    if isinstance(t, (tuple, list)):
+        t0, t1 = t[0], t[-1]
+        return [t0 + (t1 - t0) * i / 3. for i in range(4)]
+    return [t]
+
+def without_splines(gnm):
+    """Return 'gnm' with every spline replaced by None, keeping the layout."""
+    if isinstance(gnm, dict):
+        return dict((k, without_splines(v)) for k, v in gnm.items())
+    elif isinstance(gnm, SplEval):
+        return None
+    elif isinstance(gnm, list):
+        return map(without_splines, gnm)
+    return gnm
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError, e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copy(src, dst)
+
+class FrameStore(object):
+    def __init__(self, prof, revs, ext, root=STORE_DIR):
+        self.ext, self.root = ext, root
+        # Every key shares these, so hash them once
+        self.base = sha1(json.dumps([prof, revs], sort_keys=True)).digest()
+        self.prepared = (None, None, None)
+
+    def prepare(self, gnm):
+        """
+        Return a SplineBatch of the splines of 'gnm' which affect its frames,
+        and a hash of everything else that does. Both are kept for the last
+        genome seen, since a render asks for the keys of one genome in turn.
+        """
+        last, batch, base = self.prepared
+        if last is not gnm:
+            pixels = dict((k, v) for k, v in gnm.items()
+                          if k not in METADATA)
+            batch = SplineBatch(pixels)
+            base = sha1(self.base)
+            base.update(json.dumps(without_splines(pixels), sort_keys=True))
+            self.prepared = (gnm, batch, base)
+        return batch, base
+
+    def key(self, gnm, t):
+        """Return the key for the frame of 'gnm' at time 't'."""
+        batch, base = self.prepare(gnm)
+        h = base.copy()
+        # Adding zero turns any -0.0 into 0.0, which hashes alike
+        vals = np.round(batch(sample_times(t)), 10) + 0.
+        h.update(vals.tostring())
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], '%s.%s' % (key, self.ext))
+
+    def fetch(self, key, dst):
+        """Link the frame 'key' to 'dst' if it is stored. Returns success."""
+        src = self.path(key)
+        if not os.path.isfile(src):
+            return False
+        if os.path.lexists(dst):
+            os.unlink(dst)
+        link_or_copy(src, dst)
+        return True
+
+    def put(self, key, src):
+        """Add the frame at 'src' to the store under 'key'."""
+        dst = self.path(key)
+        if os.path.isfile(dst):
+            return
+        dir = os.path.dirname(dst)
+        if not os.path.isdir(dir):
+            try:
+                os.makedirs(dir)
+            except OSError:
+                if not os.path.isdir(dir): raise
+        # Link under a private name first so readers never see partial files
+        tmp = '%s.%d.%d' % (dst, os.getpid(), threading.current_thread().ident)
+        link_or_copy(src, tmp)
+        os.rename(tmp, dst)
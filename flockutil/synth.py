@@ -0,0 +1,212 @@
+"""
+Synthetic flock repositories, for benchmarking.
+
+A synthetic flock has a history of a given number of commits, each adding or
+changing a few node edges (edges/*.json) and occasionally the dependency
+revisions, plus managed edges between random pairs of nodes, ratings of
+random edges at their current revisions, and output directories with logs
+and placeholder frames for some of the edges, as 'render' would leave them.
+
+The history is written with 'git fast-import', so building a flock with
+thousands of commits takes seconds. Genomes are random but well-formed, and
+the frames are empty files; only their logs and manifests are real.
+"""
+
+import os
+import json
+import time
+from subprocess import Popen, PIPE, check_call
+import numpy as np
+
+# The defaults, which are roughly those of a large flock.
+DEFAULTS = dict(commits=2000, edges=500, managed=1000, ratings=1500,
+                rendered=0.5, frames=360, profiles=('preview',), xforms=4,
+                seed=0)
+
+PROFILE = dict(width=640, height=360, duration=30, fps=24, skip=0,
+               quality=600, output=dict(format='jpeg', quality=90))
+
+# Fraction of commits which also change a dependency revision.
+DEP_CHANGES = 0.02
+
+# Written by 'create', inside .git so that it is never committed, to tell
+# synthetic flocks (which benchmarks may freely change) from real ones.
+MARKER = '.git/flockutil-synthetic'
+
+def is_synthetic(root):
+    return os.path.isfile(os.path.join(root, MARKER))
+
+def knots(rng, lo, hi):
+    return [0, round(rng.uniform(lo, hi), 4), 1, round(rng.uniform(lo, hi), 4)]
+
+def random_genome(rng, nxforms):
+    """Return a random reference genome, ready to be dumped to JSON."""
+    from cuburn.genome import palette_encode
+    from bench import VARIATIONS
+
+    xforms = {}
+    for i in range(nxforms):
+        names = rng.choice(VARIATIONS, rng.randint(1, 4), replace=False)
+        xforms[str(i)] = dict(
+            color=knots(rng, 0, 1), color_speed=0.5, opacity=1,
+            density=knots(rng, 0.1, 1),
+            affine=dict(angle=[0, rng.uniform(-180, 180),
+                               1, rng.uniform(-180, 180) - 360],
+                        spread=45 if rng.uniform() < 0.7 else -45,
+                        magnitude=dict(x=knots(rng, 0.2, 1),
+                                       y=knots(rng, 0.2, 1)),
+                        offset=dict(x=knots(rng, -1, 1),
+                                    y=knots(rng, -1, 1))),
+            variations=dict((str(n), dict(weight=knots(rng, 0, 1)))
+                            for n in names))
+    return dict(
+        camera=dict(center=dict(x=0, y=0), scale=0.25, rotation=0),
+        color=dict(brightness=4, gamma=4, palette_times=[0, '0', 1, '0']),
+        palettes=[palette_encode(rng.uniform(0, 1, (256, 4)))],
+        link=dict(left='loop', right='loop'),
+        xforms=xforms)
+
+class FastImport(object):
+    """Writes commits to a 'git fast-import' process on the current branch."""
+    def __init__(self):
+        self.proc = Popen(['git', 'fast-import', '--quiet'], stdin=PIPE)
+        self.count = 0
+        self.when = int(time.time()) - 86400 * 365
+
+    def data(self, s):
+        self.proc.stdin.write('data %d\n%s\n' % (len(s), s))
+
+    def commit(self, msg, files):
+        """Commit 'files', a dict of path to contents."""
+        self.count += 1
+        self.when += 600
+        w = self.proc.stdin.write
+        w('commit refs/heads/master\n')
+        w('committer Synthetic <synth@example.com> %d +0000\n' % self.when)
+        self.data(msg)
+        for path, contents in sorted(files.items()):
+            w('M 100644 inline %s\n' % path)
+            self.data(contents)
+        w('\n')
+
+    def close(self):
+        self.proc.stdin.close()
+        if self.proc.wait():
+            raise RuntimeError('git fast-import failed')
+
+def dumps(obj):
+    return json.dumps(obj, sort_keys=True, indent=2) + '\n'
+
+def write_history(rng, params, names):
+    """Write the history of a flock, returning the genome of each node."""
+    genomes = dict((n, random_genome(rng, params['xforms'])) for n in names)
+    path = lambda n: 'edges/%s.json' % n
+    gi = FastImport()
+    files = {'.gitignore': 'out/\n',
+             '.deps/cuburn': '0\n', '.deps/flockutil': '0\n',
+             'edges/managed.txt': "# Add edges here or use './flock "
+                                  "addEdges'.\n",
+             'ratings.txt': '# edgename revid user flags [comments]\n'}
+    for pname in params['profiles']:
+        files['profiles/%s.json' % pname] = dumps(PROFILE)
+    # Nodes arrive at random over the history, and are edited now and then
+    ncommits = max(1, params['commits'])
+    arrival = np.sort(rng.randint(0, ncommits, len(names)))
+    added = 0
+    for i in range(ncommits):
+        while added < len(names) and arrival[added] == i:
+            files[path(names[added])] = dumps(genomes[names[added]])
+            added += 1
+        if added and rng.uniform() < 0.5:
+            n = names[rng.randint(added)]
+            genomes[n]['camera']['rotation'] = round(rng.uniform(0, 360), 2)
+            files[path(n)] = dumps(genomes[n])
+        if i and rng.uniform() < DEP_CHANGES:
+            dep = '.deps/' + rng.choice(['cuburn', 'flockutil'])
+            files[dep] = '%d\n' % i
+        gi.commit('Commit %d\n' % i, files)
+        files = {}
+    gi.close()
+    return genomes
+
+def write_managed(rng, params, names):
+    lines = []
+    for i in range(params['managed'] if len(names) > 1 else 0):
+        l, r = rng.choice(len(names), 2, replace=False)
+        lines.append('%s %s' % (names[l], names[r]))
+    with open('edges/managed.txt', 'a') as fp:
+        fp.write(''.join(l + '\n' for l in lines))
+
+def write_ratings(rng, params, flock):
+    """Rate random edges, mostly at their current revisions."""
+    edges = sorted(flock.edges) + sorted(flock.managed)
+    with open('ratings.txt', 'a') as fp:
+        for i in range(params['ratings'] if edges else 0):
+            edge = edges[rng.randint(len(edges))]
+            rev = flock.find_edge(edge)[2]
+            if rng.uniform() < 0.1:
+                rev = 'old%03d' % rng.randint(1000)
+            fp.write('%s %s user%d %d\n' % (edge, rev, rng.randint(5),
+                                            rng.randint(6)))
+
+def write_outputs(rng, params, flock):
+    """Write output directories for a random share of the edges."""
+    from output import log_record
+    edges = sorted(flock.edges) + sorted(flock.managed)
+    nf = PROFILE['duration'] * PROFILE['fps']
+    for pname in params['profiles']:
+        for edge in edges:
+            if rng.uniform() >= params['rendered']:
+                continue
+            rev = flock.find_edge(edge)[2]
+            odir = os.path.join('out', pname, edge, rev)
+            os.makedirs(odir)
+            os.symlink(rev, os.path.join('out', pname, edge, 'latest'))
+            now = round(time.time(), 3)
+            recs = [log_record(name=edge, rev=rev, nf=nf, time=now,
+                               worker='synth')]
+            count = min(nf, int(params['frames'] * rng.uniform(0.5, 1.5)))
+            for idx in sorted(rng.choice(nf, count, replace=False) + 1):
+                gpu = int(rng.gamma(4, 250))
+                recs.append(log_record(idx=idx, gpu_ms=gpu, wall_ms=gpu + 5,
+                                       encode_ms=12, bytes=200000,
+                                       time=now, worker='synth'))
+                open(os.path.join(odir, '%05d.jpg' % idx), 'w').close()
+            with open(os.path.join(odir, 'log.txt'), 'w') as fp:
+                fp.write(''.join(recs))
+
+def create(root, **params):
+    """
+    Create a synthetic flock in the empty or missing directory 'root'.
+    'params' override the items of DEFAULTS. Leaves the current directory
+    unchanged.
+    """
+    params = dict(DEFAULTS, **params)
+    rng = np.random.RandomState(params['seed'])
+    names = ['node%05d' % i for i in range(params['edges'])]
+    cwd = os.getcwd()
+    if not os.path.isdir(root):
+        os.makedirs(root)
+    elif os.listdir(root):
+        raise ValueError('%s is not empty' % root)
+    os.chdir(root)
+    try:
+        with open(os.devnull, 'w') as null:
+            check_call(['git', 'init', '-q', '.'], stdout=null)
+        with open(MARKER, 'w') as fp:
+            fp.write('%s\n' % json.dumps(params, sort_keys=True))
+        write_history(rng, params, names)
+        check_call(['git', 'checkout', '-q', '-f', 'master'])
+        write_managed(rng, params, names)
+
+        # Ratings need the revisions which the flock gives each edge
+        from flock import Flock
+        write_ratings(rng, params, Flock())
+        check_call(['git', 'add', 'edges/managed.txt', 'ratings.txt'])
+        check_call(['git', '-c', 'user.name=Synthetic', '-c',
+                    'user.email=synth@example.com', 'commit', '-q', '-m',
+                    'Add managed edges and ratings'])
+        write_outputs(rng, params, Flock())
+    finally:
+        os.chdir(cwd)
+    return params
@@ -0,0 +1,123 @@
+"""
+Helpers for spreading work that needs the GPU over several threads.
+
+There is one GPU context, owned by the main thread, so work that renders is
+split up: worker threads do everything else (loading genomes, decoding and
+comparing frames, file I/O), and hand render calls to a RenderService which
+runs them one at a time on the main thread. Work that needs no GPU and is
+CPU-bound (blending, converting) is spread over a pool of processes instead.
+"""
+
+import sys
+import threading
+import traceback
+from Queue import Queue, Empty
+from multiprocessing import Pool, cpu_count
+
+class RenderService(object):
+    """Runs calls on the main thread on behalf of worker threads."""
+    def __init__(self):
+        self.queue = Queue()
+
+    def call(self, fn, *args):
+        """Run fn(*args) on the serving thread and return its result."""
+        done, box = threading.Event(), []
+        self.queue.put((fn, args, box, done))
+        done.wait()
+        result, exc = box
+        if exc:
+            raise exc[0], exc[1], exc[2]
+        return result
+
+    def serve(self, threads, poll=0.1):
+        """Run calls until all of 'threads' have exited."""
+        while any(t.is_alive() for t in threads):
+            try:
+                fn, args, box, done = self.queue.get(timeout=poll)
+            except Empty:
+                continue
+            try:
+                box[:] = fn(*args), None
+            except:
+                box[:] = None, sys.exc_info()
+            done.set()
+
+class Summary(object):
+    """A thread-safe tally of which outcome each item of work had."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outcomes = {}
+
+    def add(self, outcome, item):
+        with self.lock:
+            self.outcomes.setdefault(outcome, []).append(item)
+
+    def get(self, outcome):
+        with self.lock:
+            return list(self.outcomes.get(outcome, []))
+
+    def report(self, fmt=str):
+        with self.lock:
+            for outcome in sorted(self.outcomes):
+                items = self.outcomes[outcome]
+                print '%s (%d):' % (outcome, len(items))
+                for item in sorted(items):
+                    print '    ' + fmt(item)
+
+def run_pool(jobs, work, nthreads, service=None):
+    """
+    Call 'work' on each of 'jobs' from a pool of 'nthreads' threads. If a
+    RenderService is given, the calling thread serves it until the pool is
+    done. Exceptions are printed, and the jobs that raised them returned.
+    """
+    queue = Queue()
+    for job in jobs:
+        queue.put(job)
+    failed = []
+
+    def run():
+        while True:
+            try:
+                job = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                work(job)
+            except (Exception, SystemExit):
+                traceback.print_exc()
+                failed.append(job)
+
+    threads = [threading.Thread(target=run) for i in range(nthreads)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    if service:
+        service.serve(threads)
+    for t in threads:
+        t.join()
+    return failed
+
+def run_jobs(work, jobs, procs=None, chunksize=1):
+    """
+    Call 'work' on each job in a pool of 'procs' processes (all cores by
+    default), yielding the results as jobs complete. Jobs are sent to
+    workers 'chunksize' at a time.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return
+    procs = min(procs or cpu_count(), len(jobs))
+    if procs == 1:
+        for job in jobs:
+            yield work(job)
+        return
+    pool = Pool(procs)
+    try:
+        for result in pool.imap_unordered(work, jobs, chunksize):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
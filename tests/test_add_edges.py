@@ -0,0 +1,37 @@
+"""Tests for the checks 'addEdges' makes before choosing edges."""
+
+import sys
+import argparse
+import unittest
+from StringIO import StringIO
+
+try:
+    from flockutil.flock import Flockutil
+except ImportError:
+    Flockutil = None
+
+@unittest.skipIf(Flockutil is None, 'cuburn is not available')
+class BlendOptionsTest(unittest.TestCase):
+    def add_edges(self, *opts):
+        # A Flockutil without a flock, which fails if it gets that far
+        fu = object.__new__(Flockutil)
+        stderr, sys.stderr = sys.stderr, StringIO()
+        try:
+            fu.cmd_add_edges(argparse.Namespace(opts=list(opts)))
+        finally:
+            sys.stderr = stderr
+
+    def test_bad_options_are_rejected(self):
+        for opts in (['--', '-x'], ['-a', 'sideways'], ['-l', 'two'],
+                     ['extra']):
+            with self.assertRaises(SystemExit) as cm:
+                self.add_edges(*opts)
+            self.assertIn('Invalid blend options', str(cm.exception.code))
+
+    def test_good_options_are_accepted(self):
+        # Gets as far as the flock, which isn't there
+        self.assertRaises(AttributeError, self.add_edges, '--', '-a',
+                          'optimal', '-l', '3')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""Tests for the CPU stand-in renderer."""
+
+import unittest
+
+import numpy as np
+
+try:
+    from cuburn.genome import palette_encode
+    from flockutil.backends import CpuBackend
+except ImportError:
+    palette_encode = None
+
+def palette(value):
+    return palette_encode(np.ones((256, 4)) * value)
+
+@unittest.skipIf(palette_encode is None, 'cuburn is not available')
+class PaletteTest(unittest.TestCase):
+    def test_reference_genome(self):
+        # Reference genomes name their one palette with a bare string
+        gnm = dict(palettes=[palette(0.25)], color=dict(palette_times='0'))
+        pal = CpuBackend.palette(gnm, 0.5)
+        self.assertEqual(pal.shape, (256, 3))
+        self.assertTrue(np.allclose(pal, 0.25, atol=0.01))
+
+    def test_no_palette_times(self):
+        gnm = dict(palettes=[palette(0.25)])
+        self.assertTrue(np.allclose(CpuBackend.palette(gnm, 0), 0.25,
+                                    atol=0.01))
+
+    def test_single_knot(self):
+        gnm = dict(palettes=[palette(0), palette(0.5)],
+                   color=dict(palette_times=[0, '1']))
+        self.assertTrue(np.allclose(CpuBackend.palette(gnm, 0.7), 0.5,
+                                    atol=0.01))
+
+    def test_blend(self):
+        gnm = dict(palettes=[palette(0), palette(0.5)],
+                   color=dict(palette_times=[0, '0', 1, '1']))
+        self.assertTrue(np.allclose(CpuBackend.palette(gnm, 0.5), 0.25,
+                                    atol=0.01))
+        self.assertTrue(np.allclose(CpuBackend.palette(gnm, 1), 0.5,
+                                    atol=0.01))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Tests for streaming frames to a video encoder."""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from flockutil import encode
+from flockutil.encode import VideoEncoder, EncodeError
+
+# Stand-in encoders. Commands are filled in with str.format, so no braces.
+COPY = ('%s -c "import sys; open(sys.argv[1], \'wb\').write(sys.stdin.read())"'
+        ' {out}' % sys.executable)
+FAIL = '%s -c "import sys; sys.stdin.read(); sys.exit(3)"' % sys.executable
+QUIT = '%s -c "import sys; sys.exit(3)"' % sys.executable
+
+class VideoEncoderTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.out = os.path.join(self.dir, 'out.raw')
+        rng = np.random.RandomState(0)
+        self.frames = [rng.randint(0, 256, (6, 10, 3)).astype(np.uint8)
+                       for i in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_frames_in_order(self):
+        enc = VideoEncoder(self.out, 10, 6, 24, COPY)
+        for frame in self.frames:
+            enc.write(frame)
+        enc.close()
+        self.assertEqual(enc.frames, 5)
+        self.assertEqual(enc.bytes, 5 * 6 * 10 * 3)
+        with open(self.out, 'rb') as fp:
+            data = fp.read()
+        self.assertEqual(data, ''.join(f.tostring() for f in self.frames))
+
+    def test_wrong_shape(self):
+        enc = VideoEncoder(self.out, 10, 6, 24, COPY)
+        self.assertRaises(EncodeError, enc.write, self.frames[0][:5])
+        enc.close()
+        self.assertEqual(enc.frames, 0)
+
+    def test_encoder_fails(self):
+        enc = VideoEncoder(self.out, 10, 6, 24, FAIL)
+        enc.write(self.frames[0])
+        self.assertRaises(EncodeError, enc.close)
+
+    def test_encoder_exits_early(self):
+        enc = VideoEncoder(self.out, 1000, 1000, 24, QUIT)
+        frame = np.zeros((1000, 1000, 3), np.uint8)
+        # Enough data to fill the pipe once the encoder has gone
+        with self.assertRaises(EncodeError):
+            for i in range(20):
+                enc.write(frame)
+
+class PrefetchTest(unittest.TestCase):
+    def test_order(self):
+        # Later items load faster, so they finish first on the pool
+        load = lambda i: time.sleep((10 - i) * 0.002) or i * i
+        self.assertEqual(list(encode.prefetch(range(10), load, 4, 3)),
+                         [i * i for i in range(10)])
+
+    def test_error(self):
+        def load(i):
+            if i == 3:
+                raise ValueError(i)
+            return i
+        out = encode.prefetch(range(10), load, 2)
+        self.assertEqual([next(out) for i in range(3)], [0, 1, 2])
+        self.assertRaises(ValueError, next, out)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+Tests for the render farm's frame queue, and for a server and host talking
+over a loopback socket with a stub renderer.
+"""
+
+import socket
+import threading
+import unittest
+
+from flockutil import farm
+
+TASKS = [('a', 'r1', i) for i in range(1, 5)] + [('b', 'r2', 1)]
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.
+    def __call__(self):
+        return self.now
+
+class FrameQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.queue = farm.FrameQueue(TASKS, lease_time=10, clock=self.clock)
+
+    def test_lease_batches_by_edge(self):
+        self.assertEqual(self.queue.lease('w', 8), TASKS[:4])
+        self.assertEqual(self.queue.lease('w', 8), TASKS[4:])
+        self.assertEqual(self.queue.lease('w', 8), [])
+        self.assertFalse(self.queue.finished.is_set())
+
+    def test_expired_lease_is_requeued(self):
+        self.queue.lease('slow', 2)
+        self.clock.now = 11
+        self.assertEqual(self.queue.lease('fast', 2), TASKS[:2])
+
+    def test_late_completion_finishes(self):
+        first = self.queue.lease('slow', 2)
+        self.clock.now = 11
+        # The expired tasks go back to the front of the queue, and the rest
+        # are rendered elsewhere
+        while True:
+            tasks = self.queue.lease('fast', 8)
+            tasks = [t for t in tasks if t not in first]
+            if not tasks:
+                break
+            self.queue.complete('fast', [farm.FrameQueue.key(t)
+                                         for t in tasks])
+        self.assertFalse(self.queue.finished.is_set())
+        # The slow host reports after all, with its tasks leased again
+        self.queue.complete('slow', [farm.FrameQueue.key(t) for t in first])
+        self.assertTrue(self.queue.finished.is_set())
+        self.assertEqual(self.queue.status()['done'], len(TASKS))
+
+    def test_requeued_done_tasks_are_skipped(self):
+        first = self.queue.lease('slow', 2)
+        self.clock.now = 11
+        self.queue._requeue()
+        self.queue.complete('slow', [farm.FrameQueue.key(t) for t in first])
+        self.assertEqual(self.queue.lease('fast', 8), TASKS[2:4])
+
+    def test_empty_queue_is_finished(self):
+        self.assertTrue(farm.FrameQueue([]).finished.is_set())
+
+class FlakyClient(object):
+    """Serves TASKS one at a time, failing the requests listed in 'fail'."""
+    def __init__(self, fail=()):
+        self.queue = farm.FrameQueue(TASKS)
+        self.fail, self.calls = list(fail), []
+
+    def request(self, op, *args):
+        self.calls.append(op)
+        if self.fail and self.fail[0] == len(self.calls):
+            self.fail.pop(0)
+            raise socket.error('Connection refused')
+        return getattr(self, '_' + op)(*args)
+
+    def lease(self, worker, count=1):
+        return self.request('lease', worker, count)
+
+    def complete(self, worker, keys):
+        return self.request('complete', worker, keys)
+
+    def _lease(self, worker, count):
+        return dict(tasks=self.queue.lease(worker, count),
+                    finished=self.queue.finished.is_set())
+
+    def _complete(self, worker, keys):
+        self.queue.complete(worker, keys)
+        return dict(ok=True)
+
+class RunHostTest(unittest.TestCase):
+    def run_host(self, client):
+        self.sleeps = []
+        render = lambda resp: [farm.FrameQueue.key(t) for t in resp['tasks']]
+        farm.run_host(client, 'h', render, 1, sleep=self.sleeps.append,
+                      backoff=(1, 2, 4))
+
+    def test_transient_errors_are_retried(self):
+        # Fail the first lease, and both tries at reporting the first frame
+        client = FlakyClient([1, 3, 4])
+        self.run_host(client)
+        self.assertTrue(client.queue.finished.is_set())
+        self.assertEqual(client.calls[:6], ['lease', 'lease', 'complete',
+                                            'complete', 'complete', 'lease'])
+        self.assertEqual(self.sleeps, [1, 1, 2])
+
+    def test_gives_up_in_the_end(self):
+        client = FlakyClient([3, 4, 5, 6])
+        self.assertRaises(socket.error, self.run_host, client)
+        self.assertEqual(self.sleeps, [1, 2, 4])
+        self.assertFalse(client.queue.finished.is_set())
+
+class LoopbackTest(unittest.TestCase):
+    def test_hosts_render_everything(self):
+        queue = farm.FrameQueue(TASKS, lease_time=0.2)
+        server = farm.FarmServer(('127.0.0.1', 0), queue, dict(profile='p'))
+        client = farm.FarmClient(server.server_address)
+        rendered, lock = [], threading.Lock()
+        stalled = []
+
+        def render(resp):
+            self.assertEqual(resp['profile'], 'p')
+            keys = [farm.FrameQueue.key(t) for t in resp['tasks']]
+            if not stalled:
+                # Stall past the lease on the first batch, as a stub for a
+                # slow renderer, so that it is handed out again
+                stalled.append(keys)
+                threading.Event().wait(0.5)
+            with lock:
+                rendered.extend(keys)
+            return keys
+
+        hosts = [threading.Thread(target=farm.run_host,
+                                  args=(client, 'h%d' % i, render, 2, 0.05))
+                 for i in range(2)]
+        for h in hosts:
+            h.daemon = True
+            h.start()
+        done = threading.Thread(target=server.serve_until_finished,
+                                kwargs=dict(poll=0.05, linger=0.5))
+        done.daemon = True
+        done.start()
+        done.join(10)
+        self.assertFalse(done.is_alive(), 'Server did not finish')
+        for h in hosts:
+            h.join(10)
+            self.assertFalse(h.is_alive(), 'Host did not exit')
+        self.assertEqual(set(rendered), set(map(farm.FrameQueue.key, TASKS)))
+
+if __name__ == '__main__':
+    unittest.main()
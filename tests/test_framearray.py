@@ -0,0 +1,123 @@
+"""Tests for frame array files, as written by the raw output formats."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from flockutil import framearray
+from flockutil.framearray import FrameArray, ArrayEncoder
+
+class FrameArrayTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, framearray.NAME)
+        rng = np.random.RandomState(0)
+        self.bufs = [rng.uniform(0, 1, (4, 6, 3)).astype(np.float32)
+                     for i in range(4)]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, dtype, idxs):
+        framearray.create(self.path, (4, 6, 3), dtype)
+        frames = {}
+        for i in idxs:
+            buf = self.bufs[i - 1]
+            if dtype == 'uint8':
+                buf = buf * 255 + 0.5
+            frames[i] = buf.astype(dtype)
+            framearray.write_frame(self.path, i, frames[i])
+        return frames
+
+    def test_uint8_round_trip(self):
+        frames = self.write('uint8', [3, 1, 2])
+        arr = FrameArray(self.path)
+        self.assertEqual(len(arr), 3)
+        self.assertEqual(arr.dtype, np.uint8)
+        for i, frame in frames.items():
+            self.assertTrue(np.array_equal(arr[i], frame))
+            self.assertTrue(np.array_equal(arr.rgb8(i), frame))
+            self.assertTrue(np.allclose(arr.rgb(i), frame / 255.))
+
+    def test_float16_round_trip(self):
+        frames = self.write('float16', [2, 1])
+        arr = FrameArray(self.path)
+        self.assertEqual(arr.dtype, np.float16)
+        for i, frame in frames.items():
+            self.assertTrue(np.array_equal(arr[i], frame))
+            self.assertEqual(arr.rgb(i).dtype, np.float32)
+            self.assertTrue(np.allclose(arr.rgb(i), self.bufs[i - 1],
+                                        atol=1e-3))
+            err = arr.rgb8(i).astype(int) - self.bufs[i - 1] * 255
+            # Half a step for rounding, plus float16's own error
+            self.assertTrue(np.all(abs(err) <= 0.8))
+
+    def test_float16_is_clipped(self):
+        framearray.create(self.path, (4, 6, 3), 'float16')
+        framearray.write_frame(self.path, 1,
+                               np.full((4, 6, 3), 1.5, np.float16))
+        framearray.write_frame(self.path, 2,
+                               np.full((4, 6, 3), -0.5, np.float16))
+        arr = FrameArray(self.path)
+        self.assertTrue(np.all(arr.rgb8(1) == 255))
+        self.assertTrue(np.all(arr.rgb(1) == 1))
+        self.assertTrue(np.all(arr.rgb8(2) == 0))
+        self.assertTrue(np.all(arr.rgb(2) == 0))
+
+    def test_sparse(self):
+        frames = self.write('uint8', [4])
+        arr = FrameArray(self.path)
+        self.assertEqual(len(arr), 4)
+        self.assertTrue(np.array_equal(arr[4], frames[4]))
+        # Slots never written read as black
+        self.assertTrue(np.all(arr[2] == 0))
+
+    def test_index_out_of_range(self):
+        self.write('uint8', [1, 2])
+        arr = FrameArray(self.path)
+        self.assertRaises(IndexError, arr.__getitem__, 0)
+        self.assertRaises(IndexError, arr.__getitem__, 3)
+        self.assertRaises(IndexError, arr.rgb8, 3)
+        # Frames written after opening need a new FrameArray
+        self.write('uint8', [3])
+        self.assertRaises(IndexError, arr.rgb, 3)
+        self.assertEqual(len(FrameArray(self.path)), 3)
+
+    def test_empty(self):
+        framearray.create(self.path, (4, 6, 3), 'uint8')
+        arr = FrameArray(self.path)
+        self.assertEqual(len(arr), 0)
+        self.assertRaises(IndexError, arr.__getitem__, 1)
+
+    def test_create_keeps_existing(self):
+        frames = self.write('uint8', [1])
+        framearray.create(self.path, (4, 6, 3), 'uint8')
+        self.assertTrue(np.array_equal(FrameArray(self.path)[1], frames[1]))
+
+    def test_create_refuses_mismatch(self):
+        framearray.create(self.path, (4, 6, 3), 'uint8')
+        self.assertRaises(ValueError, framearray.create, self.path,
+                          (4, 6, 3), 'float16')
+        self.assertRaises(ValueError, framearray.create, self.path,
+                          (4, 8, 3), 'uint8')
+
+    def test_not_an_array(self):
+        with open(self.path, 'w') as fp:
+            fp.write('{"magic": "something else"}')
+        self.assertRaises(ValueError, FrameArray, self.path)
+
+    def test_encoder(self):
+        enc = ArrayEncoder('raw16')
+        rgba = np.dstack([self.bufs[0], np.ones((4, 6))]).astype(np.float32)
+        self.assertEqual(enc(self.path, rgba, 2), 4 * 6 * 3 * 2)
+        enc = ArrayEncoder('raw')
+        self.assertRaises(ValueError, enc, self.path, rgba, 1)
+        arr = FrameArray(self.path)
+        self.assertTrue(np.array_equal(arr[2],
+                                       self.bufs[0].astype(np.float16)))
+
+if __name__ == '__main__':
+    unittest.main()
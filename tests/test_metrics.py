@@ -0,0 +1,71 @@
+"""Tests for the frame difference metrics."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from flockutil import metrics
+from flockutil.output import FrameEncoder
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        y, x = np.mgrid[0:32, 0:48] / 48.
+        self.frame = np.dstack([x, y, (x + y) / 2]).astype(np.float32)
+        self.noise = rng.uniform(-1, 1, self.frame.shape).astype(np.float32)
+
+    def noisy(self, level):
+        return np.clip(self.frame + level * self.noise, 0, 1)
+
+    def test_identical(self):
+        a = np.array([self.frame, self.noisy(0.1)])
+        self.assertTrue(np.allclose(metrics.ssim(a, a), 0, atol=1e-6))
+        self.assertTrue(np.all(metrics.rmse(a, a) == 0))
+
+    def test_ordered_by_noise(self):
+        levels = [0.01, 0.05, 0.1, 0.3]
+        a = np.array([self.frame] * len(levels))
+        b = np.array([self.noisy(l) for l in levels])
+        for fn in (metrics.ssim, metrics.rmse):
+            d = fn(a, b)
+            self.assertEqual(d.shape, (len(levels),))
+            self.assertTrue(np.all(np.diff(d) > 0), (fn.__name__, d))
+            self.assertTrue(np.all((d > 0) & (d <= 1)))
+
+    def test_rmse_value(self):
+        a = np.zeros((1, 4, 4, 3), np.float32)
+        self.assertTrue(np.allclose(metrics.rmse(a, a + 0.25), 0.25))
+
+    def test_compare(self):
+        pairs = [(0, 0), (0, 0.1), (0.3, 0), (0.05, 0.05)]
+        load = self.noisy
+        for metric, fn in (('ssim', metrics.ssim), ('rmse', metrics.rmse)):
+            # Batches smaller than the list give the same results
+            got = metrics.compare(pairs, metric, batch=3, load=load)
+            want = fn(np.array([load(p) for p, q in pairs]),
+                      np.array([load(q) for p, q in pairs]))
+            self.assertTrue(np.allclose(got, want))
+            self.assertEqual(got[0], got[3])
+            self.assertTrue(got[2] > got[1] > got[0])
+
+    def test_compare_sizes_differ(self):
+        load = lambda n: np.zeros((n, 4, 3), np.float32)
+        self.assertRaises(ValueError, metrics.compare, [(4, 5)], 'rmse',
+                          load=load)
+
+    def test_load_frame(self):
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, '00001.png')
+            FrameEncoder('png')(path, self.frame)
+            frame = metrics.load_frame(path)
+        finally:
+            shutil.rmtree(dir)
+        self.assertEqual(frame.dtype, np.float32)
+        self.assertTrue(np.abs(frame - self.frame).max() <= 0.5 / 255 + 1e-6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Tests for frame encoding and writing."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from flockutil.output import FrameEncoder, FrameManifest, log_record
+
+class FrameEncoderTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_linked_frames_are_replaced(self):
+        # Frames in output directories may be hard links into the frame
+        # store; writing a new frame must not change the stored one
+        enc = FrameEncoder()
+        path = os.path.join(self.dir, '00001.jpg')
+        stored = os.path.join(self.dir, 'stored.jpg')
+        enc(path, np.zeros((8, 8, 3), np.float32))
+        os.link(path, stored)
+        with open(stored, 'rb') as fp:
+            before = fp.read()
+        enc(path, np.ones((8, 8, 3), np.float32))
+        with open(stored, 'rb') as fp:
+            self.assertEqual(fp.read(), before)
+        with open(path, 'rb') as fp:
+            self.assertNotEqual(fp.read(), before)
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['00001.jpg', 'stored.jpg'])
+
+class FrameManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log(1, 2, 4)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def log(self, *idxs):
+        with open(os.path.join(self.dir, 'log.txt'), 'a') as fp:
+            fp.write(''.join(log_record(idx=i) for i in idxs))
+
+    def test_missing_reads_log_only_for_frames_to_render(self):
+        man = FrameManifest.load(self.dir, save=False)
+        reads = []
+        catch_up = man.catch_up
+        def counted():
+            reads.append(1)
+            return catch_up()
+        man.catch_up = counted
+        rt = [(i, i / 10.) for i in range(1, 7)]
+        out = []
+        for r in man.missing(rt):
+            out.append(r)
+            if r[0] == 3:
+                # Another render of the same directory writes frame 5
+                self.log(5)
+        self.assertEqual([r[0] for r in out], [3, 6])
+        # Once up front, and once before each of frames 3, 5 and 6
+        self.assertEqual(len(reads), 4)
+
+if __name__ == '__main__':
+    unittest.main()
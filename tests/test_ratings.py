@@ -0,0 +1,126 @@
+"""Tests for the index of ratings.txt."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from flockutil.ratings import RatingIndex
+
+class RatingIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'ratings.txt')
+        self.revs = dict(a='r2', b='r1', c='r1')
+        self.write('# edgename revid user flags [comments]\n', 'w')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, data, mode='a'):
+        with open(self.path, mode) as fp:
+            fp.write(data)
+
+    def index(self):
+        idx = RatingIndex(self.revs.__getitem__, self.path)
+        idx.updated = []
+        update = idx.update
+        def record(edge):
+            idx.updated.append(edge)
+            update(edge)
+        idx.update = record
+        return idx
+
+    def test_effective_rating(self):
+        self.write('a r1 u1 1\n'
+                   'a r2 u1 4 nice\n'
+                   'a r2 u2 5f\n'
+                   'b r0 u1 2  # an old revision\n'
+                   'b r0 u2 3\n'
+                   'c r1 u1 x\n'
+                   'short line\n')
+        idx = self.index()
+        # Ratings of the current revision only, where there are any
+        self.assertEqual(idx.get('a'), 4.5)
+        # Otherwise all of them
+        self.assertEqual(idx.get('b'), 2.5)
+        # Lines without a valid rating are ignored
+        self.assertEqual(idx.get('c'), None)
+        self.assertEqual(idx.get('c', 2.5), 2.5)
+        self.assertEqual(sorted(idx), ['a', 'b'])
+        self.assertEqual(idx['a']['r2']['u2'], (5, 'f'))
+        self.assertEqual(list(idx.best()), [('a', 4.5), ('b', 2.5)])
+
+    def test_edge_removed(self):
+        self.write('gone r1 u1 3\n')
+        del self.revs['a']
+        idx = self.index()
+        self.assertEqual(idx.get('gone'), 3)
+
+    def test_first_rating_counts(self):
+        self.write('a r2 u1 1\n'
+                   'a r2 u1 5\n'
+                   'a r2 u2 3\n')
+        self.assertEqual(self.index().get('a'), 2)
+
+    def test_refresh_reads_only_new_lines(self):
+        self.write('a r2 u1 4\nb r1 u1 2\n')
+        idx = self.index()
+        self.assertFalse(idx.refresh())
+        self.write('b r1 u2 4\nc r1 u1 5\n')
+        self.assertTrue(idx.refresh())
+        self.assertEqual(sorted(idx.updated), ['b', 'c'])
+        self.assertEqual(idx.get('a'), 4)
+        self.assertEqual(idx.get('b'), 3)
+        self.assertEqual(list(idx.best()), [('c', 5), ('a', 4), ('b', 3)])
+        # A repeated rating changes nothing
+        idx.updated = []
+        self.write('b r1 u2 0\n')
+        self.assertTrue(idx.refresh())
+        self.assertEqual(idx.updated, [])
+        self.assertEqual(idx.get('b'), 3)
+
+    def test_partial_line(self):
+        self.write('a r2 u1 4\nb r1 u1 3')
+        idx = self.index()
+        self.assertEqual(idx.get('b'), 3)
+        # The rest of the last line arrives; it is read again from the start
+        self.write(' comment\nb r1 u2 1\n')
+        self.assertTrue(idx.refresh())
+        self.assertEqual(idx.get('b'), 2)
+        self.assertEqual(idx['b']['r1']['u1'], (3, ''))
+        self.assertEqual(len(idx.ranked), 2)
+
+    def test_shrunk_file(self):
+        self.write('a r2 u1 4\nb r1 u1 3\n')
+        idx = self.index()
+        self.write('b r1 u1 1\n', 'w')
+        self.assertTrue(idx.refresh())
+        self.assertEqual(sorted(idx), ['b'])
+        self.assertEqual(idx.get('a'), None)
+        self.assertEqual(idx.get('b'), 1)
+        self.assertEqual(list(idx.best()), [('b', 1)])
+
+    def test_missing_file(self):
+        os.unlink(self.path)
+        idx = self.index()
+        self.assertEqual(len(idx), 0)
+        self.assertFalse(idx.refresh())
+
+    def test_at_least(self):
+        self.revs.update(d='r1', e='r1')
+        self.write('a r2 u1 3\n'
+                   'b r1 u1 4\n'
+                   'c r1 u1 3\n'
+                   'd r1 u1 2\n'
+                   'd r1 u2 3\n'
+                   'e r1 u1 1\n')
+        idx = self.index()
+        # Ties with the threshold are included, best first, then by name
+        self.assertEqual(idx.at_least(3), ['b', 'a', 'c'])
+        self.assertEqual(idx.at_least(2.5), ['b', 'a', 'c', 'd'])
+        self.assertEqual(idx.at_least(5), [])
+        self.assertEqual(idx.at_least(0), ['b', 'a', 'c', 'd', 'e'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Tests for the orderings of render work."""
+
+import os
+import shutil
+import argparse
+import tempfile
+import unittest
+
+from flockutil import schedule
+from flockutil.schedule import EdgePlan, order_frames
+from flockutil.output import log_record
+
+try:
+    from flockutil.flock import Flockutil
+except ImportError:
+    Flockutil = None
+
+def plan(edge, n, cost, stride=1):
+    rt = [(i, None) for i in range(1, n * stride + 1, stride)]
+    return EdgePlan(edge, rt, stride, [dict(gpu_ms=cost)])
+
+class OrderFramesTest(unittest.TestCase):
+    def test_empty(self):
+        for order in ('linear', 'progressive', 'motion'):
+            self.assertEqual(order_frames([], order, []), [])
+
+    def test_motion_is_a_permutation(self):
+        rt = [(i, i / 10.) for i in range(1, 11)]
+        out = order_frames(rt, 'motion', [0] * 5 + [1] * 5)
+        self.assertEqual(sorted(out), rt)
+
+class OrderTest(unittest.TestCase):
+    def test_complete(self):
+        # Remaining work is 100, 60, 90 and 0 (nothing left) ms
+        plans = [plan('a', 10, 10), plan('b', 2, 30), plan('c', 9, 10),
+                 plan('d', 0, 1)]
+        out = list(schedule.order(plans, 'complete'))
+        self.assertEqual([e for e, rt in out], ['b', 'c', 'a'])
+        self.assertEqual(out[0][1], plans[1].rt)
+
+    def test_complete_fills_unknown_costs(self):
+        plans = [plan('a', 10, 10), plan('b', 10, 30),
+                 EdgePlan('c', [(1, None)])]
+        out = [e for e, rt in schedule.order(plans, 'complete')]
+        # 'c' costs the median of the others, for one frame
+        self.assertEqual(out, ['c', 'a', 'b'])
+
+    def test_coverage(self):
+        # Positions 0 to 8 of 'a', with a stride of two, and 0 to 4 of 'b'
+        plans = [plan('a', 9, 20, 2), plan('b', 5, 10)]
+        out = [(e, [r[0] for r in rt])
+               for e, rt in schedule.order(plans, 'coverage')]
+        # Each level halves the spacing of the frames of each edge, and
+        # cheaper edges go first within a level
+        self.assertEqual(out, [('b', [1]), ('a', [1]),
+                               ('a', [17]),
+                               ('b', [5]), ('a', [9]),
+                               ('b', [3]), ('a', [5, 13]),
+                               ('b', [2, 4]), ('a', [3, 7, 11, 15])])
+        levels = [plans[e == 'b'].level(rt[0]) for e, rt in out]
+        self.assertEqual(levels, sorted(levels))
+
+@unittest.skipIf(Flockutil is None, 'cuburn is not available')
+class ScheduledWorkTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd, self.root = os.getcwd(), tempfile.mkdtemp()
+        os.chdir(self.root)
+        self.fu = object.__new__(Flockutil)
+        self.fu.flock = argparse.Namespace(
+                find_edge=lambda edge: (edge, None, 'r' + edge, False))
+        self.prepared = []
+        self.fu.prepare_edge = self.prepare_edge
+        # Edge 'a' has 4 of 8 frames, at 10 ms each; 'b' 6 of 8, at 30 ms
+        for edge, done, cost in (('a', 4, 10), ('b', 6, 30)):
+            odir = os.path.join('out', 'p', edge, 'r' + edge)
+            os.makedirs(odir)
+            with open(os.path.join(odir, 'log.txt'), 'w') as fp:
+                fp.write(log_record(name=edge, rev='r' + edge, nf=8))
+                for i in range(1, done + 1):
+                    fp.write(log_record(idx=i, gpu_ms=cost))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root)
+
+    def prepare_edge(self, pname, prof, edge):
+        self.prepared.append(edge)
+        rt = [(i, i / 8.) for i in range(1, 9)]
+        return 'genome ' + edge, 'r' + edge, 'out/p/%s/r%s' % (edge, edge), rt
+
+    def test_edges_prepared_as_reached(self):
+        args = argparse.Namespace(profile='p', schedule='complete')
+        work = self.fu.scheduled_work(args, ['a', 'b'], dict(skip=0))
+        # Planning reads logs only
+        edge, gnm, rev, odir, rt = next(work)
+        self.assertEqual(self.prepared, ['a'])
+        self.assertEqual((edge, gnm, rt), ('a', 'genome a',
+                         [(i, i / 8.) for i in range(5, 9)]))
+        edge, gnm, rev, odir, rt = next(work)
+        self.assertEqual(self.prepared, ['a', 'b'])
+        self.assertEqual([r[0] for r in rt], [7, 8])
+        self.assertRaises(StopIteration, next, work)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""Tests for the keys of the content-addressed frame store."""
+
+import copy
+import unittest
+
+try:
+    from cuburn.genome import SplEval
+    from flockutil.store import FrameStore
+except ImportError:
+    FrameStore = None
+
+def genome():
+    return dict(info=dict(name='a=b'), link=dict(left='a', right='b'),
+                color=dict(palette_times='0'),
+                xforms={'0': dict(density=SplEval([0, 0.5, 1, 0.7]),
+                                  color=SplEval([0, 0.1, 1, 0.9]))})
+
+@unittest.skipIf(FrameStore is None, 'cuburn is not available')
+class FrameStoreKeyTest(unittest.TestCase):
+    def setUp(self):
+        self.store = FrameStore(dict(width=64), dict(cuburn='abc'), 'jpg')
+
+    def key(self, gnm, t=0.25):
+        return self.store.key(gnm, t)
+
+    def test_metadata_is_ignored(self):
+        gnm = genome()
+        other = copy.deepcopy(gnm)
+        other['info']['name'] = 'c=d'
+        other['link'] = dict(left='c', right='d')
+        self.assertEqual(self.key(gnm), self.key(other))
+
+    def test_frame_inputs_change_the_key(self):
+        gnm = genome()
+        changed = genome()
+        changed['xforms']['0']['color'] = SplEval([0, 0.1, 1, 0.8])
+        self.assertNotEqual(self.key(gnm), self.key(changed))
+        other = genome()
+        other['color']['palette_times'] = '1'
+        self.assertNotEqual(self.key(gnm), self.key(other))
+        self.assertNotEqual(self.key(gnm, 0.25), self.key(gnm, 0.5))
+
+    def test_key_of_a_span(self):
+        gnm = genome()
+        keys = [self.key(gnm, t) for t in ((0.2, 0.3), 0.25, (0.2, 0.3))]
+        self.assertEqual(keys[0], keys[2])
+        self.assertNotEqual(keys[0], keys[1])
+
+if __name__ == '__main__':
+    unittest.main()
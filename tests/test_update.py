@@ -0,0 +1,111 @@
+"""Tests for the frame comparisons behind 'update'."""
+
+import os
+import shutil
+import argparse
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    from flockutil.flock import Flockutil
+except ImportError:
+    Flockutil = None
+
+from flockutil.output import FrameEncoder
+from flockutil.workers import Summary
+
+@unittest.skipIf(Flockutil is None, 'cuburn is not available')
+class CompareFramesTest(unittest.TestCase):
+    def setUp(self):
+        self.dirs = [tempfile.mkdtemp() for i in range(2)]
+        # A Flockutil without a flock; comparing frames needs neither
+        self.fu = object.__new__(Flockutil)
+        enc = FrameEncoder()
+        rng = np.random.RandomState(0)
+        self.rt = [(i, i / 10.) for i in (1, 2, 3)]
+        for i, t in self.rt:
+            buf = rng.uniform(0, 1, (32, 48, 3)).astype(np.float32)
+            for d in self.dirs:
+                enc(self.fu.topath(d, i, 'jpg'), buf)
+
+    def tearDown(self):
+        for d in self.dirs:
+            shutil.rmtree(d)
+
+    def compare(self, thresh):
+        return dict(self.fu.compare_frames(self.dirs[0], self.dirs[1],
+                                           self.rt, 'ssim', 'jpg',
+                                           lambda msg: None, thresh))
+
+    def test_identical_frames(self):
+        self.assertEqual(self.compare(0), {})
+        diffs = self.compare(None)
+        self.assertEqual(sorted(diffs), self.rt)
+        self.assertTrue(all(abs(v) < 1e-6 for v in diffs.values()))
+
+    def test_relative_diff_of_identical_renders(self):
+        # The new renders match each other exactly, so any difference from
+        # the old render is far beyond the renderer's own noise
+        retry = dict((r, 0.05) for r in self.rt)
+        hi = Flockutil.relative_diff(retry, self.compare(None))
+        self.assertTrue(hi > 1e6)
+        self.assertEqual(Flockutil.relative_diff(retry, {}), hi)
+
+class NoisyBackend(object):
+    """Renders the same image with fresh noise every time, as cuburn does."""
+    name = device = 'cpu'
+
+    def __init__(self):
+        self.rng = np.random.RandomState(1)
+
+    def render(self, gnm, rt, width, height):
+        from flockutil.backends import RenderOutput
+        base = np.linspace(0, 1, height * width * 3).reshape(height, width, 3)
+        for idx, t in rt:
+            noise = self.rng.uniform(-0.05, 0.05, base.shape)
+            yield RenderOutput(idx, (base + noise).astype(np.float32), 0)
+
+class Genome(dict):
+    def set_profile(self, prof):
+        return None, [i / 100. for i in range(100)]
+
+class Service(object):
+    def call(self, fn, *args):
+        return fn(*args)
+
+@unittest.skipIf(Flockutil is None, 'cuburn is not available')
+class CheckUpdateTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd, self.root = os.getcwd(), tempfile.mkdtemp()
+        os.chdir(self.root)
+        self.fu = object.__new__(Flockutil)
+        self.fu.info = dict(worker='test', revs=dict(cuburn='abc'))
+        self.fu._backend, self.fu._backends = None, {'cpu': NoisyBackend()}
+        self.fu.load_edge = lambda edge: (Genome(), edge, 'new')
+        self.prof = dict(width=16, height=8, skip=0, backend='cpu',
+                         output=dict(format='png'))
+        self.ldir = os.path.join(self.root, 'out', 'p', 'edge', 'old')
+        os.makedirs(self.ldir)
+        # As an older renderer would have, so the store can't match them
+        self.fu.render_frames(self.ldir, Genome(), self.prof,
+                              [(i, i / 100.) for i in range(1, 101)], False)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.root)
+
+    def test_noise_passes_relative_threshold(self):
+        # Every frame differs from the old render by the renderer's noise
+        # alone, so only the relative threshold can pass the edge
+        args = argparse.Namespace(metric='rmse', diff=1e-4, reldiff=2,
+                                  nframes=3)
+        summary = Summary()
+        self.fu.check_update(args, Service(), summary, 'p', self.prof,
+                             'edge', self.ldir, range(1, 101))
+        self.assertEqual(summary.get('Linked'), [('p', 'edge')])
+        self.assertTrue(os.path.islink('out/p/edge/new'))
+
+if __name__ == '__main__':
+    unittest.main()